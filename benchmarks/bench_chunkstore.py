@@ -0,0 +1,138 @@
+#!/bin/env python3
+"""
+Storage and write volume of a chunk store on a synthetic, mutated dataset.
+
+Writes a set of base files ("images"), then several versions of each with
+random overwrites, insertions and deletions, adds every version to a chunk
+store and compares the bytes written with encrypting each version as its
+own .age file. Uses a software X25519 key, no YubiKey.
+
+    python3 benchmarks/bench_chunkstore.py --files 4 --size 32MB --versions 5 --edits 5
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import chunkstore  # noqa: E402
+from engine import select_engine  # noqa: E402
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def mutate(data: bytes, edits: int, rng: random.Random) -> bytes:
+    """Applies random small overwrites, insertions and deletions."""
+    data = bytearray(data)
+    for _ in range(edits):
+        position = rng.randrange(len(data))
+        length = rng.randint(1, 4096)
+        kind = rng.choice(("overwrite", "insert", "delete"))
+        if kind == "overwrite":
+            data[position:position + length] = rng.randbytes(length)[:len(data) - position]
+        elif kind == "insert":
+            data[position:position] = rng.randbytes(length)
+        else:
+            del data[position:position + length]
+    return bytes(data)
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4, help="base files (default: 4)")
+    parser.add_argument("--size", default="32MB", help="size of each base file (default: 32MB)")
+    parser.add_argument("--versions", type=int, default=5, help="versions per file (default: 5)")
+    parser.add_argument("--edits", type=int, default=5, help="random edits per version (default: 5)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="encryption workers")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    engine = select_engine("age")
+    identity, recipient = engine.generate_identity()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        chunkstore.KEYS_CACHE = os.path.join(tmp, "keys")
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        versions = []
+        for n in range(args.files):
+            data = rng.randbytes(parse_size(args.size))
+            for v in range(args.versions):
+                path = os.path.join(data_dir, f"image{n}.v{v}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                versions.append(path)
+                data = mutate(data, args.edits, rng)
+        total = sum(os.path.getsize(path) for path in versions)
+
+        start = time.perf_counter()
+        plain = 0
+        for path in versions:
+            engine.encrypt_file(path, f"{path}.age", [recipient])
+            plain += os.path.getsize(f"{path}.age")
+            os.remove(f"{path}.age")
+        plain_time = time.perf_counter() - start
+
+        store = chunkstore.ChunkStore.create(os.path.join(tmp, "bench.ycc"), [recipient], engine)
+        start = time.perf_counter()
+        chunks = new_chunks = 0
+        for path in versions:
+            stats = store.add_file(path, os.path.relpath(path, tmp), args.workers)
+            chunks += stats["chunks"]
+            new_chunks += stats["new_chunks"]
+        store_time = time.perf_counter() - start
+        stored = directory_size(store.path)
+
+        # Spot check: the last version comes back intact
+        identity_file = os.path.join(tmp, "identity.txt")
+        Path(identity_file).write_text(f"{identity}\n")
+        store_identity = store.unwrap(identity_file)
+        manifests = store.read_manifests(store_identity)
+        last = next(e for e in manifests.values() if e["path"] == os.path.relpath(versions[-1], tmp))
+        store.restore_entry(last, os.path.join(tmp, "restored"), store_identity, args.workers)
+        if Path(tmp, "restored").read_bytes() != Path(versions[-1]).read_bytes():
+            raise AssertionError("restored file differs")
+
+    result = {
+        "input_bytes": total,
+        "age_files_bytes": plain,
+        "store_bytes": stored,
+        "store_ratio": stored / plain,
+        "chunks": chunks,
+        "unique_chunks": new_chunks,
+        "age_files_mb_per_sec": total / plain_time / (1 << 20),
+        "store_mb_per_sec": total / store_time / (1 << 20),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{args.files} files x {args.versions} versions of {args.size}, {args.edits} edits per version")
+        print(f"input          {total:>14,} bytes")
+        print(f"one .age each  {plain:>14,} bytes  {result['age_files_mb_per_sec']:8.1f} MB/s")
+        print(f"chunk store    {stored:>14,} bytes  {result['store_mb_per_sec']:8.1f} MB/s  "
+              f"({result['store_ratio']:.1%}, {new_chunks}/{chunks} chunks written)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
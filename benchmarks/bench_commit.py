@@ -0,0 +1,95 @@
+#!/bin/env python3
+"""
+Cost of the crash-safe output path per --sync-batch setting: every file is
+written through atomic_output (temp file, fsync, rename) and handed to a
+GroupCommit that fsyncs the directory and removes the source per batch.
+"unsafe" is the old direct write followed by os.remove. No age involved, so
+this is the overhead on top of encryption. Run it on the disk you care about,
+tmpfs ignores fsync.
+
+    python3 benchmarks/bench_commit.py --dir /var/tmp --files 2000 --batches 1,16,64
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from durable import GroupCommit, atomic_output  # noqa: E402
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def run(directory: str, files: int, size: int, workers: int, batch: str) -> dict:
+    data = os.urandom(size)
+    sources = []
+    for n in range(files):
+        path = os.path.join(directory, f"file{n:06d}")
+        with open(path, "wb") as f:
+            f.write(data)
+        sources.append(path)
+
+    def write_unsafe(path: str) -> None:
+        with open(f"{path}.age", "wb") as f:
+            f.write(data)
+        os.remove(path)
+
+    def write_safe(path: str, commit: GroupCommit) -> None:
+        with atomic_output(f"{path}.age") as tmp, open(tmp, "wb") as f:
+            f.write(data)
+        commit.add(f"{path}.age", remove=path)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        if batch == "unsafe":
+            list(executor.map(write_unsafe, sources))
+        else:
+            with GroupCommit(int(batch)) as commit:
+                list(executor.map(lambda path: write_safe(path, commit), sources))
+    elapsed = time.perf_counter() - start
+    for path in sources:
+        os.remove(f"{path}.age")
+    return {"batch": batch, "files_per_sec": files / elapsed, "mb_per_sec": files * size / elapsed / (1 << 20)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1000, help="files per run (default: 1000)")
+    parser.add_argument("--size", default="64KB", help="size of each file (default: 64KB)")
+    parser.add_argument("--batches", default="unsafe,1,16,64", help="comma separated --sync-batch values")
+    parser.add_argument("-j", "--workers", type=int, default=8, help="writer threads (default: 8)")
+    parser.add_argument("--dir", default=None, help="directory for the test files (default: $TMPDIR)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for batch in args.batches.split(","):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            results.append(run(tmp, args.files, parse_size(args.size), args.workers, batch))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.files} files of {args.size}, {args.workers} writers")
+        print(f"{'batch':<8} {'files/s':>10} {'MB/s':>10}")
+        for r in results:
+            print(f"{r['batch']:<8} {r['files_per_sec']:>10.1f} {r['mb_per_sec']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
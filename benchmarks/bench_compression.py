@@ -0,0 +1,121 @@
+#!/bin/env python3
+"""
+Ciphertext size and throughput of the --compress codecs on synthetic logs,
+JSON and random data. Decryption includes the decompression in place, the
+way yubideCrypt does it. Uses a software X25519 key, no YubiKey.
+
+    python3 benchmarks/bench_compression.py --size 256MB
+    python3 benchmarks/bench_compression.py --codecs none,auto --data logs
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import compress  # noqa: E402
+from engine import select_engine  # noqa: E402
+
+DATA = ("logs", "json", "random")
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def write_data(kind: str, path: str, size: int, rng: random.Random) -> None:
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            if kind == "logs":
+                lines = [f"2026-10-18 12:{rng.randrange(60):02d}:{rng.randrange(60):02d} "
+                         f"{rng.choice(('INFO', 'INFO', 'WARN', 'DEBUG'))} request id={rng.getrandbits(32)} "
+                         f"path=/api/v1/items/{rng.randrange(1000)} status={rng.choice((200, 200, 404, 500))} "
+                         f"took={rng.random() * 100:.2f}ms" for _ in range(1000)]
+                block = ("\n".join(lines) + "\n").encode()
+            elif kind == "json":
+                records = [{"id": rng.getrandbits(48), "user": f"user{rng.randrange(10000)}",
+                            "tags": rng.sample(("a", "b", "c", "d", "e", "f"), 3), "score": rng.random()}
+                           for _ in range(1000)]
+                block = "".join(json.dumps(r) + "\n" for r in records).encode()
+            else:
+                block = rng.randbytes(1 << 20)
+            block = block[:size - written]
+            f.write(block)
+            written += len(block)
+
+
+def run(src: str, identity_file: str, recipient: str, setting: str) -> dict:
+    engine = select_engine("age")
+    encrypted, restored = f"{src}.{setting}.age", f"{src}.{setting}.out"
+    start = time.perf_counter()
+    codec = compress.encrypt_file(engine, src, encrypted, [recipient], setting)
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.decrypt_file(encrypted, restored, identity_file)
+    compress.decompress_file(restored)
+    decrypt_time = time.perf_counter() - start
+
+    if Path(restored).read_bytes() != Path(src).read_bytes():
+        raise AssertionError(f"{setting}: round trip changed the file")
+    size = os.path.getsize(src)
+    result = {
+        "setting": setting,
+        "codec": codec,
+        "ciphertext_ratio": os.path.getsize(encrypted) / size,
+        "encrypt_mb_per_sec": size / encrypt_time / (1 << 20),
+        "decrypt_mb_per_sec": size / decrypt_time / (1 << 20),
+    }
+    os.remove(encrypted)
+    os.remove(restored)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="64MB", help="size of each input (default: 64MB)")
+    parser.add_argument("--data", default=",".join(DATA), help=f"comma separated, from {', '.join(DATA)}")
+    parser.add_argument("--codecs", default=",".join(("none", "auto") + tuple(compress.available_codecs())),
+                        help="comma separated --compress settings (default: none, auto and every installed codec)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    identity, recipient = select_engine("age").generate_identity()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        identity_file = os.path.join(tmp, "identity.txt")
+        Path(identity_file).write_text(f"{identity}\n")
+        for kind in args.data.split(","):
+            src = os.path.join(tmp, kind)
+            write_data(kind, src, parse_size(args.size), rng)
+            for setting in dict.fromkeys(args.codecs.split(",")):
+                results.append(dict(run(src, identity_file, recipient, setting), data=kind))
+            os.remove(src)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.size} per input, installed codecs: {', '.join(compress.available_codecs())}")
+        print(f"{'data':<8} {'setting':<8} {'codec':<6} {'size':>7} {'enc MB/s':>10} {'dec MB/s':>10}")
+        for r in results:
+            print(f"{r['data']:<8} {r['setting']:<8} {r['codec']:<6} {r['ciphertext_ratio']:>7.1%} "
+                  f"{r['encrypt_mb_per_sec']:>10.1f} {r['decrypt_mb_per_sec']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/bin/env python3
+"""
+End-to-end latency of the yubienCrypt alias: wall clock of a whole
+`python3 src/daemon_client.py encrypt FILE` process against `python3 src/encrypt.py
+FILE`, both served by a running yubiCryptd, and of encrypt.py running on its
+own (YUBICRYPT_DAEMON=0). load_daemon.py only times the socket round-trip,
+this includes the interpreter start and the imports.
+
+    yubiCryptd &
+    python3 benchmarks/bench_daemon_client.py --runs 30
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from daemon import DAEMON_ENV, SOCKET_PATH, request  # noqa: E402
+
+ENTRY_POINTS = [
+    ("daemon_client.py (alias)", [str(SRC / "daemon_client.py"), "encrypt"], {}),
+    ("encrypt.py", [str(SRC / "encrypt.py")], {}),
+    ("encrypt.py, no daemon", [str(SRC / "encrypt.py")], {DAEMON_ENV: "0"}),
+]
+
+
+def time_runs(command: list, env: dict, tmp: str, runs: int) -> list:
+    timings = []
+    for n in range(runs):
+        path = os.path.join(tmp, f"bench{n:04d}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(1024))
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *command, path], env=dict(os.environ, **env),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} exited with {result.returncode}")
+        os.remove(f"{path}.age")
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="processes per entry point (default: 20)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if request({"op": "ping"}) is None:
+        print(f"yubiCryptd is not listening on {SOCKET_PATH}", file=sys.stderr)
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, command, env in ENTRY_POINTS:
+            timings = time_runs(command, env, tmp, args.runs)
+            results.append({"entry_point": name, "median_ms": statistics.median(timings) * 1000,
+                            "min_ms": min(timings) * 1000})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'entry point':<24} {'median ms':>10} {'min ms':>10}")
+        for r in results:
+            print(f"{r['entry_point']:<24} {r['median_ms']:>10.1f} {r['min_ms']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
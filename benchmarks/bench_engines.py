@@ -0,0 +1,80 @@
+#!/bin/env python3
+"""Compares per-file latency of the age subprocess backend and the in-process pyrage backend."""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from engine import select_engine  # noqa: E402
+
+
+def bench_engine(name: str, files, recipient: str, identity: str) -> dict:
+    engine = select_engine(name)
+
+    start = time.perf_counter()
+    for path in files:
+        engine.encrypt_file(path, f"{path}.{name}.age", [recipient])
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in files:
+        engine.decrypt_file(f"{path}.{name}.age", f"{path}.{name}.out", identity=identity)
+    decrypt_time = time.perf_counter() - start
+
+    for path in files:
+        with open(path, "rb") as a, open(f"{path}.{name}.out", "rb") as b:
+            if a.read() != b.read():
+                raise AssertionError(f"{name}: round trip mismatch for {path}")
+
+    return {
+        "engine": name,
+        "files": len(files),
+        "encrypt_ms_per_file": encrypt_time / len(files) * 1000,
+        "decrypt_ms_per_file": decrypt_time / len(files) * 1000,
+        "encrypt_files_per_sec": len(files) / encrypt_time,
+        "decrypt_files_per_sec": len(files) / decrypt_time,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=200, help="number of files (default: 200)")
+    parser.add_argument("-s", "--size", type=int, default=4096, help="bytes per file (default: 4096)")
+    parser.add_argument("--engines", default="age,pyrage", help="comma separated backends")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for n in range(args.files):
+            path = os.path.join(tmp, f"file{n:05d}")
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.size))
+            files.append(path)
+
+        identity, recipient = select_engine("age").generate_identity()
+        for name in args.engines.split(","):
+            try:
+                results.append(bench_engine(name, files, recipient, identity))
+            except ImportError as e:
+                print(f"Skipping {name}: {e}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'engine':<8} {'enc ms/file':>12} {'dec ms/file':>12} {'enc files/s':>12} {'dec files/s':>12}")
+        for r in results:
+            print(f"{r['engine']:<8} {r['encrypt_ms_per_file']:>12.2f} {r['decrypt_ms_per_file']:>12.2f} "
+                  f"{r['encrypt_files_per_sec']:>12.1f} {r['decrypt_files_per_sec']:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
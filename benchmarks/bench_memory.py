@@ -0,0 +1,123 @@
+#!/bin/env python3
+"""
+Peak RSS and throughput of the file encryption paths for one large input.
+Every mode runs in its own child process, so ru_maxrss is the peak of that
+mode alone (age itself runs in grandchildren and is not counted).
+
+    python3 benchmarks/bench_memory.py --size 2GB
+    python3 benchmarks/bench_memory.py --size 1GB --modes segmented,bytes
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from engine import select_engine  # noqa: E402
+from segments import DEFAULT_SEGMENT_SIZE, decrypt_segmented, encrypt_segmented  # noqa: E402
+
+MODES = ("file", "segmented", "bytes", "pyrage")
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def run_mode(mode: str, src: str, identity_file: str, recipient: str, workers: int) -> dict:
+    """Encrypts and decrypts src once the way the given mode does it."""
+    engine = select_engine("pyrage" if mode == "pyrage" else "age")
+    encrypted, restored = f"{src}.{mode}.enc", f"{src}.{mode}.out"
+
+    start = time.perf_counter()
+    if mode == "segmented":
+        encrypt_segmented(src, encrypted, [recipient], DEFAULT_SEGMENT_SIZE, workers, engine)
+    elif mode == "bytes":
+        # The naive in-memory path: whole plaintext and ciphertext as Python bytes
+        with open(src, "rb") as f, open(encrypted, "wb") as out:
+            out.write(engine.encrypt_bytes(f.read(), [recipient]))
+    else:
+        engine.encrypt_file(src, encrypted, [recipient])
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == "segmented":
+        decrypt_segmented(encrypted, restored, identity_file, workers, engine)
+    elif mode == "bytes":
+        with open(encrypted, "rb") as f, open(restored, "wb") as out:
+            out.write(engine.decrypt_bytes(f.read(), identity_file=identity_file))
+    else:
+        engine.decrypt_file(encrypted, restored, identity_file)
+    decrypt_time = time.perf_counter() - start
+
+    if os.path.getsize(restored) != os.path.getsize(src):
+        raise AssertionError(f"{mode}: round trip changed the file size")
+    mb = os.path.getsize(src) / (1 << 20)
+    os.remove(encrypted)
+    os.remove(restored)
+    return {
+        "mode": mode,
+        "encrypt_mb_per_sec": mb / encrypt_time,
+        "decrypt_mb_per_sec": mb / decrypt_time,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1GB", help="input size (default: 1GB)")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma separated, from {', '.join(MODES)}")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="workers for segmented")
+    parser.add_argument("--dir", default=None, help="directory for the test files (default: $TMPDIR)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--child", nargs=4, metavar=("MODE", "SRC", "IDENTITY", "RECIPIENT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(*args.child, args.workers)))
+        return 0
+
+    size = parse_size(args.size)
+    identity, recipient = select_engine("age").generate_identity()
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        src = os.path.join(tmp, "input")
+        identity_file = os.path.join(tmp, "identity.txt")
+        Path(identity_file).write_text(f"{identity}\n")
+        block = os.urandom(1 << 20)
+        with open(src, "wb") as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:min(len(block), size - offset)])
+
+        for mode in args.modes.split(","):
+            child = subprocess.run([sys.executable, __file__, "--child", mode, src, identity_file, recipient,
+                                    "-j", str(args.workers)], capture_output=True, text=True)
+            if child.returncode:
+                print(f"Skipping {mode}: {child.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                continue
+            results.append(json.loads(child.stdout))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.size} input, {args.workers} workers")
+        print(f"{'mode':<10} {'enc MB/s':>10} {'dec MB/s':>10} {'peak RSS MB':>12}")
+        for r in results:
+            print(f"{r['mode']:<10} {r['encrypt_mb_per_sec']:>10.1f} {r['decrypt_mb_per_sec']:>10.1f} "
+                  f"{r['peak_rss_mb']:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/bin/env python3
+"""
+Throughput of segmented encryption over a range of worker counts, against a
+single age process for the whole file. Uses a software X25519 key, so only
+crypto and disk are measured.
+
+    python3 benchmarks/bench_segments.py --size 4GB --workers 1,2,4,8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from engine import select_engine  # noqa: E402
+from segments import DEFAULT_SEGMENT_SIZE, decrypt_segmented, encrypt_segmented  # noqa: E402
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def write_synthetic(path: str, size: int) -> None:
+    block = os.urandom(1 << 20)
+    with open(path, "wb") as f:
+        for offset in range(0, size, len(block)):
+            f.write(block[:min(len(block), size - offset)])
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="2GB", help="synthetic file size (default: 2GB)")
+    parser.add_argument("--segment-size", type=int, default=DEFAULT_SEGMENT_SIZE >> 20, metavar="MiB",
+                        help=f"segment size (default: {DEFAULT_SEGMENT_SIZE >> 20})")
+    parser.add_argument("--workers", default=",".join(str(w) for w in (1, 2, 4, 8, os.cpu_count() or 1)),
+                        help="comma separated worker counts")
+    parser.add_argument("--engine", default="age", help="age backend (default: age)")
+    parser.add_argument("--dir", default=None, help="directory for the test files (default: $TMPDIR)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    mb = size / (1 << 20)
+    engine = select_engine(args.engine)
+    identity, recipient = engine.generate_identity()
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        src = os.path.join(tmp, "image")
+        identity_file = os.path.join(tmp, "identity.txt")
+        Path(identity_file).write_text(f"{identity}\n")
+        write_synthetic(src, size)
+
+        seconds = timed(engine.encrypt_file, src, f"{src}.age", [recipient])
+        results.append({"mode": "single age", "workers": 1, "encrypt_mb_per_sec": mb / seconds,
+                        "decrypt_mb_per_sec": mb / timed(engine.decrypt_file, f"{src}.age", f"{src}.out",
+                                                         identity_file)})
+        os.remove(f"{src}.age")
+        os.remove(f"{src}.out")
+
+        for workers in sorted({int(w) for w in args.workers.split(",")}):
+            dst = f"{src}.ycs"
+            encrypt_time = timed(encrypt_segmented, src, dst, [recipient], args.segment_size << 20, workers, engine)
+            decrypt_time = timed(decrypt_segmented, dst, f"{src}.out", identity_file, workers, engine)
+            results.append({"mode": "segmented", "workers": workers, "encrypt_mb_per_sec": mb / encrypt_time,
+                            "decrypt_mb_per_sec": mb / decrypt_time})
+            if os.path.getsize(f"{src}.out") != size:
+                raise AssertionError("segmented round trip changed the file size")
+            os.remove(dst)
+            os.remove(f"{src}.out")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.size} file, {args.segment_size} MiB segments, {os.cpu_count()} CPUs")
+        print(f"{'mode':<12} {'workers':>8} {'enc MB/s':>10} {'dec MB/s':>10}")
+        for r in results:
+            print(f"{r['mode']:<12} {r['workers']:>8} {r['encrypt_mb_per_sec']:>10.1f} {r['decrypt_mb_per_sec']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/bin/env python3
+"""
+Slot scan wall-clock against a stub plugin: the legacy thread pool with
+shell=True, the per-slot asyncio scan and the single-call enumeration.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "yubiCryptImporter"))
+
+from modules.get_ids import process_slots, scan_slots  # noqa: E402
+
+STUB = """#!{python}
+import sys, time
+time.sleep({latency})
+slots = [int(sys.argv[sys.argv.index("--slot") + 1])] if "--slot" in sys.argv else {occupied}
+if any(slot not in {occupied} for slot in slots):
+    sys.exit(1)
+for slot in slots:
+    print(f"#       Serial: 1, Slot: {{slot}}")
+    print(f"#    Recipient: age1yubikey1stub{{slot}}")
+    print(f"AGE-PLUGIN-YUBIKEY-1STUB{{slot}}")
+"""
+
+
+def legacy_scan(slot_range, max_workers=8):
+    """The previous ThreadPoolExecutor + shell=True implementation, kept for comparison."""
+    def run(slot):
+        result = subprocess.run(f"age-plugin-yubikey --identity --slot {slot}",
+                                shell=True, capture_output=True, text=True)
+        return slot, result.stdout.strip() if result.returncode == 0 else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return {slot: out for slot, out in executor.map(run, slot_range) if out}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub plugin latency in seconds")
+    parser.add_argument("--occupied", default="1,2,3", help="occupied slots")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    occupied = [int(s) for s in args.occupied.split(",") if s]
+    with tempfile.TemporaryDirectory() as tmp:
+        stub = Path(tmp) / "age-plugin-yubikey"
+        stub.write_text(STUB.format(python=sys.executable, latency=args.latency, occupied=occupied))
+        stub.chmod(stub.stat().st_mode | stat.S_IXUSR)
+        os.environ["PATH"] = f"{tmp}{os.pathsep}{os.environ['PATH']}"
+
+        results = []
+        scans = (
+            ("threaded", legacy_scan),
+            ("per-slot", lambda slots, n: asyncio.run(scan_slots(slots, n))),
+            ("enumerate", process_slots),
+        )
+        for name, scan in scans:
+            start = time.perf_counter()
+            with redirect_stdout(StringIO()):
+                found = scan(range(22), args.concurrency)
+            elapsed = time.perf_counter() - start
+            assert sorted(found) == occupied, f"{name} found {sorted(found)}"
+            results.append({"scan": name, "seconds": elapsed})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            print(f"{r['scan']:<10} {r['seconds']:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/bin/env python3
+"""
+Throughput of yubiCryptVerify's hardware-free check per worker count: random
+"ciphertexts" with valid age headers are recorded in a throwaway verify
+index, then verified (structure check plus SHA-256) the way yubiCryptVerify
+does it. Drop the page cache between runs (or use --size larger than RAM) to
+measure the disk rather than hashlib.
+
+    python3 benchmarks/bench_verify.py --files 64 --size 16MB --workers 1,2,4,8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from verify import VerifyIndex, file_sha256, verify_files  # noqa: E402
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+HEADER = b"age-encryption.org/v1\n-> X25519 bench\nAAAA\n--- bench\n"
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def make_files(directory: str, files: int, size: int, index: VerifyIndex) -> list:
+    block = os.urandom(1 << 20)
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, f"file{n:04d}.age")
+        with open(path, "wb") as f:
+            f.write(HEADER)
+            for offset in range(0, size, len(block)):
+                f.write(block[:min(len(block), size - offset)])
+        st = os.stat(path)
+        index.files[os.path.abspath(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                              "sha256": file_sha256(path)}
+        paths.append(path)
+    return paths
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=32, help="number of files (default: 32)")
+    parser.add_argument("--size", default="8MB", help="size of each file (default: 8MB)")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts")
+    parser.add_argument("--dir", default=None, help="directory for the test files (default: $TMPDIR)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        index = VerifyIndex(os.path.join(tmp, "verify.index.json"))
+        paths = make_files(tmp, args.files, size, index)
+        total = sum(os.path.getsize(path) for path in paths)
+        for workers in map(int, args.workers.split(",")):
+            start = time.perf_counter()
+            checked = verify_files(paths, workers, index, fallback={})
+            elapsed = time.perf_counter() - start
+            if any(status != "OK" for status, _ in checked.values()):
+                raise AssertionError(f"{workers} workers: {checked}")
+            results.append({"workers": workers, "files_per_sec": len(paths) / elapsed,
+                            "mb_per_sec": total / elapsed / (1 << 20)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.files} files of {args.size}, {os.cpu_count()} cores")
+        print(f"{'workers':<8} {'files/s':>10} {'MB/s':>10}")
+        for r in results:
+            print(f"{r['workers']:<8} {r['files_per_sec']:>10.1f} {r['mb_per_sec']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
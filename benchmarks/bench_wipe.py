@@ -0,0 +1,92 @@
+#!/bin/env python3
+"""
+Throughput of the --wipe policies: files are removed through a Shredder the
+way yubienCrypt removes the originals, reporting the file bytes removed and
+the bytes overwritten per second (wall clock, all wipe workers together).
+Run it on the disk you care about, tmpfs ignores fsync and hole punching.
+
+    python3 benchmarks/bench_wipe.py --dir /var/tmp --files 16 --size 64MB
+    python3 benchmarks/bench_wipe.py --policies overwrite --rate 50 -j 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from shred import DEFAULT_WIPE_WORKERS, POLICIES, Shredder  # noqa: E402
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def run(directory: str, policy: str, files: int, size: int, workers: int, rate) -> dict:
+    block = os.urandom(1 << 20)
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, f"plain{n:04d}")
+        with open(path, "wb") as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:min(len(block), size - offset)])
+            os.fsync(f.fileno())
+        paths.append(path)
+
+    start = time.perf_counter()
+    with Shredder(policy, workers, rate) as shredder:
+        for path in paths:
+            shredder.submit(path)
+    elapsed = time.perf_counter() - start
+    if shredder.failed:
+        raise AssertionError(f"{policy}: {next(iter(shredder.failed.values()))}")
+    return {
+        "policy": policy,
+        "removed_mb_per_sec": shredder.stats["size"] / elapsed / (1 << 20),
+        "overwritten_mb_per_sec": shredder.stats["written"] / elapsed / (1 << 20),
+        "seconds": elapsed,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8, help="files per policy (default: 8)")
+    parser.add_argument("--size", default="32MB", help="size of each file (default: 32MB)")
+    parser.add_argument("--policies", default=",".join(POLICIES), help=f"comma separated, from {', '.join(POLICIES)}")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WIPE_WORKERS,
+                        help=f"wipe workers (default: {DEFAULT_WIPE_WORKERS})")
+    parser.add_argument("--rate", type=float, default=None, metavar="MB/s", help="rate limit (default: none)")
+    parser.add_argument("--dir", default=None, help="directory for the test files (default: $TMPDIR)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rate = args.rate * (1 << 20) if args.rate else None
+    results = []
+    for policy in args.policies.split(","):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            results.append(run(tmp, policy, args.files, parse_size(args.size), args.workers, rate))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.files} files of {args.size}, {args.workers} workers, "
+              f"rate {f'{args.rate} MB/s' if args.rate else 'unlimited'}")
+        print(f"{'policy':<10} {'removed MB/s':>13} {'overwritten MB/s':>17} {'seconds':>8}")
+        for r in results:
+            print(f"{r['policy']:<10} {r['removed_mb_per_sec']:>13.1f} {r['overwritten_mb_per_sec']:>17.1f} "
+                  f"{r['seconds']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/bin/env python3
+"""Load test for yubiCryptd: concurrent clients, per-request latency percentiles."""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from daemon import SOCKET_PATH, request  # noqa: E402
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def one_request(op: str, tmp: str, n: int, socket_path: str) -> float:
+    start = time.perf_counter()
+    if op == "ping":
+        response = request({"op": "ping"}, socket_path)
+    else:
+        path = os.path.join(tmp, f"load{n:06d}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(1024))
+        start = time.perf_counter()
+        response = request({"op": "encrypt", "files": [path], "workers": 1}, socket_path)
+    elapsed = time.perf_counter() - start
+    if response is None or not response["ok"]:
+        raise RuntimeError(f"request failed: {response}")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--op", choices=("ping", "encrypt"), default="ping")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--clients", type=int, default=8)
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if request({"op": "ping"}, args.socket) is None:
+        print(f"yubiCryptd is not listening on {args.socket}", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            latencies = list(executor.map(lambda n: one_request(args.op, tmp, n, args.socket),
+                                          range(args.requests)))
+        wall = time.perf_counter() - start
+
+    result = {
+        "op": args.op,
+        "requests": args.requests,
+        "clients": args.clients,
+        "requests_per_sec": args.requests / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:>16}: {value:.2f}" if isinstance(value, float) else f"{key:>16}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
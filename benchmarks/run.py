@@ -0,0 +1,256 @@
+#!/bin/env python3
+"""
+yubiCrypt benchmark suite.
+
+Measures encrypt_file/decrypt_file throughput over a file size distribution,
+the slot scan of get_ids.py and the manifest hashing and unchanged re-deploy
+of copy_run_files.py, writes the results as JSON and compares them against a
+stored baseline.
+Runs against the simulator in simulator/bin unless --real is given.
+
+    python3 benchmarks/run.py                                   # default sizes
+    python3 benchmarks/run.py --sizes 1KB,1MB,1GB --output out.json
+    python3 benchmarks/run.py --save-baseline                   # refresh baseline.json
+
+The cases that take milliseconds keep the best of --repeat runs, and a
+metric only counts as a regression when its case also got slower by more
+than NOISE_FLOOR seconds.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = "1KB,64KB,1MB,16MB"
+UNITS = {"B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+BUDGET = 64 << 20  # bytes written per size case
+MAX_FILES = 50
+DEFAULT_REPEAT = 5
+# Wall-clock differences below this are scheduling noise, whatever the ratio
+NOISE_FLOOR = 0.02
+
+# Metrics where a higher value is better, everything else is a latency
+THROUGHPUT_METRICS = ("files_per_sec", "mb_per_sec")
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+def size_label(size: int) -> str:
+    for unit in ("GB", "MB", "KB"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def write_random(path: str, size: int) -> None:
+    block = os.urandom(min(size, 1 << 20))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, len(block))
+            f.write(block[:n])
+            remaining -= n
+
+
+def prepare_home(home: str) -> None:
+    """A throwaway ~/.yubiCrypt with the identities of the (simulated) YubiKey."""
+    keys = Path(home) / ".yubiCrypt" / "keys"
+    keys.mkdir(parents=True)
+    identity = subprocess.run(["age-plugin-yubikey", "--identity"], capture_output=True,
+                              text=True, check=True).stdout
+    (keys / "bench.txt").write_text(identity)
+
+
+def throughput(files: int, size: int, seconds: float) -> dict:
+    return {
+        "files": files,
+        "seconds": seconds,
+        "files_per_sec": files / seconds,
+        "mb_per_sec": files * size / seconds / (1 << 20),
+    }
+
+
+def bench_crypto(work: str, size: int) -> dict:
+    import decrypt
+    import encrypt
+
+    count = max(1, min(MAX_FILES, BUDGET // size))
+    directory = os.path.join(work, f"crypto-{size}")
+    os.makedirs(directory)
+    files = []
+    for n in range(count):
+        path = os.path.join(directory, f"f{n:04d}")
+        write_random(path, size)
+        files.append(path)
+
+    recipients = encrypt.read_recipients()
+    identity = decrypt.identity_paths()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        start = time.perf_counter()
+        ok = all(encrypt.encrypt_file(path, recipients) for path in files)
+        encrypt_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ok &= all(decrypt.decrypt_file(f"{path}.age", identity) for path in files)
+        decrypt_time = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError(f"encrypt/decrypt failed for {size_label(size)} files")
+
+    for path in files:
+        os.remove(path)
+    return {
+        f"encrypt_{size_label(size)}": throughput(count, size, encrypt_time),
+        f"decrypt_{size_label(size)}": throughput(count, size, decrypt_time),
+    }
+
+
+def best_of(repeat: int, func) -> tuple:
+    """Runs func repeat times, returns (its last result, the fastest run in seconds)."""
+    best = float("inf")
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def bench_slot_scan(repeat: int = DEFAULT_REPEAT) -> dict:
+    sys.path.insert(0, str(ROOT / "yubiCryptImporter"))
+    from modules.get_ids import process_slots
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        found, elapsed = best_of(repeat, lambda: process_slots(range(22)))
+    return {"slot_scan": {"slots_found": len(found), "seconds": elapsed}}
+
+
+def bench_manifest(work: str, repeat: int = DEFAULT_REPEAT) -> dict:
+    sys.path.insert(0, str(ROOT / "setup_files"))
+    from copy_run_files import copy_with_permissions, create_file_manifest
+
+    source = os.path.join(work, "manifest-src")
+    total = 0
+    for n in range(200):
+        path = os.path.join(source, f"d{n % 10}", f"f{n:03d}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 4096 * (1 + n % 64)
+        write_random(path, size)
+        total += size
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        manifest, elapsed = best_of(repeat, lambda: create_file_manifest(source, os.path.join(work, "manifest-dst")))
+        # A second deploy of the same tree only compares stat data with the manifest
+        copy_with_permissions(source, os.path.join(work, "manifest-dst"))
+        _, redeploy = best_of(repeat, lambda: copy_with_permissions(source, os.path.join(work, "manifest-dst")))
+    return {"manifest_hash": throughput(len(manifest), total / len(manifest), elapsed),
+            "manifest_redeploy": {"files": len(manifest), "seconds": redeploy}}
+
+
+def compare(results: dict, baseline: dict, tolerance: float, floor: float = NOISE_FLOOR) -> list:
+    """
+    Returns a line per metric that regressed by more than tolerance, skipping
+    the cases whose seconds changed by less than floor.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        old_seconds = baseline.get(case, {}).get("seconds")
+        if isinstance(old_seconds, (int, float)) and metrics.get("seconds", 0) - old_seconds < floor:
+            continue
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if not isinstance(old, (int, float)) or not old or metric in ("files", "slots_found"):
+                continue
+            if metric in THROUGHPUT_METRICS:
+                change = (value - old) / old
+                regressed = change < -tolerance
+            else:
+                change = (old - value) / old
+                regressed = change < -tolerance
+            if regressed:
+                regressions.append(f"{case}.{metric}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"file sizes, 1KB-10GB (default: {DEFAULT_SIZES})")
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--baseline", default=str(BASELINE), help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (default: 0.25)")
+    parser.add_argument("--floor", type=float, default=NOISE_FLOOR,
+                        help=f"slowdowns below this many seconds never count (default: {NOISE_FLOOR})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"runs of the millisecond cases, the fastest counts (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--real", action="store_true", help="use the real ykman/age on PATH")
+    args = parser.parse_args()
+
+    if not args.real:
+        os.environ["PATH"] = f"{ROOT / 'simulator' / 'bin'}{os.pathsep}{os.environ['PATH']}"
+    os.environ["YUBICRYPT_DAEMON"] = "0"
+
+    with tempfile.TemporaryDirectory(prefix="yubicrypt-bench-") as work:
+        # The modules resolve ~/.yubiCrypt at import time, so HOME is switched first
+        os.environ["HOME"] = os.path.join(work, "home")
+        prepare_home(os.environ["HOME"])
+        sys.path.insert(0, str(ROOT / "src"))
+
+        results = {}
+        for size in sorted(parse_size(s) for s in args.sizes.split(",")):
+            print(f"encrypt/decrypt {size_label(size)}...", file=sys.stderr)
+            results.update(bench_crypto(work, size))
+        print("slot scan...", file=sys.stderr)
+        results.update(bench_slot_scan(args.repeat))
+        print("manifest hashing...", file=sys.stderr)
+        results.update(bench_manifest(work, args.repeat))
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "simulator": not args.real,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(text + "\n")
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if os.path.exists(args.baseline):
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance, args.floor)
+        if regressions:
+            print("Regressions:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("No regressions against the baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,136 @@
 #!/bin/env python3
+"""
+Installs yubiCrypt: system packages, age, age-plugin-yubikey, the directories
+in your home, the importer, the run files and the aliases.
+
+The steps form a dependency graph (see setup_files/install_graph.py):
+independent steps run at once, steps that are already satisfied are skipped
+and a failed run is resumed from .installer_state.json.
+
+    ./installer.py                       # everything
+    ./installer.py --skip rust-rewrite   # make install
+    ./installer.py --only run-files      # one step and what it requires
+    ./installer.py --list
+"""
+
+import argparse
 import os
+import shutil
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT / "setup_files"))
+
+from install_graph import (DEFAULT_WORKERS, Installer, Step, command_succeeds,  # noqa: E402
+                           version_at_least)
+from instrument import PROFILE_ENV, enable as enable_profiling  # noqa: E402
+
+STATE_PATH = ROOT / ".installer_state.json"
+MIN_AGE_VERSION = (1, 0, 0)
+PACKAGE_MANAGER_LOCK = "package-manager"
+CARGO_LOCK = "cargo"
+
+
+def python_script(path: str, *args: str, sudo: bool = False) -> list:
+    command = [sys.executable, str(ROOT / path), *args]
+    return ["sudo", *command] if sudo else command
+
+
+def pcsclite_installed() -> bool:
+    return command_succeeds(["pkg-config", "--exists", "libpcsclite"])
+
+
+def plugin_installed() -> bool:
+    return command_succeeds(["age-plugin-yubikey", "--version"])
+
+
+def install_rust() -> None:
+    from install_age_plugin import install_rust as rustup
+    rustup()
+
+
+def create_key_dir() -> None:
+    os.makedirs(Path.home() / ".yubiCrypt" / "keys", mode=0o700, exist_ok=True)
+
+
+def install_importer() -> None:
+    """Copies yubiCryptImporter to ~/.yubiCrypt, following the module symlinks like cp -rL."""
+    source = ROOT / "yubiCryptImporter"
+    dest = Path.home() / ".yubiCrypt" / "yubiCryptImporter"
+    (dest / "modules").mkdir(parents=True, exist_ok=True)
+    for path in source.glob("*.py"):
+        shutil.copy2(path, dest)
+    for path in (source / "modules").glob("*.py"):
+        shutil.copy2(path, dest / "modules")
+
+
+def build_steps() -> list:
+    return [
+        Step("pcsclite", python_script("install_pcsclite.py", sudo=True), check=pcsclite_installed,
+             lock=PACKAGE_MANAGER_LOCK, interactive=True, description="PCSC-Lite and the pcscd service"),
+        Step("age", python_script("setup_files/install_age.py", sudo=True),
+             check=lambda: version_at_least(["age", "--version"], MIN_AGE_VERSION),
+             lock=PACKAGE_MANAGER_LOCK, interactive=True, description="age from the package manager"),
+        Step("rust", install_rust, check=lambda: command_succeeds(["cargo", "--version"]),
+             interactive=True, description="Rust toolchain via rustup"),
+        Step("plugin-deps", python_script("setup_files/install_age_plugin.py", "--deps-only", sudo=True),
+             requires=["pcsclite"], check=lambda: plugin_installed() or pcsclite_installed(),
+             lock=PACKAGE_MANAGER_LOCK, interactive=True, description="build dependencies of age-plugin-yubikey"),
+        Step("age-plugin-yubikey", ["cargo", "install", "age-plugin-yubikey"], requires=["rust", "plugin-deps"],
+             check=plugin_installed, lock=CARGO_LOCK, description="cargo install age-plugin-yubikey"),
+        Step("rust-rewrite", ["cargo", "build", "--release"], requires=["rust"], lock=CARGO_LOCK,
+             cwd=str(ROOT / "alpha_rust_rewrite"), description="build alpha_rust_rewrite"),
+        Step("yubicrypt-dirs", python_script("setup_files/directory_checker_yubicrypt.py"),
+             description="~/.yubiCrypt with secure permissions"),
+        Step("key-dir", create_key_dir, requires=["yubicrypt-dirs"], description="~/.yubiCrypt/keys"),
+        Step("importer", install_importer, requires=["yubicrypt-dirs"],
+             description="yubiCryptImporter to ~/.yubiCrypt"),
+        Step("dcde-dirs", python_script("setup_files/directory_checker_dcde.py"),
+             description="~/dcde/src with secure permissions"),
+        Step("run-files", python_script("setup_files/copy_run_files.py"), requires=["yubicrypt-dirs", "dcde-dirs"],
+             description="run_files and src, changed files only"),
+        Step("aliases", python_script("setup_files/add_aliases.py"), requires=["run-files"], interactive=True,
+             description="aliases in ~/.bash_aliases"),
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Install yubiCrypt.")
+    parser.add_argument("--only", action="append", default=[], metavar="STEP",
+                        help="run only STEP and the steps it requires, repeatable")
+    parser.add_argument("--skip", action="append", default=[], metavar="STEP", help="leave STEP out, repeatable")
+    parser.add_argument("--list", action="store_true", help="list the steps and their requirements")
+    parser.add_argument("--force", action="store_true", help="run the steps even if their checks are satisfied")
+    parser.add_argument("--restart", action="store_true", help="do not resume a failed run, run every step")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"steps run at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--state", default=str(STATE_PATH), help=f"state file (default: {STATE_PATH.name})")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the output of every step")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help=f"record timing spans to FILE (.prom or JSON lines) or stderr (default: ${PROFILE_ENV})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    enable_profiling(args.profile)
+    try:
+        installer = Installer(build_steps(), args.state, args.workers, args.force, args.restart, args.verbose)
+        names = installer.select(args.only, args.skip)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if args.list:
+        for name in installer.order:
+            step = installer.steps[name]
+            requires = f" (after {', '.join(step.requires)})" if step.requires else ""
+            print(f"{'*' if name in names else ' '} {name:<20} {step.description}{requires}")
+        return 0
+
+    return 0 if installer.run(args.only, args.skip) else 1
 
-os.system('sudo ./install_pcsclite.py')
-os.system('make all')
-os.system('sudo python3 setup_files/install_age.py')
-os.system('cargo install age-plugin-yubikey')
-os.system('sudo python3 setup_files/install_age_plugin.py')
-os.system('python3 setup_files/directory_checker_yubicrypt.py')
-os.system('python3 setup_files/copy_run_files.py')
-os.system('python3 setup_files/directory_checker_dcde.py')
-os.system('python3 setup_files/add_aliases.py')
-os.system('mkdir -p  ~/.yubiCrypt/yubiCryptImporter/')
-os.system('mkdir -p  ~/.yubiCrypt/yubiCryptImporter/modules')
-os.system('cp -r ./yubiCryptImporter/*.py ~/.yubiCrypt/yubiCryptImporter/*')
-os.system('cp -r ./yubiCryptImporter/modules/*.py ~/.yubiCrypt/yubiCryptImporter/modules/*')
 
+if __name__ == "__main__":
+    sys.exit(main())
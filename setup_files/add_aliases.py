@@ -1,39 +1,23 @@
 #!/usr/bin/env python3
 
 from typing import Any
-import os
 from pathlib import Path
 import getpass
-import time
 from contextlib import contextmanager
 from typing import Generator, IO, Any
-from datetime import datetime
 
 @contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
+def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
+    file: IO= open(path, mode)
+    print('Opening file')
     try:
-        yield
+        yield file
+    except Exception as e:
+        print(e)
     finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
-
-
-@contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
-        print('Opening file')
-        try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
+        print('Closing file...')
+        if file:
+            file.close()
 
 
 def add_aliases_to_bash_aliases():
@@ -48,9 +32,11 @@ def add_aliases_to_bash_aliases():
 
     # Define the aliases to add
     aliases = [
-        "alias yubienCrypt='python3 ~/dcde/src/encrypt.py'",
-        "alias yubideCrypt='python3 ~/dcde/src/decrypt.py'",
+        "alias yubienCrypt='python3 ~/dcde/src/daemon_client.py encrypt'",
+        "alias yubideCrypt='python3 ~/dcde/src/daemon_client.py decrypt'",
         "alias yubiCryptImport='python3 ~/.yubiCrypt/yubiCryptImporter/import.py'",
+        "alias yubiCryptd='python3 ~/dcde/src/daemon.py'",
+        "alias yubiCryptVerify='python3 ~/dcde/src/verify.py'",
     ]
 
     try:
@@ -1,98 +1,196 @@
 #!/usr/bin/env python3
-from typing import Any
+"""
+Deploys run_files to ~/.yubiCrypt/run_files and src to ~/dcde/src.
+
+Each destination keeps a copy_manifest.txt (JSON) with the size, mtime and
+SHA-256 of every source and the size and mtime of its copy. A re-run only
+hashes sources whose stat data changed and only copies files whose hash
+changed or whose copy was touched, so an unchanged tree costs a stat per file.
+Copies use a reflink or copy_file_range where the filesystem offers them and
+are verified against the source hash before they replace the old file.
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
 import os
-import sys
 import shutil
-from pathlib import Path
 import stat
-import datetime
-import hashlib
-import time
-from contextlib import contextmanager
-from typing import Generator, IO, Any
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
 
-@contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
-    try:
-        yield
-    finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
-
-
-@contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
-        print('Opening file')
-        try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
-
+from instrument import span
 
+MANIFEST_NAME = "copy_manifest.txt"
+MANIFEST_VERSION = 2
+HASH_BLOCK = 4 << 20
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+FICLONE = 0x40049409  # ioctl(dst, FICLONE, src) on btrfs, xfs and other reflink filesystems
+COPY_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.EPERM)
 
 
 def calculate_file_hash(file_path):
     """Calculate SHA-256 hash of a file"""
     sha256_hash = hashlib.sha256()
-    with file_manager(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+    with open(file_path, "rb", buffering=0) as f:
+        # Small files get a small buffer, allocating HASH_BLOCK would cost more than hashing them
+        buffer = bytearray(min(HASH_BLOCK, os.fstat(f.fileno()).st_size + 1))
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sha256_hash.update(view[:n])
     return sha256_hash.hexdigest()
 
-def create_file_manifest(source_dir, dest_dir):
-    """Create a manifest of copied files with their hashes"""
+
+def hash_files(paths: List[Path], workers: int = DEFAULT_WORKERS) -> List[str]:
+    """Hashes many files at once, hashlib releases the GIL on large buffers."""
+    if len(paths) < 2 or workers < 2:
+        return [calculate_file_hash(path) for path in paths]
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(calculate_file_hash, paths))
+
+
+def load_manifest(dest_dir) -> Dict[str, dict]:
+    """Entries of the previous run keyed by relative path, empty for missing or old text manifests."""
+    try:
+        with open(Path(dest_dir) / MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["files"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return {}
+
+
+def save_manifest(dest_dir, manifest: List[dict]) -> Path:
+    manifest_file = Path(dest_dir) / MANIFEST_NAME
+    tmp = manifest_file.with_name(f".{MANIFEST_NAME}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": {item["rel_path"]: item for item in manifest}}, f, indent=1)
+    # Set secure permissions for manifest file
+    os.chmod(tmp, stat.S_IRUSR | stat.S_IWUSR)
+    os.replace(tmp, manifest_file)
+    return manifest_file
+
+
+def unchanged_copy(item: dict, previous: Optional[dict]) -> bool:
+    """Whether the copy of the previous run still matches both the source and what was written."""
+    if previous is None or previous.get("hash") != item["hash"]:
+        return False
+    try:
+        st = os.stat(item["dest_path"])
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == (previous.get("dest_size"), previous.get("dest_mtime_ns"))
+
+
+def create_file_manifest(source_dir, dest_dir, previous: Optional[Dict[str, dict]] = None,
+                         workers: int = DEFAULT_WORKERS) -> List[dict]:
+    """
+    Create a manifest of the source files with their hashes. Hashes of files
+    whose size and mtime match the previous manifest are taken from it.
+    """
+    previous = previous or {}
     manifest = []
     source_path = Path(source_dir)
     dest_path = Path(dest_dir)
 
-    for src_file in source_path.rglob('*'):
+    for src_file in sorted(source_path.rglob('*')):
         if src_file.is_file():
-            rel_path = src_file.relative_to(source_path)
-            dest_file = dest_path / rel_path
-
-            manifest.append({
+            st = src_file.stat()
+            rel_path = str(src_file.relative_to(source_path))
+            item = {
+                'rel_path': rel_path,
                 'source_path': str(src_file),
-                'dest_path': str(dest_file),
-                'hash': calculate_file_hash(src_file),
-                'size': src_file.stat().st_size,
-                'timestamp': datetime.datetime.fromtimestamp(src_file.stat().st_mtime).isoformat()
-            })
-
+                'dest_path': str(dest_path / rel_path),
+                'hash': None,
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'timestamp': datetime.fromtimestamp(st.st_mtime).isoformat()
+            }
+            old = previous.get(rel_path)
+            if old and (old.get('size'), old.get('mtime_ns')) == (st.st_size, st.st_mtime_ns):
+                item['hash'] = old.get('hash')
+            manifest.append(item)
+
+    pending = [item for item in manifest if not item['hash']]
+    for item, digest in zip(pending, hash_files([Path(item['source_path']) for item in pending], workers)):
+        item['hash'] = digest
     return manifest
 
-def verify_copy(manifest):
-    """Verify that files were copied correctly using their hashes"""
-    all_valid = True
-    for file_info in manifest:
-        dest_path = Path(file_info['dest_path'])
-        if not dest_path.exists():
-            print(f"❌ Missing file: {dest_path}")
-            all_valid = False
-            continue
-
-        dest_hash = calculate_file_hash(dest_path)
-        if dest_hash != file_info['hash']:
-            print(f"❌ Hash mismatch for {dest_path}")
-            all_valid = False
-        else:
-            print(f"✅ Verified: {dest_path}")
 
-    return all_valid
+def clone_file(src_fd: int, dst_fd: int, size: int) -> str:
+    """Copies src_fd to dst_fd inside the kernel where possible, returns the method used."""
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return "reflink"
+    except OSError as e:
+        if e.errno not in COPY_FALLBACK_ERRORS:
+            raise
+    if hasattr(os, "copy_file_range"):
+        copied = 0
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+            return "copy_file_range"
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRORS or copied:
+                raise
+    while True:
+        block = os.read(src_fd, HASH_BLOCK)
+        if not block:
+            return "read/write"
+        view = memoryview(block)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+
+def copy_file(item: dict) -> str:
+    """
+    Copies one manifest item next to its destination, verifies the copy
+    against the source hash and renames it into place. Returns the copy method.
+    """
+    src_path = Path(item['source_path'])
+    dst_path = Path(item['dest_path'])
 
-def copy_with_permissions(src, dst, manifest_path):
+    # Create parent directories if they don't exist
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst_path.with_name(f".{dst_path.name}.tmp")
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        # Set secure permissions (600) for files
+        dst_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        try:
+            method = clone_file(src_fd, dst_fd, item['size'])
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    try:
+        if calculate_file_hash(tmp) != item['hash']:
+            raise OSError(f"Hash mismatch for {dst_path}")
+        shutil.copystat(src_path, tmp)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IWUSR)
+        os.replace(tmp, dst_path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return method
+
+
+def copy_with_permissions(src, dst, manifest_path=None, workers=DEFAULT_WORKERS, force=False):
     """
-    Copy run_files directory to ~/.yubiCrypt/run_files/
-    with proper permissions and verification
+    Copy a directory tree to dst with proper permissions and verification,
+    skipping the files that are unchanged since the previous run
     """
     try:
         source_dir = Path(src).resolve()
@@ -117,52 +215,48 @@ def copy_with_permissions(src, dst, manifest_path):
         print(f"📁 Copying files from {source_dir} to {dest_dir}")
         print("=" * 60)
 
-        # Create manifest before copying
-        manifest = create_file_manifest(source_dir, dest_dir)
+        # Create manifest before copying, reusing the hashes of unchanged sources
+        previous = {} if force else load_manifest(dest_dir)
+        with span("manifest"):
+            manifest = create_file_manifest(source_dir, dest_dir, previous, workers)
+
+        changed = [item for item in manifest if not unchanged_copy(item, previous.get(item['rel_path']))]
+
+        # Copy and verify the changed files
+        methods: Dict[str, int] = {}
+        failed = []
+        with span("copy", files=len(changed)), ThreadPoolExecutor(max(1, workers)) as executor:
+            futures = [(item, executor.submit(copy_file, item)) for item in changed]
+            for item, future in futures:
+                try:
+                    method = future.result()
+                except OSError as e:
+                    print(f"❌ {item['rel_path']}: {e}")
+                    failed.append(item)
+                    continue
+                print(f"Copied: {item['rel_path']} ({method})")
+                methods[method] = methods.get(method, 0) + 1
+
+        if failed:
+            print("❌ Some files failed verification!")
+            return False
 
-        # Copy files
         for item in manifest:
-            src_path = Path(item['source_path'])
-            dst_path = Path(item['dest_path'])
-
-            # Create parent directories if they don't exist
-            dst_path.parent.mkdir(parents=True, exist_ok=True)
-
-            # Copy file
-            print(f"Copying: {src_path.relative_to(source_dir)}")
-            shutil.copy2(src_path, dst_path)
-
-            # Set secure permissions (600) for files
-            os.chmod(dst_path, stat.S_IRUSR | stat.S_IWUSR)
+            dest_stat = os.stat(item['dest_path'])
+            item['dest_size'] = dest_stat.st_size
+            item['dest_mtime_ns'] = dest_stat.st_mtime_ns
 
         # Save manifest
-        manifest_file = dest_dir / "copy_manifest.txt"
-        with file_manager(manifest_file, 'w') as f:
-            for item in manifest:
-                f.write(f"File: {item['dest_path']}\n")
-                f.write(f"Hash: {item['hash']}\n")
-                f.write(f"Size: {item['size']} bytes\n")
-                f.write(f"Timestamp: {item['timestamp']}\n")
-                f.write("-" * 50 + "\n")
-
-        # Set secure permissions for manifest file
-        os.chmod(manifest_file, stat.S_IRUSR | stat.S_IWUSR)
-
-        print("🔍 Verifying copied files...")
-        print("=" * 60)
-
-        # Verify the copy
-        if verify_copy(manifest):
-            print("✅ All files copied and verified successfully!")
-            print(f"📝 Manifest saved to: {manifest_file}")
-        else:
-            print("❌ Some files failed verification!")
-            return False
+        manifest_file = save_manifest(dest_dir, manifest)
+        print("✅ All files copied and verified successfully!")
+        print(f"📝 Manifest saved to: {manifest_file}")
 
         # Print summary
         total_size = sum(item['size'] for item in manifest)
         print("📊 Summary:")
-        print(f"Total files copied: {len(manifest)}")
+        print(f"Total files: {len(manifest)}, copied: {len(changed)}, unchanged: {len(manifest) - len(changed)}")
+        if methods:
+            print("Copy methods: " + ", ".join(f"{method} {count}" for method, count in sorted(methods.items())))
         print(f"Total size: {total_size:,} bytes")
         print(f"Manifest location: {manifest_file}")
 
@@ -172,7 +266,17 @@ def copy_with_permissions(src, dst, manifest_path):
         print(f"Error during copy operation: {e}", file=sys.stderr)
         return False
 
-def main():
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deploy run_files and src to the home directory.")
+    parser.add_argument("--force", action="store_true", help="ignore the previous manifests and copy everything")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"files hashed and copied at once (default: {DEFAULT_WORKERS})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     print('\n--------------------------------------------')
     print(__file__)
     print('--------------------------------------------\n')
@@ -186,9 +290,6 @@ def main():
     # Destination directory in ~/dcde/src
     dest_dir_2 = Path.home() / "dcde" / "src"
 
-    # Manifest path
-    manifest_path = dest_dir / "copy_manifest.txt"
-
     print(f"🚀 Starting secure copy operation...")
 
 
@@ -200,18 +301,13 @@ def main():
         sys.exit(1)
 
     # Perform the copy for .yubiCrypt and dcde
-    if copy_with_permissions(source_dir, dest_dir, manifest_path):
-        print("✨ Operation completed successfully!")
-    else:
-        print("❌ Operation failed!")
-        return False
-        sys.exit(1)
-    if copy_with_permissions(source_dir_2, dest_dir_2, manifest_path):
-        print("✨ Operation completed successfully!")
-        return True
-    else:
-        print("❌ Operation failed!")
-        sys.exit(1)
+    for source, dest in ((source_dir, dest_dir), (source_dir_2, dest_dir_2)):
+        if copy_with_permissions(source, dest, dest / MANIFEST_NAME, args.workers, args.force):
+            print("✨ Operation completed successfully!")
+        else:
+            print("❌ Operation failed!")
+            sys.exit(1)
+    return True
 
 if __name__ == "__main__":
     main()
@@ -219,3 +315,4 @@ if __name__ == "__main__":
 # Created/Modified files during execution:
 # - ~/.yubiCrypt/run_files/* (copied files)
 # - ~/.yubiCrypt/run_files/copy_manifest.txt
+# - ~/dcde/src/* and ~/dcde/src/copy_manifest.txt
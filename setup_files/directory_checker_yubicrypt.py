@@ -8,36 +8,21 @@ import pwd
 import grp
 import platform
 from typing import Any
-import time
 from contextlib import contextmanager
 from typing import Generator, IO, Any
-from datetime import datetime
 
 @contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
+def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
+    file: IO= open(path, mode)
+    print('Opening file')
     try:
-        yield
+        yield file
+    except Exception as e:
+        print(e)
     finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
-
-
-@contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
-        print('Opening file')
-        try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
+        print('Closing file...')
+        if file:
+            file.close()
 
 
 def get_user_info():
@@ -156,7 +141,7 @@ def main() -> bool:
     return True
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
 
 # Created/Modified files during execution:
 # - ~/.yubiCrypt/ (directory)
@@ -97,7 +97,7 @@ def main() -> bool:
             return False
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
 
 # Created/Modified files during execution:
 # No files are created or modified by this script
@@ -52,12 +52,23 @@ def install_dependencies():
         print(f"Unsupported operating system: {system}")
         sys.exit(1)
 
+def check_plugin_installed():
+    """Check if age-plugin-yubikey is already on PATH"""
+    try:
+        subprocess.run(["age-plugin-yubikey", "--version"], check=True, capture_output=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
 def install_age_plugin_yubikey():
     """Install age-plugin-yubikey using cargo"""
+    if check_plugin_installed():
+        print("age-plugin-yubikey is already installed, skipping cargo install.")
+        return
     print("Installing age-plugin-yubikey...")
     os.system('cargo install age-plugin-yubikey')
 
-def main() -> bool:
+def main(deps_only=False) -> bool:
     print('\n--------------------------------------------')
     print(__file__)
     print('--------------------------------------------\n')
@@ -71,6 +82,10 @@ def main() -> bool:
 
         # Install system dependencies
         install_dependencies()
+        if deps_only:
+            # installer.py runs cargo install itself, as the user
+            print("Dependencies of age-plugin-yubikey installed.")
+            return True
 
         # Install age-plugin-yubikey
         install_age_plugin_yubikey()
@@ -83,7 +98,7 @@ def main() -> bool:
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    main(deps_only="--deps-only" in sys.argv[1:])
 
 # Created/Modified files during execution:
 # Note: The script itself doesn't create files directly, but the installation process will create:
@@ -0,0 +1,321 @@
+#!/bin/env python3
+"""
+Dependency graph runner behind installer.py.
+
+Every Step names the steps it requires, an optional check telling whether it
+is already satisfied (age new enough, plugin on PATH, ...) and an optional
+lock shared with steps that must not overlap: package managers hold a global
+lock, cargo its package cache, and interactive steps (sudo and input prompts)
+the terminal. Ready steps run at once on a small pool. The output of
+non-interactive commands is captured and printed when they finish, so it
+never mixes with a prompt.
+
+Progress is written to a state file after every step. A run that failed is
+resumed by the next one, which does not repeat the steps that succeeded.
+After a complete run the next one starts over and relies on the checks.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from instrument import span
+
+STATE_VERSION = 1
+DEFAULT_WORKERS = 4
+TERMINAL_LOCK = "terminal"
+OUTPUT_TAIL = 20
+
+# Statuses of a step in the state file and the summary
+DONE = "done"
+SATISFIED = "satisfied"
+RESUMED = "resumed"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+SUCCEEDED = (DONE, SATISFIED, RESUMED, SKIPPED)
+
+Action = Union[Sequence[str], Callable[[], object]]
+
+
+def command_output(command: Sequence[str]) -> Optional[str]:
+    """stdout of a command, None if it is missing or fails."""
+    try:
+        result = subprocess.run(list(command), capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def command_succeeds(command: Sequence[str]) -> bool:
+    return command_output(command) is not None
+
+
+def parse_version(text: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """First x.y[.z] in text, "v1.2.1-simulator" -> (1, 2, 1)."""
+    match = re.search(r"(\d+)\.(\d+)(?:\.(\d+))?", text or "")
+    if not match:
+        return None
+    return tuple(int(part or 0) for part in match.groups())
+
+
+def version_at_least(command: Sequence[str], minimum: Tuple[int, ...]) -> bool:
+    version = parse_version(command_output(command))
+    return version is not None and version >= minimum
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Step:
+    """
+    One installation step. action is a command (list of arguments, run from
+    cwd) or a callable that raises on failure. After the action ran the check
+    must hold, otherwise the step failed.
+    """
+
+    def __init__(self, name: str, action: Action, requires: Iterable[str] = (),
+                 check: Optional[Callable[[], bool]] = None, lock: Optional[str] = None,
+                 interactive: bool = False, cwd: Optional[str] = None, description: str = "") -> None:
+        self.name = name
+        self.action = action
+        self.requires = tuple(requires)
+        self.check = check
+        self.interactive = interactive
+        self.locks = {lock} if lock else set()
+        if interactive:
+            self.locks.add(TERMINAL_LOCK)
+        self.cwd = cwd
+        self.description = description or name
+
+    def run(self) -> str:
+        """Runs the action, returns the captured output of a non-interactive command."""
+        if callable(self.action):
+            self.action()
+            return ""
+        try:
+            result = subprocess.run(list(self.action), cwd=self.cwd, text=True, stdin=None if self.interactive
+                                    else subprocess.DEVNULL, capture_output=not self.interactive)
+        except OSError as e:
+            raise StepFailed(f"{self.action[0]}: {e}")
+        output = (result.stdout or "") + (result.stderr or "")
+        if result.returncode != 0:
+            tail = "\n".join(output.splitlines()[-OUTPUT_TAIL:])
+            message = f"{' '.join(self.action)} exited with {result.returncode}"
+            raise StepFailed(f"{message}\n{tail}" if tail else message)
+        return output
+
+
+class Installer:
+    """Runs a set of steps in dependency order, concurrently where the graph and the locks allow."""
+
+    def __init__(self, steps: Iterable[Step], state_path: str, workers: int = DEFAULT_WORKERS,
+                 force: bool = False, restart: bool = False, verbose: bool = False) -> None:
+        self.steps: Dict[str, Step] = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError(f"Duplicate step '{step.name}'")
+            self.steps[step.name] = step
+        for step in self.steps.values():
+            for name in step.requires:
+                if name not in self.steps:
+                    raise ValueError(f"Step '{step.name}' requires unknown step '{name}'")
+        self.order = self._topological_order()
+        self.state_path = state_path
+        self.workers = max(1, workers)
+        self.force = force
+        self.verbose = verbose
+        self.state = self._read_state(restart)
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        visiting = set()
+
+        def visit(name: str, path: Tuple[str, ...]) -> None:
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + (name,))}")
+            visiting.add(name)
+            for required in self.steps[name].requires:
+                visit(required, path + (name,))
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, ())
+        return order
+
+    def select(self, only: Iterable[str] = (), skip: Iterable[str] = ()) -> List[str]:
+        """Steps to run: only and everything they require (default: all), minus skip."""
+        for name in list(only) + list(skip):
+            if name not in self.steps:
+                raise ValueError(f"Unknown step '{name}', choose from {', '.join(self.order)}")
+        selected = set()
+
+        def add(name: str) -> None:
+            if name not in selected:
+                selected.add(name)
+                for required in self.steps[name].requires:
+                    add(required)
+
+        for name in only or self.order:
+            add(name)
+        return [name for name in self.order if name in selected and name not in set(skip)]
+
+    def _read_state(self, restart: bool) -> dict:
+        fresh = {"version": STATE_VERSION, "complete": False, "started": datetime.now().isoformat(timespec="seconds"),
+                 "steps": {}}
+        if restart:
+            return fresh
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return fresh
+        if state.get("version") != STATE_VERSION or state.get("complete"):
+            return fresh
+        return state
+
+    def _save_state(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def _record(self, name: str, status: str, seconds: float = 0.0, error: Optional[str] = None) -> None:
+        entry = {"status": status, "seconds": round(seconds, 3),
+                 "finished": datetime.now().isoformat(timespec="seconds")}
+        if error:
+            entry["error"] = error
+        self.state["steps"][name] = entry
+        self._save_state()
+
+    def _check(self, step: Step) -> Tuple[bool, float]:
+        """Runs in a worker, without the step's locks: returns (satisfied, seconds)."""
+        start = time.perf_counter()
+        try:
+            satisfied = bool(step.check and step.check())
+        except Exception:
+            satisfied = False
+        return satisfied, time.perf_counter() - start
+
+    def _execute(self, step: Step) -> Tuple[str, str, float]:
+        """Runs in a worker, holding the step's locks: returns (status, output or error, seconds)."""
+        start = time.perf_counter()
+        with span("install_step", step=step.name):
+            try:
+                output = step.run()
+                if step.check and not step.check():
+                    raise StepFailed("still not satisfied after running it")
+                return DONE, output, time.perf_counter() - start
+            except Exception as e:
+                return FAILED, str(e), time.perf_counter() - start
+
+    def run(self, only: Iterable[str] = (), skip: Iterable[str] = ()) -> bool:
+        skip = list(skip)
+        names = self.select(only, skip)
+        outcome: Dict[str, str] = {name: SKIPPED for name in skip}
+        for name in names:
+            if self.state["steps"].get(name, {}).get("status") in SUCCEEDED:
+                outcome[name] = RESUMED
+        if any(status == RESUMED for status in outcome.values()):
+            print(f"Resuming the run of {self.state['started']}, use --restart to run every step again")
+        pending = [name for name in names if name not in outcome]
+        # Checks run as soon as the requirements are met, actions also wait for their locks
+        waiting: List[Step] = []
+        running: Dict[Future, Tuple[Step, bool]] = {}
+        spent: Dict[str, float] = {}
+        held = set()
+        backlog: List[str] = []
+        start = time.perf_counter()
+
+        def flush_backlog() -> None:
+            # While an interactive step owns the terminal everything else waits in the backlog
+            if not any(step.interactive and acting for step, acting in running.values()):
+                for text in backlog:
+                    print(text, flush=True)
+                backlog.clear()
+
+        def finish(step: Step, status: str, detail: str = "") -> None:
+            outcome[step.name] = status
+            seconds = spent.get(step.name, 0.0)
+            self._record(step.name, status, seconds, detail if status == FAILED else None)
+            if status == FAILED:
+                backlog.append(f"❌ {step.name} failed after {seconds:.1f}s: {detail}")
+            else:
+                if detail and self.verbose:
+                    backlog.append(detail.rstrip())
+                backlog.append(f"✅ {step.name}: {status} ({seconds:.1f}s)")
+
+        with span("install", steps=len(names)), ThreadPoolExecutor(self.workers) as executor:
+            while pending or waiting or running:
+                for name in list(pending):
+                    step = self.steps[name]
+                    required = [outcome.get(r, SKIPPED if r not in names else None) for r in step.requires]
+                    if any(status in (FAILED, BLOCKED) for status in required):
+                        pending.remove(name)
+                        outcome[name] = BLOCKED
+                        self._record(name, BLOCKED)
+                        backlog.append(f"⏭️  {name}: blocked by a failed requirement")
+                    elif None not in required and len(running) < self.workers:
+                        pending.remove(name)
+                        if self.force or step.check is None:
+                            waiting.append(step)
+                        else:
+                            running[executor.submit(self._check, step)] = (step, False)
+                for step in list(waiting):
+                    if step.locks & held or len(running) >= self.workers:
+                        continue
+                    waiting.remove(step)
+                    held |= step.locks
+                    backlog.append(f"▶️  {step.name}: {step.description}")
+                    flush_backlog()
+                    running[executor.submit(self._execute, step)] = (step, True)
+                flush_backlog()
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step, acting = running.pop(future)
+                    if acting:
+                        held -= step.locks
+                        status, detail, seconds = future.result()
+                        spent[step.name] = spent.get(step.name, 0.0) + seconds
+                        finish(step, status, detail)
+                    else:
+                        satisfied, seconds = future.result()
+                        spent[step.name] = seconds
+                        if satisfied:
+                            finish(step, SATISFIED)
+                        else:
+                            waiting.append(step)
+                flush_backlog()
+
+        elapsed = time.perf_counter() - start
+        ok = all(outcome.get(name) in SUCCEEDED for name in names)
+        self.state["complete"] = ok
+        self._save_state()
+        self.print_summary(names, outcome, elapsed)
+        return ok
+
+    def print_summary(self, names: List[str], outcome: Dict[str, str], elapsed: float) -> None:
+        print("=" * 60)
+        print(f"{'step':<22} {'status':<10} {'seconds':>8}")
+        busy = 0.0
+        for name in names:
+            seconds = self.state["steps"].get(name, {}).get("seconds", 0.0) if outcome[name] != RESUMED else 0.0
+            busy += seconds
+            print(f"{name:<22} {outcome[name]:<10} {seconds:>8.1f}")
+        print(f"Wall clock {elapsed:.1f}s for {busy:.1f}s of steps, state in {self.state_path}")
+        if any(outcome[name] in (FAILED, BLOCKED) for name in names):
+            print("Fix the failed steps and run the installer again, it resumes where it stopped.", file=sys.stderr)
@@ -0,0 +1,8 @@
+"""
+Hardware-free stand-ins for ykman, age, age-keygen and age-plugin-yubikey.
+
+Put simulator/bin first on PATH (see ``python3 -m simulator --help``) and every
+yubiCrypt code path runs without a YubiKey. Behaviour is tuned through
+environment variables or a JSON file named by YUBICRYPT_SIM_CONFIG, see
+simulator/config.py.
+"""
@@ -0,0 +1,42 @@
+#!/bin/env python3
+"""
+Runs a command with the simulator first on PATH, or prints the export line.
+
+    python3 -m simulator env                   # eval "$(python3 -m simulator env)"
+    python3 -m simulator run -- python3 src/encrypt.py notes.txt
+"""
+
+import os
+import sys
+from pathlib import Path
+
+BIN_DIR = Path(__file__).resolve().parent / "bin"
+
+
+def simulated_env() -> dict:
+    env = dict(os.environ)
+    env["PATH"] = f"{BIN_DIR}{os.pathsep}{env.get('PATH', '')}"
+    return env
+
+
+def main(argv) -> int:
+    if not argv or argv[0] in ("-h", "--help"):
+        print(__doc__.strip())
+        return 0
+    if argv[0] == "env":
+        print(f'export PATH="{BIN_DIR}{os.pathsep}$PATH"')
+        return 0
+    if argv[0] == "run":
+        command = argv[1:]
+        if command[:1] == ["--"]:
+            command = command[1:]
+        if not command:
+            print("Usage: python3 -m simulator run -- <command>", file=sys.stderr)
+            return 1
+        os.execvpe(command[0], command, simulated_env())
+    print(f"Unknown command: {argv[0]}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+#!/bin/env python3
+"""
+Simulator settings.
+
+JSON file (YUBICRYPT_SIM_CONFIG) or environment, the environment wins:
+
+    serial       YUBICRYPT_SIM_SERIAL       inserted YubiKey serial            "12345678"
+    slots        YUBICRYPT_SIM_SLOTS        occupied PIV retired slots         "1,2"
+    latency      YUBICRYPT_SIM_LATENCY      seconds added to every ykman /
+                                            age-plugin-yubikey call            0
+    touch_delay  YUBICRYPT_SIM_TOUCH_DELAY  seconds per hardware unwrap        0
+    fail         YUBICRYPT_SIM_FAIL         failure probability per command,
+                                            "age-plugin-yubikey:0.5,ykman:1"   {}
+    log          YUBICRYPT_SIM_LOG          file recording every hardware op   None
+    install_delay YUBICRYPT_SIM_INSTALL_DELAY seconds per package manager
+                                            install and cargo install/build    0
+    packages     YUBICRYPT_SIM_PACKAGES     file listing the packages the fake
+                                            package managers and cargo
+                                            installed                          $TMPDIR/yubicrypt-sim-packages-UID
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+DEFAULTS = {
+    "serial": "12345678",
+    "slots": [1, 2],
+    "latency": 0.0,
+    "touch_delay": 0.0,
+    "fail": {},
+    "log": None,
+    "install_delay": 0.0,
+    "packages": os.path.join(tempfile.gettempdir(), f"yubicrypt-sim-packages-{os.getuid()}"),
+}
+
+
+def parse_fail(value: str) -> Dict[str, float]:
+    fail = {}
+    for item in value.split(","):
+        if item.strip():
+            command, _, probability = item.partition(":")
+            fail[command.strip()] = float(probability or 1)
+    return fail
+
+
+def load_config() -> dict:
+    config = dict(DEFAULTS)
+    path = os.environ.get("YUBICRYPT_SIM_CONFIG")
+    if path:
+        with open(path, "r") as f:
+            config.update(json.load(f))
+
+    env = os.environ
+    if "YUBICRYPT_SIM_SERIAL" in env:
+        config["serial"] = env["YUBICRYPT_SIM_SERIAL"]
+    if "YUBICRYPT_SIM_SLOTS" in env:
+        config["slots"] = [int(s) for s in env["YUBICRYPT_SIM_SLOTS"].split(",") if s.strip()]
+    if "YUBICRYPT_SIM_LATENCY" in env:
+        config["latency"] = float(env["YUBICRYPT_SIM_LATENCY"])
+    if "YUBICRYPT_SIM_TOUCH_DELAY" in env:
+        config["touch_delay"] = float(env["YUBICRYPT_SIM_TOUCH_DELAY"])
+    if "YUBICRYPT_SIM_FAIL" in env:
+        config["fail"] = parse_fail(env["YUBICRYPT_SIM_FAIL"])
+    if "YUBICRYPT_SIM_LOG" in env:
+        config["log"] = env["YUBICRYPT_SIM_LOG"]
+    if "YUBICRYPT_SIM_INSTALL_DELAY" in env:
+        config["install_delay"] = float(env["YUBICRYPT_SIM_INSTALL_DELAY"])
+    if "YUBICRYPT_SIM_PACKAGES" in env:
+        config["packages"] = env["YUBICRYPT_SIM_PACKAGES"]
+    config["serial"] = str(config["serial"])
+    return config
+
+
+def log_event(config: dict, message: str) -> None:
+    if config["log"]:
+        with open(config["log"], "a") as f:
+            f.write(f"{time.time():.6f} {message}\n")
+
+
+def maybe_fail(config: dict, command: str) -> None:
+    """Failure injection: exits like a broken device would."""
+    probability = config["fail"].get(command, 0.0)
+    if probability and random.random() < probability:
+        log_event(config, f"fail {command}")
+        print(f"Error: simulated failure of {command}", file=sys.stderr)
+        sys.exit(1)
+
+
+def installed_packages(config: dict) -> List[str]:
+    try:
+        with open(config["packages"], "r") as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def install_packages(config: dict, names: List[str]) -> None:
+    """Records packages as installed, after install_delay like a slow mirror."""
+    time.sleep(config["install_delay"])
+    known = set(installed_packages(config))
+    with open(config["packages"], "a") as f:
+        for name in names:
+            if name not in known:
+                f.write(f"{name}\n")
+                known.add(name)
+
+
+def identity_code(serial: str, slot: int) -> str:
+    return f"{int(serial):08X}{slot:02X}"
+
+
+def yubikey_identity(serial: str, slot: int) -> str:
+    return f"AGE-PLUGIN-YUBIKEY-1{identity_code(serial, slot)}"
+
+
+def yubikey_recipient(serial: str, slot: int) -> str:
+    return f"age1yubikey1{identity_code(serial, slot).lower()}"
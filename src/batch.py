@@ -0,0 +1,143 @@
+#!/bin/env python3
+
+import glob
+import os
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+DEFAULT_WORKERS: int = min(8, (os.cpu_count() or 1) * 2)
+
+# Kept here rather than in the modules writing them so the thin client (daemon_client.py) can sort paths cheaply
+BUNDLE_SUFFIX = ".ycb"
+STORE_SUFFIX = ".ycc"
+SEGMENT_SUFFIX = ".ycs"
+TEMP_SUFFIX = ".yctmp"
+
+# One suffix or several, as accepted by str.endswith
+Suffix = Union[str, Tuple[str, ...]]
+
+# The last error of each failed path, for yubiCryptd to send back with the results
+FAILURES: Dict[str, str] = {}
+FAILURES_LOCK = threading.Lock()
+
+
+def collect_files(targets: Iterable[str], recursive: bool = False,
+                  suffix: Optional[Suffix] = None, exclude_suffix: Optional[Suffix] = None,
+                  prune_suffix: Optional[Suffix] = None) -> Tuple[List[str], List[str]]:
+    """
+    Expands paths, globs and directories into a sorted list of unique files.
+    Returns (files, missing), missing being the targets that matched nothing.
+    """
+    files: List[str] = []
+    missing: List[str] = []
+    seen = set()
+
+    def add(path: str) -> None:
+        if suffix and not path.endswith(suffix):
+            return
+        if exclude_suffix and path.endswith(exclude_suffix):
+            return
+        real = os.path.realpath(path)
+        if real not in seen:
+            seen.add(real)
+            files.append(path)
+
+    for target in targets:
+        matches = glob.glob(target, recursive=recursive) if glob.has_magic(target) else [target]
+        if not matches:
+            print(f"No match for: {target}", file=sys.stderr)
+            missing.append(target)
+        for match in sorted(matches):
+            if os.path.isfile(match):
+                add(match)
+            elif prune_suffix and match.rstrip(os.sep).endswith(prune_suffix) and os.path.isdir(match):
+                continue
+            elif os.path.isdir(match):
+                if recursive:
+                    for root, dirs, names in os.walk(match):
+                        dirs[:] = sorted(d for d in dirs if not (prune_suffix and d.endswith(prune_suffix)))
+                        for name in sorted(names):
+                            path = os.path.join(root, name)
+                            if os.path.isfile(path):
+                                add(path)
+                else:
+                    print(f"Skipping directory (use --recursive): {match}", file=sys.stderr)
+            else:
+                print(f"File not found: {match}", file=sys.stderr)
+                missing.append(match)
+    return files, missing
+
+
+def find_directories(targets: Iterable[str], recursive: bool, suffix: Suffix,
+                     is_match: Callable[[str], bool]) -> List[str]:
+    """Returns the container directories named in targets, or found below them when recursive."""
+    found = []
+    expanded = []
+    for target in targets:
+        expanded.extend(sorted(glob.glob(target)) if glob.has_magic(target) else [target])
+    for target in expanded:
+        if is_match(target):
+            found.append(target)
+        elif recursive and os.path.isdir(target):
+            for root, dirs, _ in os.walk(target):
+                dirs.sort()
+                for name in [d for d in dirs if d.endswith(suffix)]:
+                    if is_match(os.path.join(root, name)):
+                        found.append(os.path.join(root, name))
+                dirs[:] = [d for d in dirs if not d.endswith(suffix)]
+    return found
+
+
+def run_batch(func: Callable[[str], bool], files: List[str],
+              workers: int = DEFAULT_WORKERS) -> Dict[str, bool]:
+    """Runs func on every file over a bounded worker pool, returning per-file results."""
+    # Imported here so the thin client (daemon_client.py) does not pay for it
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    results: Dict[str, bool] = {}
+    lock = threading.Lock()
+
+    def task(path: str) -> None:
+        try:
+            ok = bool(func(path))
+        except Exception as e:
+            print(f"Error processing {path}: {e}", file=sys.stderr)
+            record_failure(path, e)
+            ok = False
+        with lock:
+            results[path] = ok
+
+    if workers <= 1 or len(files) <= 1:
+        for path in files:
+            task(path)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(task, path) for path in files]
+            for future in as_completed(futures):
+                future.result()
+
+    return {path: results.get(path, False) for path in files}
+
+
+def record_failure(path: str, error: Exception) -> None:
+    with FAILURES_LOCK:
+        FAILURES[path] = str(error)
+
+
+def take_failures(paths: Iterable[str]) -> Dict[str, str]:
+    """Removes and returns the errors recorded for paths."""
+    with FAILURES_LOCK:
+        return {path: FAILURES.pop(path) for path in paths if path in FAILURES}
+
+
+def print_summary(results: Dict[str, bool], action: str) -> None:
+    """Prints per-file outcomes followed by totals."""
+    failed = [path for path, ok in results.items() if not ok]
+    if len(results) > 1:
+        print(f"\n{action} summary:")
+        print("-" * 40)
+        for path, ok in results.items():
+            print(f"{'OK    ' if ok else 'FAILED'} {path}")
+        print("-" * 40)
+    print(f"{len(results) - len(failed)}/{len(results)} files {action.lower()}ed, {len(failed)} failed")
@@ -0,0 +1,164 @@
+#!/bin/env python3
+"""
+yubiCrypt bundles: many files encrypted under one batch key.
+
+A bundle is a directory ending in ``.ycb``:
+
+    key.age      batch identity (age X25519), wrapped once to the YubiKey recipients
+    index.age    JSON index of the entries, encrypted to the batch recipient
+    blobs/       one age file per entry, encrypted to the batch recipient
+
+Decrypting a bundle costs one hardware unwrap of ``key.age``; every entry
+after that is plain software X25519.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+from batch import BUNDLE_SUFFIX, DEFAULT_WORKERS, TEMP_SUFFIX, find_directories, run_batch
+from durable import GroupCommit, atomic_output, fsync_directory
+from engine import AgeEngine, IdentityFiles, select_engine
+from instrument import span
+
+BUNDLE_VERSION = 1
+
+
+def is_bundle(path: str) -> bool:
+    return (os.path.isdir(path) and os.path.isfile(os.path.join(path, "key.age"))
+            and os.path.isfile(os.path.join(path, "index.age")))
+
+
+def find_bundles(targets: List[str], recursive: bool = False) -> List[str]:
+    """Returns the bundles named in targets, or found below them when recursive."""
+    return find_directories(targets, recursive, BUNDLE_SUFFIX, is_bundle)
+
+
+def wrap_key(identity: str, recipients: List[str], key_path: str, engine: AgeEngine) -> None:
+    """Encrypts the batch identity to the YubiKey recipients."""
+    with atomic_output(key_path) as tmp, open(tmp, "wb") as f:
+        f.write(engine.encrypt_bytes(f"{identity}\n".encode(), recipients))
+
+
+def unwrap_key(key_path: str, identity_file: IdentityFiles, engine: AgeEngine) -> str:
+    """Decrypts the batch identity with the YubiKey; this is the only hardware operation."""
+    with open(key_path, "rb") as f, span("hardware_unwrap"):
+        return engine.decrypt_bytes(f.read(), identity_file=identity_file).decode().strip()
+
+
+def entry_paths(files: List[str], bundle_path: str) -> Dict[str, str]:
+    """Maps each file to its path relative to the directory holding the bundle."""
+    base = os.path.dirname(os.path.abspath(bundle_path))
+    entries = {}
+    for path in files:
+        rel = os.path.relpath(os.path.abspath(path), base)
+        if rel.startswith(os.pardir + os.sep) or rel == os.pardir:
+            raise ValueError(f"{path} is outside {base}")
+        entries[path] = rel
+    return entries
+
+
+def create_bundle(files: List[str], bundle_path: str, recipients: List[str],
+                  workers: int = DEFAULT_WORKERS, engine: Optional[AgeEngine] = None,
+                  remover: Optional[Callable[[str], None]] = None) -> Dict[str, bool]:
+    """
+    Encrypts files into a new bundle and removes the plaintexts that made it in
+    (os.remove by default). The bundle is built in a temporary sibling
+    directory and only renamed into place once complete.
+    """
+    engine = engine or select_engine()
+    if not bundle_path.endswith(BUNDLE_SUFFIX):
+        bundle_path += BUNDLE_SUFFIX
+    if os.path.exists(bundle_path):
+        raise FileExistsError(f"Bundle already exists: {bundle_path}")
+
+    rel_paths = entry_paths(files, bundle_path)
+    parent = os.path.dirname(os.path.abspath(bundle_path))
+    build_path = tempfile.mkdtemp(dir=parent, prefix=f".{os.path.basename(bundle_path)}.", suffix=TEMP_SUFFIX)
+    try:
+        blobs_dir = os.path.join(build_path, "blobs")
+        os.mkdir(blobs_dir, mode=0o700)
+
+        identity, batch_recipient = engine.generate_identity()
+        wrap_key(identity, recipients, os.path.join(build_path, "key.age"), engine)
+
+        blob_names = {path: f"{n:06d}.age" for n, path in enumerate(files)}
+
+        def encrypt_entry(path: str) -> bool:
+            with atomic_output(os.path.join(blobs_dir, blob_names[path])) as tmp:
+                engine.encrypt_file(path, tmp, [batch_recipient])
+            return True
+
+        results = run_batch(encrypt_entry, files, workers)
+
+        index = {
+            "version": BUNDLE_VERSION,
+            "entries": [
+                {"path": rel_paths[path], "blob": blob_names[path], "size": os.path.getsize(path)}
+                for path in files if results[path]
+            ],
+        }
+        with atomic_output(os.path.join(build_path, "index.age")) as tmp, open(tmp, "wb") as f:
+            f.write(engine.encrypt_bytes(json.dumps(index).encode(), [batch_recipient]))
+
+        with span("fsync_directory"):
+            for directory in (blobs_dir, build_path):
+                fsync_directory(directory)
+        os.replace(build_path, bundle_path)
+    except BaseException:
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+
+    # The plaintexts only go once the whole bundle is on disk
+    with span("fsync_directory"):
+        fsync_directory(parent)
+    with span("file_removal", files=len(index["entries"])):
+        for path, ok in results.items():
+            if ok:
+                (remover or os.remove)(path)
+    print(f"\tSUCCESSFULLY BUNDLED! {len(index['entries'])} files ==> {bundle_path}")
+    return results
+
+
+def read_index(bundle_path: str, batch_identity: str, engine: AgeEngine) -> dict:
+    with open(os.path.join(bundle_path, "index.age"), "rb") as f:
+        index = json.loads(engine.decrypt_bytes(f.read(), identity=batch_identity))
+    if index.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version: {index.get('version')}")
+    return index
+
+
+def extract_bundle(bundle_path: str, identity_file: IdentityFiles, workers: int = DEFAULT_WORKERS,
+                   engine: Optional[AgeEngine] = None) -> Dict[str, bool]:
+    """Restores every entry of a bundle next to it, removing the bundle if all succeed."""
+    engine = engine or select_engine()
+    bundle_path = bundle_path.rstrip(os.sep)
+    batch_identity = unwrap_key(os.path.join(bundle_path, "key.age"), identity_file, engine)
+    index = read_index(bundle_path, batch_identity, engine)
+
+    base = os.path.realpath(os.path.dirname(os.path.abspath(bundle_path)))
+    targets = {}
+    for entry in index["entries"]:
+        target = os.path.realpath(os.path.join(base, entry["path"]))
+        if os.path.commonpath([base, target]) != base:
+            raise ValueError(f"Bundle entry escapes {base}: {entry['path']}")
+        targets[target] = os.path.join(bundle_path, "blobs", os.path.basename(entry["blob"]))
+
+    commit = GroupCommit(len(targets))
+
+    def decrypt_entry(target: str) -> bool:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with atomic_output(target) as tmp:
+            engine.decrypt_file(targets[target], tmp, identity=batch_identity)
+        commit.add(target)
+        return True
+
+    results = run_batch(decrypt_entry, list(targets), workers)
+    commit.flush()
+    if all(results.values()):
+        with span("file_removal"):
+            shutil.rmtree(bundle_path)
+        print(f"\tSUCCESSFULLY UNBUNDLED! {bundle_path} ==> {len(results)} files")
+    return results
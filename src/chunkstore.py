@@ -0,0 +1,362 @@
+#!/bin/env python3
+"""
+yubiCrypt chunk stores: files cut into content-defined chunks, each distinct
+chunk encrypted and stored only once.
+
+A chunk store is a directory ending in ``.ycc``:
+
+    store.json           format version, chunking parameters and the store recipient
+    key.age              store identity and chunk key, wrapped to the YubiKey recipients
+    chunks/xx/ID.age     one age file per distinct chunk, encrypted to the store recipient
+    manifests/ID.age     one per stored file: path, size and chunk list, encrypted likewise
+
+Chunks are named by an HMAC of their content under the chunk key, so equal
+chunks of different files or versions are stored once without their names
+revealing the content. The chunk key is cached in ~/.yubiCrypt/chunkstores/
+when the store is created (or first unwrapped on another machine), so adding
+files needs no YubiKey. Restoring costs one hardware unwrap of key.age, and
+every chunk and manifest is checked against its HMAC.
+
+Chunk boundaries depend only on the bytes just before them (see Chunker) and
+on the chunk key, so an insertion only changes the chunks around it and the
+boundaries do not fingerprint the content either.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import threading
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from batch import DEFAULT_WORKERS, STORE_SUFFIX, find_directories
+from durable import GroupCommit, atomic_output, fsync_directory
+from engine import AgeEngine, IdentityFiles, select_engine
+from instrument import span
+
+STORE_VERSION = 1
+KEYS_CACHE = os.path.expanduser("~/.yubiCrypt/chunkstores")
+
+MIN_CHUNK = 256 << 10
+AVERAGE_BITS = 20  # 1 MiB
+MAX_CHUNK = 4 << 20
+
+
+def is_store(path: str) -> bool:
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "store.json"))
+
+
+def find_stores(targets: List[str], recursive: bool = False) -> List[str]:
+    """Returns the chunk stores named in targets, or found below them when recursive."""
+    return find_directories(targets, recursive, STORE_SUFFIX, is_store)
+
+
+class Chunker:
+    """
+    Content-defined chunking at C speed. Bytes are mapped to one keyed bit each
+    (bytes.translate) and every "0 followed by ANCHOR ones" in that bit stream is
+    a candidate (bytes.find); a candidate ends a chunk when a keyed CRC of the
+    WINDOW bytes before it matches the mask. Both only look at the bytes just
+    before the cut, so an edit moves the boundaries around it and no others.
+    """
+
+    ANCHOR = 8
+    WINDOW = 64
+
+    def __init__(self, chunk_key: bytes, min_size: int = MIN_CHUNK, average_bits: int = AVERAGE_BITS,
+                 max_size: int = MAX_CHUNK) -> None:
+        # Exactly half of the byte values map to 1, which half depends on the key
+        order = sorted(range(256), key=lambda b: hmac.new(chunk_key, b"bit%d" % b, hashlib.sha256).digest())
+        ones = set(order[:128])
+        self.table = bytes(1 if b in ones else 0 for b in range(256))
+        self.pattern = b"\x00" + b"\x01" * self.ANCHOR
+        self.seed = int.from_bytes(hmac.new(chunk_key, b"crc", hashlib.sha256).digest()[:4], "big")
+        # A random candidate shows up every 2 ** (ANCHOR + 1) bytes, the CRC does the rest
+        self.mask = (1 << max(0, average_bits - self.ANCHOR - 1)) - 1
+        self.min_size = max(min_size, self.WINDOW)
+        self.max_size = max(max_size, self.min_size)
+
+    def find_cut(self, buffer: bytearray) -> int:
+        """Length of the next chunk at the start of buffer."""
+        end = min(len(buffer), self.max_size)
+        if end <= self.min_size:
+            return end
+        offset = self.min_size - len(self.pattern)
+        bits = buffer[offset:end].translate(self.table)
+        position = 0
+        while True:
+            found = bits.find(self.pattern, position)
+            if found < 0:
+                return end
+            cut = offset + found + len(self.pattern)
+            if not zlib.crc32(buffer[cut - self.WINDOW:cut], self.seed) & self.mask:
+                return cut
+            position = found + 1
+
+    def chunks(self, f: BinaryIO) -> Iterator[bytes]:
+        """Yields the content-defined chunks of a file object."""
+        buffer = bytearray()
+        eof = False
+        while True:
+            while not eof and len(buffer) < self.max_size:
+                block = f.read(max(1 << 20, self.max_size))
+                if block:
+                    buffer += block
+                else:
+                    eof = True
+            if not buffer:
+                return
+            cut = self.find_cut(buffer)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+
+
+class ChunkStore:
+    """A chunk store directory and the chunks it already holds."""
+
+    def __init__(self, path: str, engine: Optional[AgeEngine] = None) -> None:
+        self.path = path.rstrip(os.sep)
+        self.engine = engine or select_engine()
+        with open(os.path.join(self.path, "store.json"), "r") as f:
+            config = json.load(f)
+        if config.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {config.get('version')}")
+        self.id: str = config["id"]
+        self.recipient: str = config["recipient"]
+        self.min_chunk: int = config["min_chunk"]
+        self.average_bits: int = config["average_bits"]
+        self.max_chunk: int = config["max_chunk"]
+        self.chunks_dir = os.path.join(self.path, "chunks")
+        self.manifests_dir = os.path.join(self.path, "manifests")
+        self.known = {name[:-len(".age")] for _, _, names in os.walk(self.chunks_dir)
+                      for name in names if name.endswith(".age")}
+        self._lock = threading.Lock()
+        self._chunk_key: Optional[bytes] = None
+        self._dirty_dirs = set()
+
+    @classmethod
+    def create(cls, path: str, recipients: List[str], engine: Optional[AgeEngine] = None,
+               min_chunk: int = MIN_CHUNK, average_bits: int = AVERAGE_BITS,
+               max_chunk: int = MAX_CHUNK) -> "ChunkStore":
+        """Creates an empty store whose key is wrapped to the YubiKey recipients."""
+        engine = engine or select_engine()
+        if not path.endswith(STORE_SUFFIX):
+            path += STORE_SUFFIX
+        if os.path.exists(path):
+            raise FileExistsError(f"Chunk store already exists: {path}")
+        if not 0 < min_chunk <= max_chunk:
+            raise ValueError(f"Invalid chunk sizes: {min_chunk}-{max_chunk}")
+
+        identity, recipient = engine.generate_identity()
+        chunk_key = os.urandom(32)
+        os.makedirs(os.path.join(path, "chunks"), mode=0o700)
+        os.makedirs(os.path.join(path, "manifests"), mode=0o700)
+        with atomic_output(os.path.join(path, "key.age")) as tmp, open(tmp, "wb") as f:
+            f.write(engine.encrypt_bytes(f"# chunk-key: {chunk_key.hex()}\n{identity}\n".encode(), recipients))
+        config = {
+            "version": STORE_VERSION,
+            "id": uuid.uuid4().hex,
+            "recipient": recipient,
+            "min_chunk": min_chunk,
+            "average_bits": average_bits,
+            "max_chunk": max_chunk,
+        }
+        with atomic_output(os.path.join(path, "store.json")) as tmp, open(tmp, "w") as f:
+            json.dump(config, f, indent=2)
+        # The sources of store_files are removed once their chunks are durable, the store itself must be too
+        fsync_directory(path)
+        fsync_directory(os.path.dirname(os.path.abspath(path)))
+        store = cls(path, engine)
+        store._cache_chunk_key(chunk_key)
+        return store
+
+    def _cache_path(self) -> str:
+        return os.path.join(KEYS_CACHE, f"{self.id}.key")
+
+    def _cache_chunk_key(self, chunk_key: bytes) -> None:
+        self._chunk_key = chunk_key
+        os.makedirs(KEYS_CACHE, mode=0o700, exist_ok=True)
+        fd = os.open(self._cache_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(chunk_key.hex())
+
+    def unwrap(self, identity_file: IdentityFiles) -> str:
+        """Decrypts key.age with the YubiKey, returns the store identity and caches the chunk key."""
+        with open(os.path.join(self.path, "key.age"), "rb") as f, span("hardware_unwrap"):
+            lines = self.engine.decrypt_bytes(f.read(), identity_file=identity_file).decode().splitlines()
+        chunk_key = next(line.split(":", 1)[1].strip() for line in lines if line.startswith("# chunk-key:"))
+        self._cache_chunk_key(bytes.fromhex(chunk_key))
+        return next(line.strip() for line in lines if line.startswith("AGE-SECRET-KEY-"))
+
+    def chunk_key(self, identity_file: Optional[IdentityFiles] = None) -> bytes:
+        """The chunk key, from the local cache or else from one hardware unwrap."""
+        if self._chunk_key is None:
+            try:
+                with open(self._cache_path(), "r") as f:
+                    self._chunk_key = bytes.fromhex(f.read().strip())
+            except (OSError, ValueError):
+                if identity_file is None:
+                    raise
+                self.unwrap(identity_file)
+        return self._chunk_key
+
+    def _chunk_path(self, chunk_id: str) -> str:
+        return os.path.join(self.chunks_dir, chunk_id[:2], f"{chunk_id}.age")
+
+    def _mac(self, data: bytes) -> str:
+        return hmac.new(self.chunk_key(), data, hashlib.sha256).hexdigest()
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        with atomic_output(path) as tmp, open(tmp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._dirty_dirs.add(os.path.dirname(path))
+
+    def _sync(self) -> None:
+        """Makes the renames of the chunks and manifests written so far durable."""
+        with self._lock:
+            directories, self._dirty_dirs = self._dirty_dirs, set()
+        with span("fsync_directory", directories=len(directories)):
+            for directory in directories:
+                fsync_directory(directory)
+
+    def _store_chunk(self, chunk_id: str, data: bytes) -> int:
+        """Encrypts a chunk unless the store has it, returns the bytes written."""
+        with self._lock:
+            if chunk_id in self.known:
+                return 0
+            self.known.add(chunk_id)
+        try:
+            ciphertext = self.engine.encrypt_bytes(data, [self.recipient])
+            self._write_atomic(self._chunk_path(chunk_id), ciphertext)
+        except BaseException:
+            with self._lock:
+                self.known.discard(chunk_id)
+            raise
+        return len(ciphertext)
+
+    def add_file(self, file_path: str, rel_path: str, workers: int = DEFAULT_WORKERS,
+                 identity_file: Optional[IdentityFiles] = None) -> Dict[str, int]:
+        """
+        Stores one file under rel_path (replacing an older version of it) and
+        returns chunk and byte counts once all of it is durable. Chunking runs
+        here while a pool of workers encrypts the new chunks.
+        """
+        key = self.chunk_key(identity_file)
+        chunker = Chunker(key, self.min_chunk, self.average_bits, self.max_chunk)
+        chunks: List[Tuple[str, int]] = []
+        futures = []
+        in_flight = threading.BoundedSemaphore(max(1, workers) * 2)
+        size = 0
+        with open(file_path, "rb") as f, ThreadPoolExecutor(max(1, workers)) as executor:
+            for chunk in chunker.chunks(f):
+                chunk_id = hmac.new(key, chunk, hashlib.sha256).hexdigest()
+                chunks.append((chunk_id, len(chunk)))
+                size += len(chunk)
+                # Bounded so memory stays at a few chunks per worker
+                in_flight.acquire()
+                future = executor.submit(self._store_chunk, chunk_id, chunk)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+            written = sum(future.result() for future in futures)
+
+        entry = {"path": rel_path, "size": size, "chunks": chunks}
+        body = json.dumps(entry, sort_keys=True).encode()
+        manifest = json.dumps({"version": STORE_VERSION, "entry": entry, "mac": self._mac(body)}).encode()
+        manifest_path = os.path.join(self.manifests_dir, f"{self._mac(rel_path.encode())[:32]}.age")
+        self._write_atomic(manifest_path, self.engine.encrypt_bytes(manifest, [self.recipient]))
+        self._sync()
+        return {
+            "size": size,
+            "chunks": len(chunks),
+            "new_chunks": sum(1 for future in futures if future.result()),
+            "written": written,
+        }
+
+    def read_manifests(self, identity: str) -> Dict[str, dict]:
+        """Decrypts and checks every manifest, by manifest file name."""
+        manifests = {}
+        for name in sorted(os.listdir(self.manifests_dir)):
+            if not name.endswith(".age"):
+                continue
+            with open(os.path.join(self.manifests_dir, name), "rb") as f:
+                manifest = json.loads(self.engine.decrypt_bytes(f.read(), identity=identity))
+            if manifest.get("version") != STORE_VERSION:
+                raise ValueError(f"Unsupported manifest version in {name}: {manifest.get('version')}")
+            body = json.dumps(manifest["entry"], sort_keys=True).encode()
+            if not hmac.compare_digest(manifest["mac"], self._mac(body)):
+                raise ValueError(f"Manifest {name} does not belong to this store")
+            manifests[name] = manifest["entry"]
+        return manifests
+
+    def restore_entry(self, entry: dict, target: str, identity: str, workers: int = DEFAULT_WORKERS) -> None:
+        """Rebuilds one file from its chunks, decrypting them in parallel."""
+        key = self.chunk_key()
+        offsets = []
+        position = 0
+        for chunk_id, length in entry["chunks"]:
+            offsets.append(position)
+            position += length
+
+        def restore_chunk(n: int) -> None:
+            chunk_id, length = entry["chunks"][n]
+            with open(self._chunk_path(chunk_id), "rb") as f:
+                data = self.engine.decrypt_bytes(f.read(), identity=identity)
+            if len(data) != length or not hmac.compare_digest(hmac.new(key, data, hashlib.sha256).hexdigest(),
+                                                               chunk_id):
+                raise ValueError(f"Chunk {chunk_id} is corrupted")
+            os.pwrite(fd, data, offsets[n])
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            os.ftruncate(fd, entry["size"])
+            with ThreadPoolExecutor(max(1, workers)) as executor:
+                list(executor.map(restore_chunk, range(len(entry["chunks"]))))
+        except BaseException:
+            os.close(fd)
+            os.remove(target)
+            raise
+        os.close(fd)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.path)
+        if os.path.exists(self._cache_path()):
+            os.remove(self._cache_path())
+
+
+def extract_store(store_path: str, identity_file: IdentityFiles, workers: int = DEFAULT_WORKERS,
+                  engine: Optional[AgeEngine] = None) -> Dict[str, bool]:
+    """Restores every file of a chunk store next to it, removing the store if all succeed."""
+    store = ChunkStore(store_path, engine)
+    identity = store.unwrap(identity_file)
+    manifests = store.read_manifests(identity)
+
+    base = os.path.realpath(os.path.dirname(os.path.abspath(store.path)))
+    results = {}
+    commit = GroupCommit(len(manifests))
+    for entry in manifests.values():
+        target = os.path.realpath(os.path.join(base, entry["path"]))
+        if os.path.commonpath([base, target]) != base:
+            raise ValueError(f"Chunk store entry escapes {base}: {entry['path']}")
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with atomic_output(target) as tmp:
+                store.restore_entry(entry, tmp, identity, workers)
+            commit.add(target)
+            results[target] = True
+        except Exception as e:
+            print(f"Error restoring {target}: {e}")
+            results[target] = False
+    commit.flush()
+
+    if all(results.values()):
+        with span("file_removal"):
+            store.remove()
+        print(f"\tSUCCESSFULLY RESTORED! {store.path} ==> {len(results)} files")
+    return results
@@ -0,0 +1,330 @@
+#!/bin/env python3
+"""
+Compression before encryption (``yubienCrypt --compress``).
+
+Ciphertext does not compress, so logs, dumps and other text have to be
+compressed before age sees them. A compressed .age file holds a small header
+in front of the compressed plaintext:
+
+    MAGIC (8 bytes)   b"\\x89YCZ\\r\\n\\x1a\\n", never the start of a text file
+    codec (1 byte)    CODEC_IDS, 0 for stored
+
+yubideCrypt checks for the header after decrypting and decompresses, files
+without it are plaintext as before. With ``auto`` a few samples spread over
+the file are compressed first and files that would not shrink by MIN_SAVING
+are encrypted as they are. zstd (zstandard, or compression.zstd on Python
+3.14) and lz4 are used when installed, zlib otherwise.
+"""
+
+import os
+import shutil
+import threading
+import zlib
+from itertools import chain
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from durable import atomic_output
+from instrument import span
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from compression import zstd as stdlib_zstd
+except ImportError:
+    stdlib_zstd = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+MAGIC = b"\x89YCZ\r\n\x1a\n"
+HEADER_SIZE = len(MAGIC) + 1
+CODEC_IDS = {"none": 0, "zlib": 1, "lz4": 2, "zstd": 3}
+# Fastest first: auto takes the first one that is installed
+AUTO_ORDER = ("zstd", "lz4", "zlib")
+COMPRESS_CHOICES = ("auto",) + tuple(CODEC_IDS)
+
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 1
+MIN_SAVING = 0.1
+SAMPLES = 8
+SAMPLE_SIZE = 64 << 10
+BLOCK_SIZE = 1 << 20
+
+
+class Stored:
+    """Pass-through codec for framed but uncompressed data."""
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class LZ4Compressor:
+    """lz4.frame wants begin() before the first block."""
+
+    def __init__(self) -> None:
+        self._compressor = lz4_frame.LZ4FrameCompressor()
+        self._started = False
+
+    def compress(self, data: bytes) -> bytes:
+        if not self._started:
+            self._started = True
+            return self._compressor.begin() + self._compressor.compress(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        head = b"" if self._started else self._compressor.begin()
+        self._started = True
+        return head + self._compressor.flush()
+
+
+class Decompressor:
+    """Adds the flush() that the zstd and lz4 decompressors lack."""
+
+    def __init__(self, decompressor) -> None:
+        self._decompressor = decompressor
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _compressors() -> Dict[str, Callable]:
+    codecs: Dict[str, Callable] = {
+        "none": Stored,
+        "zlib": lambda: zlib.compressobj(ZLIB_LEVEL),
+    }
+    if zstandard is not None:
+        codecs["zstd"] = lambda: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    elif stdlib_zstd is not None:
+        codecs["zstd"] = lambda: stdlib_zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    if lz4_frame is not None:
+        codecs["lz4"] = LZ4Compressor
+    return codecs
+
+
+def _decompressors() -> Dict[str, Callable]:
+    codecs: Dict[str, Callable] = {
+        "none": Stored,
+        "zlib": zlib.decompressobj,
+    }
+    if zstandard is not None:
+        codecs["zstd"] = lambda: Decompressor(zstandard.ZstdDecompressor().decompressobj())
+    elif stdlib_zstd is not None:
+        codecs["zstd"] = lambda: Decompressor(stdlib_zstd.ZstdDecompressor())
+    if lz4_frame is not None:
+        codecs["lz4"] = lambda: Decompressor(lz4_frame.LZ4FrameDecompressor())
+    return codecs
+
+
+COMPRESSORS = _compressors()
+DECOMPRESSORS = _decompressors()
+
+
+def available_codecs() -> List[str]:
+    return [name for name in AUTO_ORDER if name in COMPRESSORS]
+
+
+def header(codec: str) -> bytes:
+    return MAGIC + bytes([CODEC_IDS[codec]])
+
+
+def has_header(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def resolve_codec(setting: str) -> str:
+    """Maps a --compress value to an installed codec, raising if it is not installed."""
+    if setting == "auto":
+        return available_codecs()[0]
+    if setting not in COMPRESSORS:
+        package = "zstandard" if setting == "zstd" else setting
+        raise ValueError(f"Codec '{setting}' is not installed (pip install {package})")
+    return setting
+
+
+def compression_ratio(samples: Iterable[bytes], codec: str) -> float:
+    """Compressed size over raw size of the samples, each compressed on its own."""
+    raw = packed = 0
+    for sample in samples:
+        compressor = COMPRESSORS[codec]()
+        packed += len(compressor.compress(sample)) + len(compressor.flush())
+        raw += len(sample)
+    return packed / raw if raw else 1.0
+
+
+def file_samples(path: str, samples: int = SAMPLES, sample_size: int = SAMPLE_SIZE) -> List[bytes]:
+    """Up to samples blocks spread evenly over the file, all of it if it is small."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= samples * sample_size:
+            return [f.read()]
+        step = (size - sample_size) // (samples - 1)
+        return [os.pread(f.fileno(), sample_size, n * step) for n in range(samples)]
+
+
+def choose_codec(path: str, setting: Optional[str]) -> Optional[str]:
+    """
+    The codec to frame path with, or None to encrypt it unchanged. A file that
+    happens to start with MAGIC is always framed ("none") so decrypt cannot
+    mistake it for a compressed one.
+    """
+    codec = None
+    if setting not in (None, "none"):
+        codec = resolve_codec(setting)
+        if setting == "auto":
+            with span("compression_probe", codec=codec):
+                if compression_ratio(file_samples(path), codec) > 1 - MIN_SAVING:
+                    codec = None
+    if codec is None and has_header(path):
+        return "none"
+    return codec
+
+
+def compress_chunks(blocks: Iterable[bytes], codec: str) -> Iterator[bytes]:
+    yield header(codec)
+    compressor = COMPRESSORS[codec]()
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Strips the header off a plaintext stream and decompresses it, passes other streams through."""
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= HEADER_SIZE:
+            break
+    if head[:len(MAGIC)] != MAGIC or len(head) < HEADER_SIZE:
+        if head:
+            yield head
+        yield from chunks
+        return
+
+    names = {value: name for name, value in CODEC_IDS.items()}
+    codec = names.get(head[len(MAGIC)])
+    if codec is None:
+        raise ValueError(f"Unknown compression codec {head[len(MAGIC)]}")
+    if codec not in DECOMPRESSORS:
+        raise ValueError(f"File was compressed with {codec}, which is not installed here")
+    decompressor = DECOMPRESSORS[codec]()
+    for chunk in chain([head[HEADER_SIZE:]], chunks):
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def read_blocks(f: IO, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    return iter(lambda: f.read(block_size), b"")
+
+
+def digested(blocks: Iterable[bytes], digest) -> Iterator[bytes]:
+    """Passes the blocks through, feeding each to digest.update first."""
+    for block in blocks:
+        digest.update(block)
+        yield block
+
+
+def encrypt_chunks(engine, chunks: Iterable[bytes], dst: IO, recipients: List[str]) -> None:
+    """Encrypts the chunks to dst; a thread writes them into age's stdin."""
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def feed() -> None:
+        try:
+            with os.fdopen(write_fd, "wb") as w:
+                for data in chunks:
+                    w.write(data)
+        except BrokenPipeError:
+            pass  # age gave up early, its exit status says why
+        except Exception as e:
+            errors.append(e)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        with os.fdopen(read_fd, "rb") as r:
+            engine.encrypt_stream(r, dst, recipients)
+    finally:
+        feeder.join()
+    if errors:
+        raise errors[0]
+
+
+def encrypt_compressed(engine, blocks: Iterable[bytes], dst: IO, recipients: List[str], codec: str) -> None:
+    """Encrypts the framed, compressed blocks to dst."""
+    encrypt_chunks(engine, compress_chunks(blocks, codec), dst, recipients)
+
+
+def encrypt_file(engine, src: str, dst: str, recipients: List[str], setting: Optional[str] = None,
+                 digest=None) -> str:
+    """
+    Encrypts src to dst, compressed first if setting (a codec or auto) asks for
+    it. Returns the codec used. digest.update gets the plaintext as it is read,
+    so an uncompressed file goes through a pipe rather than straight to age.
+    """
+    codec = choose_codec(src, setting)
+    if codec is None and digest is None:
+        engine.encrypt_file(src, dst, recipients)
+        return "none"
+    with open(src, "rb") as f, open(dst, "wb") as out:
+        blocks = read_blocks(f) if digest is None else digested(read_blocks(f), digest)
+        if codec is None:
+            encrypt_chunks(engine, blocks, out, recipients)
+            return "none"
+        encrypt_compressed(engine, blocks, out, recipients, codec)
+    return codec
+
+
+def encrypt_stream(engine, src: IO, dst: IO, recipients: List[str], setting: Optional[str] = None) -> None:
+    """
+    Like encrypt_file for pipes; auto probes the first block. Unframed input
+    that starts with MAGIC is framed ("none") like choose_codec does for files.
+    """
+    first = src.read(BLOCK_SIZE)
+    if setting in (None, "none"):
+        if first.startswith(MAGIC):
+            encrypt_compressed(engine, chain([first], read_blocks(src)), dst, recipients, "none")
+        else:
+            encrypt_chunks(engine, chain([first], read_blocks(src)), dst, recipients)
+        return
+    codec = resolve_codec(setting)
+    if setting == "auto":
+        with span("compression_probe", codec=codec):
+            if compression_ratio([first], codec) > 1 - MIN_SAVING:
+                codec = "none"
+    encrypt_compressed(engine, chain([first], read_blocks(src)), dst, recipients, codec)
+
+
+def decompress_file(path: str) -> Optional[str]:
+    """Decompresses a decrypted file in place if it has a header, returns its codec or None."""
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:len(MAGIC)] != MAGIC:
+        return None
+    with atomic_output(path) as tmp:
+        with span("decompress"), open(path, "rb") as f, open(tmp, "wb") as out:
+            for data in decompress_chunks(read_blocks(f)):
+                out.write(data)
+        shutil.copymode(path, tmp)
+    return {value: name for name, value in CODEC_IDS.items()}.get(head[len(MAGIC)])
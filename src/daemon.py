@@ -0,0 +1,188 @@
+#!/bin/env python3
+"""
+yubiCryptd: keeps the parsed identities and the engine warm and serves
+encrypt/decrypt requests over ~/.yubiCrypt/yubiCryptd.sock.
+
+The protocol is one JSON object per line in each direction:
+
+    {"op": "ping"}
+    {"op": "encrypt", "files": [...], "identities": [...], "engine": null, "workers": 8, "compress": null,
+     "sync_batch": 64}
+    {"op": "decrypt", "files": [...], "identities": [...], "engine": null, "sync_batch": 64}
+
+and the replies {"ok": true, "results": {path: bool}, "errors": {path: str}}
+or {"ok": false, "error": str}.
+
+yubienCrypt/yubideCrypt try the daemon first and run directly when it is not
+listening or YUBICRYPT_DAEMON=0 is set.
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from typing import List, Optional
+
+from batch import print_summary, take_failures
+from instrument import PROFILE_ENV, enable as enable_profiling
+
+SOCKET_PATH = os.path.expanduser("~/.yubiCrypt/yubiCryptd.sock")
+DAEMON_ENV = "YUBICRYPT_DAEMON"
+DEFAULT_CONCURRENCY = 4
+QUEUE_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+# A batch can wait QUEUE_TIMEOUT for a slot and then for a touch, a daemon silent for longer is treated as gone
+REPLY_TIMEOUT = 600.0
+
+
+def request(message: dict, socket_path: str = SOCKET_PATH, timeout: float = REPLY_TIMEOUT) -> Optional[dict]:
+    """
+    Sends one request to the daemon, returns None when no daemon is listening,
+    it does not answer within timeout or the answer is not a JSON reply.
+    """
+    if os.environ.get(DAEMON_ENV) == "0" or not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(min(CONNECT_TIMEOUT, timeout))
+            sock.connect(socket_path)
+            sock.sendall((json.dumps(message) + "\n").encode())
+            sock.settimeout(timeout)
+            with sock.makefile("rb") as reply:
+                line = reply.readline()
+        response = json.loads(line)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(response, dict) or "ok" not in response:
+        return None
+    return response
+
+
+def print_reply(response: dict, files: List[str], missing: List[str], action: str) -> int:
+    """Prints the outcome of a batch the daemon served like a local run, returns the exit code."""
+    if not response["ok"]:
+        print(f"yubiCryptd: {response['error']}")
+        return 1
+    results = {path: response["results"][os.path.abspath(path)] for path in files}
+    for path in files:
+        error = response.get("errors", {}).get(os.path.abspath(path))
+        if error is not None:
+            print(f"Reporting Failed {action}ion Attempt: {path} ({error})")
+    results.update(dict.fromkeys(missing, False))
+    print_summary(results, action)
+    return 0 if all(results.values()) else 1
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class YubiCryptDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = SOCKET_PATH, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+        # Imported here so thin clients calling request() stay cheap
+        import decrypt
+        import encrypt
+        from keycache import key_cache
+
+        self.encrypt = encrypt
+        self.decrypt = decrypt
+        self.keys = key_cache()
+        self.slots = threading.BoundedSemaphore(concurrency)
+        # The YubiKey serves one plugin session at a time
+        self.hardware_lock = threading.Lock()
+
+        remove_stale_socket(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.socket_path = socket_path
+
+    def dispatch(self, req: dict) -> dict:
+        op = req.get("op")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op not in ("encrypt", "decrypt"):
+            return {"ok": False, "error": f"Unknown op: {op}"}
+        if not self.slots.acquire(timeout=QUEUE_TIMEOUT):
+            return {"ok": False, "error": "busy"}
+        try:
+            self.keys.refresh()
+            engine = self.encrypt.select_engine(req.get("engine"))
+            files = req.get("files") or []
+            if op == "encrypt":
+                recipients = self.encrypt.read_recipients(req.get("identities"))
+                workers = max(1, int(req.get("workers") or self.encrypt.DEFAULT_WORKERS))
+                sync_batch = int(req.get("sync_batch") or self.encrypt.DEFAULT_SYNC_BATCH)
+                results = self.encrypt.encrypt_files(files, recipients, workers, engine, req.get("compress"),
+                                                     sync_batch)
+            else:
+                identity = self.decrypt.identity_paths(req.get("identities"))
+                with self.hardware_lock:
+                    results = self.decrypt.decrypt_files(files, identity, engine,
+                                                         int(req.get("sync_batch") or self.decrypt.DEFAULT_SYNC_BATCH))
+            return {"ok": True, "results": results,
+                    "errors": take_failures(path for path, ok in results.items() if not ok)}
+        finally:
+            self.slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """Removes a socket left behind by a dead daemon, refuses to replace a live one."""
+    if not os.path.exists(socket_path):
+        return
+    if request({"op": "ping"}, socket_path, CONNECT_TIMEOUT) is not None:
+        raise RuntimeError(f"yubiCryptd is already running on {socket_path}")
+    os.remove(socket_path)
+
+
+def main(argv=None) -> int:
+    # Imported here so thin clients calling request() stay cheap
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="yubiCryptd", description="yubiCrypt daemon")
+    parser.add_argument("--socket", default=SOCKET_PATH, help=f"socket path (default: {SOCKET_PATH})")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"requests served at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help=f"record timing spans to FILE (.prom or JSON lines) or stderr (default: ${PROFILE_ENV})")
+    args = parser.parse_args(argv)
+    enable_profiling(args.profile)
+
+    # Let SIGTERM unwind through the with block so the socket gets removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server = YubiCryptDaemon(args.socket, max(1, args.concurrency))
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+
+    with server:
+        print(f"yubiCryptd listening on {args.socket} (pid {os.getpid()})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nyubiCryptd stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/bin/env python3
+"""
+Thin client behind the yubienCrypt and yubideCrypt aliases.
+
+encrypt.py and decrypt.py import every backend (bundles, chunk stores,
+segments, compression, argparse) before they get to try yubiCryptd, which
+costs more than the daemon round-trip itself. This client only reads the
+options the daemon serves and sends plain batches straight to it. Anything
+else (another option, stdin, bundles, stores, segmented files) or no daemon
+runs encrypt.main or decrypt.main as before.
+
+    python3 daemon_client.py encrypt -r ~/notes
+    python3 daemon_client.py decrypt ~/notes/todo.txt.age
+"""
+
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from batch import BUNDLE_SUFFIX, SEGMENT_SUFFIX, STORE_SUFFIX, TEMP_SUFFIX, collect_files, find_directories
+from daemon import DAEMON_ENV, SOCKET_PATH, print_reply, request
+
+COMMANDS = ("encrypt", "decrypt")
+
+# Options the daemon serves and the request field they set, every other option runs in-process
+DECRYPT_OPTIONS = {
+    "-i": "identities", "--identity": "identities",
+    "-e": "engine", "--engine": "engine",
+    "-j": "workers", "--workers": "workers",
+    "--sync-batch": "sync_batch",
+}
+ENCRYPT_OPTIONS = dict(DECRYPT_OPTIONS, **{"--compress": "compress"})
+INTEGER_FIELDS = ("workers", "sync_batch")
+
+
+def daemon_available() -> bool:
+    return os.environ.get(DAEMON_ENV) != "0" and os.path.exists(SOCKET_PATH)
+
+
+def parse_daemon_args(command: str, argv: List[str]) -> Optional[Tuple[List[str], bool, dict]]:
+    """
+    Returns (paths, recursive, request fields) for a command line the daemon
+    can serve, None for anything else. Errors are left to argparse in main.
+    """
+    options = ENCRYPT_OPTIONS if command == "encrypt" else DECRYPT_OPTIONS
+    paths: List[str] = []
+    recursive = False
+    fields: dict = {"identities": None, "engine": None, "workers": None, "sync_batch": None}
+    if command == "encrypt":
+        fields["compress"] = None
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-r", "--recursive"):
+            recursive = True
+        elif arg == "-z" and command == "encrypt":
+            fields["compress"] = "auto"
+        elif arg.startswith("-") and arg != "-":
+            name, separator, value = arg.partition("=")
+            if name not in options:
+                return None
+            if not separator:
+                value = next(args, None)
+                if value is None:
+                    return None
+            field = options[name]
+            if field == "identities":
+                fields["identities"] = (fields["identities"] or []) + [value]
+            elif field in INTEGER_FIELDS:
+                try:
+                    fields[field] = int(value)
+                except ValueError:
+                    return None
+            else:
+                fields[field] = value
+        else:
+            paths.append(arg)
+    if not paths or "-" in paths:
+        return None
+    return paths, recursive, fields
+
+
+def send(command: str, files: List[str], missing: List[str], fields: dict) -> Optional[int]:
+    """Sends the batch to the daemon, returns the exit code or None when it stopped listening."""
+    response = request(dict(fields, op=command, files=[os.path.abspath(p) for p in files]))
+    if response is None:
+        return None
+    return print_reply(response, files, missing, command.capitalize())
+
+
+def run_in_daemon(command: str, argv: List[str]) -> Optional[int]:
+    """Exit code of the batch served by the daemon, None when it has to run in-process."""
+    if not daemon_available():
+        return None
+    parsed = parse_daemon_args(command, argv)
+    if parsed is None:
+        return None
+    paths, recursive, fields = parsed
+
+    if command == "encrypt":
+        if fields["compress"] not in (None, "auto", "none"):
+            # Imported here, it probes the optional codec packages
+            from compress import COMPRESS_CHOICES, resolve_codec
+            if fields["compress"] not in COMPRESS_CHOICES:
+                return None  # argparse reports it
+            try:
+                resolve_codec(fields["compress"])
+            except ValueError as e:
+                print(e)
+                return 1
+        # Never re-encrypt existing ciphertexts when walking directories
+        files, missing = collect_files(paths, recursive, exclude_suffix=(".age", SEGMENT_SUFFIX, TEMP_SUFFIX),
+                                       prune_suffix=(BUNDLE_SUFFIX, STORE_SUFFIX))
+        if not files:
+            print("No files to encrypt.")
+            return 1
+        return send(command, files, missing, fields)
+
+    # Bundles, stores and segmented files are decrypted in-process, a name is enough to tell
+    containers = find_directories(paths, recursive, (BUNDLE_SUFFIX, STORE_SUFFIX),
+                                  lambda path: path.endswith((BUNDLE_SUFFIX, STORE_SUFFIX)) and os.path.isdir(path))
+    if containers:
+        return None
+    files, missing = collect_files(paths, recursive, suffix=(".age", SEGMENT_SUFFIX),
+                                   prune_suffix=(BUNDLE_SUFFIX, STORE_SUFFIX))
+    if any(path.endswith(SEGMENT_SUFFIX) for path in files):
+        return None
+    if not files:
+        print("No .age files to decrypt.")
+        return 1
+    print('Press the button on your yubikey: ')
+    fields.pop("workers")
+    return send(command, files, missing, fields)
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        print(f"usage: daemon_client.py {{{','.join(COMMANDS)}}} ARGS...", file=sys.stderr)
+        return 2
+    command, argv = argv[0], argv[1:]
+    code = run_in_daemon(command, argv)
+    if code is not None:
+        return code
+    if command == "encrypt":
+        import encrypt
+        return encrypt.main(argv)
+    import decrypt
+    return decrypt.main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,113 +1,507 @@
 #!/bin/env python3
 
+import argparse
+import contextlib
+import getpass
 import os
-import subprocess
-import datetime
 import socket
+import subprocess
 import sys
-import time
+import threading
 from contextlib import contextmanager
-from typing import Generator, IO, Any
+from typing import Generator, IO, Any, Iterable, List, Optional, Tuple
 from datetime import datetime
+from batch import DEFAULT_WORKERS, collect_files, print_summary, record_failure
+from bundle import BUNDLE_SUFFIX, extract_bundle, find_bundles
+from chunkstore import STORE_SUFFIX, extract_store, find_stores
+from compress import decompress_chunks, decompress_file
+from daemon import print_reply, request as daemon_request
+from durable import DEFAULT_SYNC_BATCH, GroupCommit, atomic_output
+from engine import ENGINE_ENV, ENGINE_NAMES, select_engine
+from instrument import PROFILE_ENV, enable as enable_profiling, span
+from keycache import inserted_serials, key_cache
+from segments import SEGMENT_SUFFIX, SegmentedFile, decrypt_segmented
 
 @contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
+def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
+    file: IO= open(path, mode)
     try:
-        yield
+        yield file
+    except Exception as e:
+        print(e)
     finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
+        print('Closing ')
+        if file:
+            file.close()
 
 @contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
+def rm_file(path: str) -> Generator[IO, Any, None]:
+    file: IO = open(path)
+    print('Opening file')
+    try:
+        yield file
+    except FileNotFoundError:
+        print(f"Error: File '{file_name}' not found.")
+    except Exception as e:
+        print(e)
+    finally:
+        print('Closing file...')
+        if file:
+            file.close()
+            os.remove(path)
+            print(f"Removed '{path}' successfully.")
+
+
+DIRTY_LOCK = threading.Lock()
+
+
+def identity_paths(idents=None) -> List[str]:
+    """
+    Returns the paths of the identity files, raising if one is missing.
+    Without explicit names only the identities of the inserted YubiKey are
+    used, so age never asks for a key that is not plugged in.
+    """
+    with span("key_load"):
+        cache = key_cache()
+        if idents:
+            return cache.identity_files(idents)
+        paths = cache.identity_files_for_serials(inserted_serials()) or cache.identity_files()
+    if not paths:
+        raise FileNotFoundError(f"No identity files in {cache.keys_dir}")
+    return paths
+
+
+def report_failure(file_path: str, error: Exception) -> None:
+    """Prints and logs a failed decryption attempt to ~/.yubiCrypt/dirty.tmp."""
+    print(f"Reporting Failed Decryption Attempt: {file_path} ({error})")
+    record_failure(file_path, error)
+
+    # Log failure details
+    user = getpass.getuser()
+    hostname = socket.gethostname()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    os_type = os.name
+
+    failure_message = (
+        f"401 Unauthorized {user}@{hostname}\n"
+        f"{timestamp} {os_type}\n"
+        "DECRYPTION FAILED"
+    )
+    print(failure_message)
+
+    # Log failure to a temporary file
+    dirty_tmp_path = os.path.expanduser("~/.yubiCrypt/dirty.tmp")
+    with span("failure_log"), DIRTY_LOCK:
+        with file_manager(dirty_tmp_path, "a") as dirty_tmp:
+            dirty_tmp.write(f"{failure_message}\n")
+
+
+def wipe_keys() -> None:
+    """Cleans up the keys directory after a failed decryption."""
+    keys_dir = os.path.expanduser("~/.yubiCrypt/keys/")
+    for key_file in os.listdir(keys_dir):
+        path = os.path.join(keys_dir, key_file)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def age_rejected(error: Exception) -> bool:
+    """
+    Whether age itself failed to decrypt, the only failure that wipes the keys.
+    Output, permission, decompression and commit errors never do.
+    """
+    return isinstance(error, subprocess.CalledProcessError)
+
+
+def restore_file(file_path, identity, engine, commit=None) -> None:
+    """
+    Decrypts one .age file next to it, raising on failure. The .age file is
+    removed once the plaintext is durable, right away or with the next batch
+    of commit.
+    """
+    # Decrypt the file using `age`
+    decrypted_file = file_path[:-len(".age")]  # Remove ".age" from the file name
+    with atomic_output(decrypted_file) as tmp:
+        engine.decrypt_file(file_path, tmp, identity_file=identity)
+        codec = decompress_file(tmp)
+
+    # Confirm successful decryption
+    decompressed = f" ({codec})" if codec and codec != "none" else ""
+    print(f"\tSUCCESSFULLY DECRYPTED! {file_path} ==> {decrypted_file}{decompressed}")
+    own_commit = commit is None
+    commit = commit or GroupCommit(1)
+    commit.add(decrypted_file, remove=file_path)  # Removes the encrypted file
+    if own_commit and commit.failed:
+        raise commit.failed[file_path]
+
+
+def decrypt_file(file_path, identity=None, wipe_on_failure=True, engine=None, commit=None) -> bool:
+    """Decrypts one .age file next to it, see restore_file. Only an age failure wipes the keys."""
+    try:
+        if identity is None:
+            identity = identity_paths()
+        if engine is None:
+            engine = select_engine()
+        restore_file(file_path, identity, engine, commit)
+        return True
+    except Exception as e:
+        # Handle decryption failure
+        report_failure(file_path, e)
+        if wipe_on_failure and age_rejected(e):
+            wipe_keys()
+        print("Decryption failed.")
+        return False
+
+
+def commit_failures(results, commit) -> dict:
+    """Marks the files whose .age file could not be removed as failed."""
+    for path, error in commit.failed.items():
+        report_failure(path, error)
+        results[path] = False
+    return results
+
+
+def decrypt_files(files, identity, engine=None, sync_batch=DEFAULT_SYNC_BATCH) -> dict:
+    """
+    Decrypts many files one after another against a single identity.
+    The YubiKey can only serve one plugin session at a time, so the files are
+    fed to it back to back: with a cached touch policy a single touch covers
+    the whole run, and the keys directory is only wiped once after the batch,
+    if age rejected one of the files.
+    """
+    engine = engine or select_engine()
+    results = {}
+    rejected = False
+    total = len(files)
+    with GroupCommit(sync_batch) as commit:
+        for index, path in enumerate(files, 1):
+            print(f"[{index}/{total}] {path}")
+            try:
+                restore_file(path, identity, engine, commit)
+                results[path] = True
+            except Exception as e:
+                report_failure(path, e)
+                print("Decryption failed.")
+                rejected = rejected or age_rejected(e)
+                results[path] = False
+    results = commit_failures(results, commit)
+    if rejected:
+        wipe_keys()
+    return results
+
+
+class OutputError(Exception):
+    """A write to the output failed, as opposed to the decryption."""
+
+    def __init__(self, error: OSError) -> None:
+        super().__init__(str(error))
+        self.error = error
+
+
+class GuardedOutput:
+    """Wraps the output so that its errors can be told apart from age's."""
+
+    def __init__(self, dst: IO) -> None:
+        self.dst = dst
+
+    def write(self, data) -> int:
         try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing ')
-            if file:
-                file.close()
+            return self.dst.write(data)
+        except OSError as e:
+            raise OutputError(e) from e
 
-@contextmanager
-def rm_file(path: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO = open(path)
-        print('Opening file')
+    def flush(self) -> None:
         try:
-            yield file
-        except FileNotFoundError:
-            print(f"Error: File '{file_name}' not found.")
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
-                os.remove(path)
-                print(f"Removed '{path}' successfully.")
+            self.dst.flush()
+        except OSError as e:
+            raise OutputError(e) from e
+
+
+def output_failed(source: str, error: OutputError, dst: IO) -> bool:
+    """
+    Handles a failed write to the output. A reader that closed the pipe early
+    (| head) ends the output quietly; the keys are never wiped for either.
+    """
+    if isinstance(error.error, BrokenPipeError):
+        if dst is sys.stdout.buffer:
+            # Python would flush stdout again at exit and complain about the closed pipe
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return True
+    report_failure(source, error.error)
+    print("Decryption failed.")
+    return False
 
 
-def decrypt_file(file_path):
-    ident = "first.txt"
-    curr = os.path.expanduser(f"~/.yubiCrypt/keys/{ident}")
+def decryption_failed(source: str, error: Exception) -> bool:
+    """Reports a failed decryption; only a failure of age itself wipes the keys."""
+    report_failure(source, error)
+    if age_rejected(error):
+        wipe_keys()
+    print("Decryption failed.")
+    return False
 
-    with timer():
+
+def decrypt_stream(identity, engine, src=None, dst=None) -> bool:
+    """Decrypts stdin to stdout without a plaintext file on disk, decompressing on the way."""
+    dst = dst or sys.stdout.buffer
+    output = GuardedOutput(dst)
+    try:
+        chunks = engine.decrypt_chunks(src or sys.stdin.buffer, identity)
         try:
-            # Check if the identity file exists
-            if not os.path.isfile(curr):
-                raise FileNotFoundError(f"Identity file not found: {curr}")
+            for chunk in decompress_chunks(chunks):
+                output.write(chunk)
+        finally:
+            chunks.close()
+        output.flush()
+        return True
+    except OutputError as e:
+        return output_failed("<stdin>", e, dst)
+    except Exception as e:
+        return decryption_failed("<stdin>", e)
 
-            # Decrypt the file using `age`
-            decrypted_file = file_path[::-1][4:][::-1]  # Remove ".age" from the file name
-            command = ["age", "-d", "-i", curr, "-o", decrypted_file, file_path]
-            subprocess.run(command, check=True)
 
-            # Confirm successful decryption
-            print(f"	SUCCESSFULLY DECRYPTED! {file_path} ==> {decrypted_file}")
-            os.remove(file_path)  # Remove the encrypted file
+def parse_range(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """Parses START:END into slice bounds; either may be empty, negative counts from the end."""
+    start, sep, end = text.partition(":")
+    try:
+        if not sep:
+            raise ValueError(text)
+        return (int(start) if start else None, int(end) if end else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range '{text}', expected START:END in bytes")
+
 
+def write_range(chunks: Iterable[bytes], start: Optional[int], end: Optional[int], dst: IO) -> None:
+    """Writes the [start:end] slice of a plaintext stream to dst, reading no further than needed."""
+    if start is not None and start < 0:
+        # The size is only known at the end of the stream, keep its tail
+        tail = bytearray()
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            tail += chunk
+            if len(tail) > -start:
+                del tail[:len(tail) + start]
+        first, last, _ = slice(start, end).indices(size)
+        offset = size - len(tail)
+        dst.write(tail[max(first - offset, 0):max(last - offset, 0)])
+        return
+
+    start = start or 0
+    hold = -end if end is not None and end < 0 else 0
+    held = bytearray()
+    position = 0
+    for chunk in chunks:
+        if position + len(chunk) <= start:
+            position += len(chunk)
+            continue
+        chunk = memoryview(chunk)[max(start - position, 0):]
+        position = max(position, start)
+        if end is not None and end >= 0:
+            chunk = chunk[:max(end - position, 0)]
+        position += len(chunk)
+        if hold:
+            # Held back until we know it is not part of the last -end bytes
+            held += chunk
+            if len(held) > hold:
+                dst.write(held[:len(held) - hold])
+                del held[:len(held) - hold]
+        else:
+            dst.write(chunk)
+        if end is not None and 0 <= end <= position:
+            break
+
+
+def decrypt_range(file_path, start, end, identity, engine, dst=None, workers=DEFAULT_WORKERS) -> bool:
+    """
+    Decrypts only the bytes [start:end] of file_path to dst (stdout by default).
+    Segmented files decrypt just the segments covering the range; for .age files
+    age has to run from the beginning, but stops as soon as END is reached.
+    """
+    dst = dst or sys.stdout.buffer
+    output = GuardedOutput(dst)
+    try:
+        if file_path.endswith(SEGMENT_SUFFIX):
+            with SegmentedFile(file_path, identity, engine) as container:
+                container.read_range(start, end, output, workers)
+        else:
+            chunks = engine.decrypt_chunks(file_path, identity)
+            try:
+                # Ranges are plaintext offsets, so compressed files are decompressed up to END
+                write_range(decompress_chunks(chunks), start, end, output)
+            finally:
+                chunks.close()
+        output.flush()
+        return True
+    except OutputError as e:
+        return output_failed(file_path, e, dst)
+    except Exception as e:
+        return decryption_failed(file_path, e)
+
+
+def decrypt_bundles(bundles, identity, workers, engine=None) -> dict:
+    """
+    Extracts each bundle with a single hardware unwrap per bundle. Like
+    decrypt_files, the keys are wiped once after the batch if age rejected
+    the key or index of a bundle.
+    """
+    results = {}
+    rejected = False
+    for bundle in bundles:
+        try:
+            for path, ok in extract_bundle(bundle, identity, workers, engine).items():
+                results[f"{bundle}:{path}"] = ok
         except Exception as e:
-            # Handle decryption failure
-            print("Reporting Failed Decryption Attempt")
-
-            # Log failure details
-            user = os.getlogin()
-            hostname = socket.gethostname()
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            os_type = os.name
-
-            failure_message = (
-                f"401 Unauthorized {user}@{hostname}\n"
-                f"{timestamp} {os_type}\n"
-                "DECRYPTION FAILED"
-            )
-            print(failure_message)
-
-            # Clean up keys directory
-            keys_dir = os.path.expanduser("~/.yubiCrypt/keys/")
-            for key_file in os.listdir(keys_dir):
-                os.remove(os.path.join(keys_dir, key_file))
-
-            # Log failure to a temporary file
-            dirty_tmp_path = os.path.expanduser("~/.yubiCrypt/dirty.tmp")
-            with file_manager(dirty_tmp_path, "a") as dirty_tmp:
-                dirty_tmp.write(f"{failure_message}\n")
-            print("Decryption failed.")
+            report_failure(bundle, e)
+            rejected = rejected or age_rejected(e)
+            results[bundle] = False
+    if rejected:
+        wipe_keys()
+    return results
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 decrypt.py <file_to_decrypt>")
-        sys.exit(1)
 
-    file_to_decrypt = sys.argv[1]
-    if os.path.isfile(file_to_decrypt):
+def decrypt_stores(stores, identity, workers, engine=None) -> dict:
+    """Restores each chunk store with a single hardware unwrap per store, wiping the keys like decrypt_bundles."""
+    results = {}
+    rejected = False
+    for store in stores:
+        try:
+            for path, ok in extract_store(store, identity, workers, engine).items():
+                results[f"{store}:{path}"] = ok
+        except Exception as e:
+            report_failure(store, e)
+            rejected = rejected or age_rejected(e)
+            results[store] = False
+    if rejected:
+        wipe_keys()
+    return results
+
+
+def decrypt_large_files(files, identity, workers, engine=None, sync_batch=DEFAULT_SYNC_BATCH) -> dict:
+    """
+    Restores segmented files one at a time, spreading the segments of each
+    over the workers. The keys are wiped once after the batch if age rejected
+    one of the files.
+    """
+    results = {}
+    rejected = False
+    with GroupCommit(sync_batch) as commit:
+        for file_path in files:
+            decrypted_file = file_path[:-len(SEGMENT_SUFFIX)]
+            try:
+                with atomic_output(decrypted_file) as tmp:
+                    decrypt_segmented(file_path, tmp, identity, workers, engine)
+                print(f"\tSUCCESSFULLY DECRYPTED! {file_path} ==> {decrypted_file}")
+                commit.add(decrypted_file, remove=file_path)
+                results[file_path] = True
+            except Exception as e:
+                report_failure(file_path, e)
+                print("Decryption failed.")
+                rejected = rejected or age_rejected(e)
+                results[file_path] = False
+    results = commit_failures(results, commit)
+    if rejected:
+        wipe_keys()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="yubideCrypt", description="Decrypt files with your YubiKey.")
+    parser.add_argument("paths", nargs="+",
+                        help=".age/.ycs files, .ycb bundles, .ycc chunk stores, directories or glob patterns, "
+                             "- for stdin to stdout")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into directories")
+    parser.add_argument("-i", "--identity", action="append", metavar="NAME",
+                        help="identity file in ~/.yubiCrypt/keys, repeatable (default: the inserted YubiKey)")
+    parser.add_argument("--range", type=parse_range, metavar="START:END",
+                        help="write only plaintext bytes START:END of one file to stdout, "
+                             "negative values count from the end (use --range=-1048576: for the last MiB)")
+    parser.add_argument("--sync-batch", type=int, default=DEFAULT_SYNC_BATCH, metavar="N",
+                        help=f"fsync the output directories and remove the encrypted files every N files "
+                             f"(default: {DEFAULT_SYNC_BATCH}, 1 for one file at a time)")
+    parser.add_argument("-e", "--engine", choices=ENGINE_NAMES, default=None,
+                        help=f"age backend (default: ${ENGINE_ENV} or auto)")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"parallel workers for bundle entries and segments (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help=f"record timing spans to FILE (.prom or JSON lines) or stderr (default: ${PROFILE_ENV})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    enable_profiling(args.profile)
+
+    if args.paths == ["-"]:
+        stdout = sys.stdout.buffer
+        # stdout carries the plaintext, so every message goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            try:
+                identity = identity_paths(args.identity)
+                engine = select_engine(args.engine)
+            except Exception as e:
+                report_failure("<stdin>", e)
+                return 1
+            print('Press the button on your yubikey: ')
+            return 0 if decrypt_stream(identity, engine, dst=stdout) else 1
+
+    if args.range:
+        if len(args.paths) != 1 or not args.paths[0].endswith((".age", SEGMENT_SUFFIX)):
+            print("--range takes exactly one .age or .ycs file.", file=sys.stderr)
+            return 1
+        stdout = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            try:
+                identity = identity_paths(args.identity)
+                engine = select_engine(args.engine)
+            except Exception as e:
+                report_failure(args.paths[0], e)
+                return 1
+            print('Press the button on your yubikey: ')
+            start, end = args.range
+            return 0 if decrypt_range(args.paths[0], start, end, identity, engine, stdout, max(1, args.workers)) else 1
+
+    bundles = find_bundles(args.paths, args.recursive)
+    stores = find_stores(args.paths, args.recursive)
+    files, missing = collect_files(args.paths, args.recursive, suffix=(".age", SEGMENT_SUFFIX),
+                                   prune_suffix=(BUNDLE_SUFFIX, STORE_SUFFIX))
+    segmented = [path for path in files if path.endswith(SEGMENT_SUFFIX)]
+    files = [path for path in files if not path.endswith(SEGMENT_SUFFIX)]
+    if not files and not bundles and not stores and not segmented:
+        print("No .age files to decrypt.")
+        return 1
+
+    prompted = False
+    if not bundles and not stores and not segmented:
         print('Press the button on your yubikey: ')
-        decrypt_file(file_to_decrypt)
-    else:
-        print(f"File not found: {file_to_decrypt}")
+        prompted = True
+        response = daemon_request({"op": "decrypt", "files": [os.path.abspath(p) for p in files],
+                                   "identities": args.identity, "engine": args.engine,
+                                   "sync_batch": args.sync_batch})
+        if response is not None:
+            return print_reply(response, files, missing, "Decrypt")
+
+    try:
+        identity = identity_paths(args.identity)
+        engine = select_engine(args.engine)
+    except Exception as e:
+        for path in bundles + stores + segmented + files:
+            report_failure(path, e)
+        print("Decryption failed.")
+        return 1
+
+    if not prompted:
+        print('Press the button on your yubikey: ')
+    with span("batch", files=len(files), bundles=len(bundles), stores=len(stores), segmented=len(segmented)):
+        results = decrypt_bundles(bundles, identity, max(1, args.workers), engine)
+        results.update(decrypt_stores(stores, identity, max(1, args.workers), engine))
+        results.update(decrypt_large_files(segmented, identity, max(1, args.workers), engine, args.sync_batch))
+        results.update(decrypt_files(files, identity, engine, args.sync_batch))
+    # Paths that matched nothing fail the run like files that could not be decrypted
+    results.update(dict.fromkeys(missing, False))
+    print_summary(results, "Decrypt")
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
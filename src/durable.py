@@ -0,0 +1,134 @@
+#!/bin/env python3
+"""
+Crash-safe outputs: every .age/.ycs file (and every plaintext restored from
+one) is written to a temporary file next to its target, fsynced, renamed into
+place, and only then is the source removed.
+
+    with GroupCommit(batch=64) as commit:
+        with atomic_output(dst) as tmp:
+            engine.encrypt_file(src, tmp, recipients)
+        commit.add(dst, remove=src)
+
+A rename only survives a crash once its directory has been fsynced as well.
+GroupCommit collects the renamed outputs and fsyncs each of their directories
+once per batch, then removes the sources of that batch. Whenever the machine
+goes down, each file is left as its source, its complete output or both, never
+as a truncated output without its source. Temporary files of an interrupted
+run end in TEMP_SUFFIX and can be deleted.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from batch import TEMP_SUFFIX
+from instrument import span
+
+DEFAULT_SYNC_BATCH = 64
+
+# The umask can only be read by setting it, which is done once here and not from the worker threads
+UMASK = os.umask(0o077)
+os.umask(UMASK)
+OUTPUT_MODE = 0o666 & ~UMASK
+
+
+def fsync_file(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(path: str) -> None:
+    """Makes the renames and new entries of a directory durable (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_output(dst: str) -> Iterator[str]:
+    """
+    Yields a temporary path in dst's directory to write the output to. On
+    success it is fsynced and renamed to dst, on failure it is removed and dst
+    is left as it was. The temporary file gets the mode of a file created
+    with open() (0666 minus the umask) rather than the 0600 of mkstemp.
+    """
+    directory, name = os.path.split(os.path.abspath(dst))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=TEMP_SUFFIX)
+    try:
+        os.fchmod(fd, OUTPUT_MODE)
+    finally:
+        os.close(fd)
+    try:
+        yield tmp
+        with span("fsync"):
+            fsync_file(tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class GroupCommit:
+    """
+    Makes renamed outputs durable in batches and removes their sources after,
+    with os.remove or the given remover (such as Shredder.submit). Sources that
+    could not be removed are collected in failed.
+    """
+
+    def __init__(self, batch: int = DEFAULT_SYNC_BATCH, remover: Optional[Callable[[str], None]] = None) -> None:
+        self.batch = max(1, batch)
+        self.remover = remover or os.remove
+        self.failed: Dict[str, Exception] = {}
+        self._pending: List[Tuple[str, Optional[str]]] = []
+        self._lock = threading.Lock()
+
+    def add(self, output: str, remove: Optional[str] = None) -> None:
+        """Registers a renamed output and the source to remove once it is durable."""
+        with self._lock:
+            self._pending.append((output, remove))
+            if len(self._pending) < self.batch:
+                return
+            pending, self._pending = self._pending, []
+        self._commit(pending)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self._commit(pending)
+
+    def _commit(self, pending: List[Tuple[str, Optional[str]]]) -> None:
+        directories = {os.path.dirname(os.path.abspath(output)) for output, _ in pending}
+        with span("fsync_directory", directories=len(directories), files=len(pending)):
+            for directory in directories:
+                fsync_directory(directory)
+        sources = [source for _, source in pending if source]
+        if not sources:
+            return
+        with span("file_removal", files=len(sources)):
+            for source in sources:
+                try:
+                    self.remover(source)
+                except OSError as e:
+                    print(f"Could not remove {source}: {e}", file=sys.stderr)
+                    with self._lock:
+                        self.failed[source] = e
+
+    def __enter__(self) -> "GroupCommit":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        # Outputs added so far are complete, their sources go even if the batch was cut short
+        self.flush()
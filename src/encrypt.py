@@ -1,26 +1,29 @@
 #!/bin/env python3
 
+import argparse
+import contextlib
+import getpass
 import os
-import subprocess
-import datetime
 import socket
 import sys
-import time
+import threading
 from contextlib import contextmanager
-from typing import Generator, IO, Any
+from typing import Generator, IO, Any, List
 from datetime import datetime
-
-@contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
-    try:
-        yield
-    finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
-
+from batch import DEFAULT_WORKERS, collect_files, print_summary, record_failure, run_batch
+from bundle import BUNDLE_SUFFIX, create_bundle, entry_paths
+from chunkstore import STORE_SUFFIX, ChunkStore, is_store
+from compress import (COMPRESS_CHOICES, encrypt_file as compress_encrypt_file,
+                      encrypt_stream as compress_encrypt_stream, resolve_codec)
+from daemon import print_reply, request as daemon_request
+from durable import DEFAULT_SYNC_BATCH, TEMP_SUFFIX, GroupCommit, atomic_output
+from engine import ENGINE_ENV, ENGINE_NAMES, select_engine
+from incremental import IncrementalIndex, recipients_id
+from instrument import PROFILE_ENV, enable as enable_profiling, span
+from keycache import key_cache
+from shred import DEFAULT_WIPE_WORKERS, POLICIES as WIPE_POLICIES, Shredder
+from segments import DEFAULT_SEGMENT_SIZE, SEGMENT_SUFFIX, encrypt_segmented
+from verify import PlaintextDigest, VerifyIndex
 
 @contextmanager
 def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
@@ -28,7 +31,7 @@ def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
     print('Opening file')
     try:
         yield file
-    except Exection as e:
+    except Exception as e:
         print(e)
     finally:
         print('Saving file...')
@@ -38,60 +41,364 @@ def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
 
 
 
-def encrypt_file(file_path):
-    ident = "first.txt"
-    curr = os.path.expanduser(f"~/.yubiCrypt/keys/{ident}")
-    with timer():
-        try:
-            # Check if the identity file exists
-            if not os.path.isfile(curr):
-                raise FileNotFoundError(f"Identity file not found: {curr}")
+DIRTY_LOCK = threading.Lock()
 
-            # Extract recipient key
-            with file_manager(curr, "r") as ident_file:
-                recipient_line = next(line for line in ident_file if "Recipient" in line)
-                recipient_key = recipient_line[16:].strip()  # Extract key after "Recipient"
 
-            # Encrypt the file using `age`
-            encrypted_file = f"{file_path}.age"
-            command = ["age", "-r", recipient_key, "-o", encrypted_file, file_path]
-            subprocess.run(command, check=True)
+def read_recipients(idents=None) -> List[str]:
+    """Looks up the recipient keys of the given identity files, by default of every known YubiKey."""
+    with span("key_load"):
+        return key_cache().recipients(idents)
 
-            # Confirm successful encryption
-            print(f"	SUCCESSFULLY ENCRYPTED! {file_path} ==> {encrypted_file}")
-            os.remove(file_path)  # Remove the original file
 
-        except Exception as e:
-            # Handle encryption failure
-            print("Reporting Failed Encryption Attempt")
-
-            # Log failure details
-            user = os.getlogin()
-            hostname = socket.gethostname()
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            os_type = os.name
-
-            failure_message = (
-                f"401 Unauthorized {user}@{hostname}\n"
-                f"{timestamp} {os_type}\n"
-                "ENCRYPTION FAILED"
-            )
-            print(failure_message)
-
-            # Log failure to a temporary file
-            dirty_tmp_path = os.path.expanduser("~/.yubiCrypt/dirty.tmp")
-            with file_manager(dirty_tmp_path, "a") as dirty_tmp:
-                dirty_tmp.write(f"{failure_message}\n")
+def report_failure(file_path: str, error: Exception) -> None:
+    """Prints and logs a failed encryption attempt to ~/.yubiCrypt/dirty.tmp."""
+    print(f"Reporting Failed Encryption Attempt: {file_path} ({error})")
+    record_failure(file_path, error)
+
+    # Log failure details
+    user = getpass.getuser()
+    hostname = socket.gethostname()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    os_type = os.name
+
+    failure_message = (
+        f"401 Unauthorized {user}@{hostname}\n"
+        f"{timestamp} {os_type}\n"
+        "ENCRYPTION FAILED"
+    )
+    print(failure_message)
+
+    # Log failure to a temporary file
+    dirty_tmp_path = os.path.expanduser("~/.yubiCrypt/dirty.tmp")
+    with span("failure_log"), DIRTY_LOCK:
+        with file_manager(dirty_tmp_path, "a") as dirty_tmp:
+            dirty_tmp.write(f"{failure_message}\n")
+
+
+def encrypt_file(file_path, recipients=None, engine=None, compress=None, commit=None, verify_index=None) -> bool:
+    """
+    Encrypts one file to file.age, never over an existing one. The original is
+    removed once the .age file is durable, right away or with the next batch of
+    commit. With verify_index the hashes of both are recorded for
+    yubiCryptVerify first, the plaintext one taken from the bytes fed to age.
+    """
+    try:
+        if recipients is None:
+            recipients = read_recipients()
+        if engine is None:
+            engine = select_engine()
 
+        # Encrypt the file using `age`, compressed first if asked to
+        encrypted_file = f"{file_path}.age"
+        if os.path.exists(encrypted_file):
+            raise FileExistsError(f"{encrypted_file} already exists")
+        digest = PlaintextDigest() if verify_index is not None else None
+        with atomic_output(encrypted_file) as tmp:
+            codec = compress_encrypt_file(engine, file_path, tmp, recipients, compress, digest)
+        if verify_index is not None:
+            verify_index.record(encrypted_file, digest)
+
+        # Confirm successful encryption
+        compressed = f" ({codec})" if codec != "none" else ""
+        print(f"	SUCCESSFULLY ENCRYPTED! {file_path} ==> {encrypted_file}{compressed}")
+        own_commit = commit is None
+        commit = commit or GroupCommit(1)
+        commit.add(encrypted_file, remove=file_path)  # Removes the original file
+        if own_commit and commit.failed:
+            raise commit.failed[file_path]
+        return True
+
+    except Exception as e:
+        # Handle encryption failure
+        report_failure(file_path, e)
+        print("Encryption failed.")
+        return False
+
+
+def commit_failures(results, commit) -> dict:
+    """Marks the files whose originals could not be removed as failed."""
+    for path, error in commit.failed.items():
+        report_failure(path, error)
+        results[path] = False
+    return results
+
+
+def encrypt_files(files, recipients, workers=DEFAULT_WORKERS, engine=None, compress=None,
+                  sync_batch=DEFAULT_SYNC_BATCH, remover=None, verify_index=None):
+    """
+    Encrypts many files over a bounded worker pool with a single recipient lookup.
+    Directory fsyncs and the removal of the originals (os.remove or remover)
+    happen per sync_batch files.
+    """
+    with GroupCommit(sync_batch, remover) as commit:
+        results = run_batch(lambda path: encrypt_file(path, recipients, engine, compress, commit, verify_index),
+                            files, workers)
+    return commit_failures(results, commit)
+
+
+def encrypt_changed_files(files, recipients, workers=DEFAULT_WORKERS, engine=None, index=None,
+                          compress=None, sync_batch=DEFAULT_SYNC_BATCH) -> dict:
+    """
+    Encrypts only new or changed files and keeps the plaintexts, recording each
+    encryption in the incremental index. Unchanged files count as successes.
+    """
+    index = index or IncrementalIndex()
+    engine = engine or select_engine()
+    recipients_key = recipients_id(recipients)
+    changed = []
+    commit = GroupCommit(sync_batch)
+
+    def encrypt_if_changed(file_path) -> bool:
+        try:
+            state = index.check(file_path, recipients_key)
+            if state is None:
+                return True
+            encrypted_file = f"{file_path}.age"
+            # The previous ciphertext stays in place until the new one is complete
+            with atomic_output(encrypted_file) as tmp:
+                compress_encrypt_file(engine, file_path, tmp, recipients, compress)
+            commit.add(encrypted_file)
+            index.record(file_path, state, recipients_key, encrypted_file)
+            print(f"\tSUCCESSFULLY ENCRYPTED! {file_path} ==> {encrypted_file}")
+            changed.append(file_path)
+            return True
+        except Exception as e:
+            report_failure(file_path, e)
             print("Encryption failed.")
+            return False
+
+    results = run_batch(encrypt_if_changed, files, workers)
+    commit.flush()
+    index.save()
+    print(f"{len(changed)} new or changed, {sum(results.values()) - len(changed)} unchanged")
+    return results
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 encrypt.py <file_to_encrypt>")
-        sys.exit(1)
 
-    file_to_encrypt = sys.argv[1]
-    if os.path.isfile(file_to_encrypt):
-        encrypt_file(file_to_encrypt)
+def store_files(files, store_path, recipients, workers=DEFAULT_WORKERS, engine=None, remover=None) -> dict:
+    """Adds files to a deduplicating chunk store, created on first use, and removes the plaintexts."""
+    if not store_path.endswith(STORE_SUFFIX):
+        store_path += STORE_SUFFIX
+    if is_store(store_path):
+        store = ChunkStore(store_path, engine)
+        # Only touches the YubiKey if this machine has not cached the store's chunk key yet
+        store.chunk_key(key_cache().identity_files())
     else:
-        print(f"File not found: {file_to_encrypt}")
+        store = ChunkStore.create(store_path, recipients, engine)
+    rel_paths = entry_paths(files, store_path)
+
+    results = {}
+    total = written = 0
+    for file_path in files:
+        try:
+            # Chunks and manifest are durable once add_file returns
+            stats = store.add_file(file_path, rel_paths[file_path], workers)
+            print(f"\tSUCCESSFULLY STORED! {file_path} ==> {store_path} "
+                  f"({stats['new_chunks']}/{stats['chunks']} new chunks)")
+            with span("file_removal"):
+                (remover or os.remove)(file_path)
+            total += stats["size"]
+            written += stats["written"]
+            results[file_path] = True
+        except Exception as e:
+            report_failure(file_path, e)
+            print("Encryption failed.")
+            results[file_path] = False
+    if total:
+        print(f"Stored {total:,} bytes as {written:,} bytes of new chunks ({written / total:.1%})")
+    return results
+
+
+def encrypt_large_files(files, recipients, segment_size=DEFAULT_SEGMENT_SIZE, workers=DEFAULT_WORKERS,
+                        engine=None, sync_batch=DEFAULT_SYNC_BATCH, remover=None, verify_index=None) -> dict:
+    """Encrypts files one at a time, spreading the segments of each over the workers."""
+    results = {}
+    with GroupCommit(sync_batch, remover) as commit:
+        for file_path in files:
+            segmented_file = f"{file_path}{SEGMENT_SUFFIX}"
+            try:
+                if os.path.exists(segmented_file):
+                    raise FileExistsError(f"{segmented_file} already exists")
+                digest = PlaintextDigest() if verify_index is not None else None
+                with atomic_output(segmented_file) as tmp:
+                    encrypt_segmented(file_path, tmp, recipients, segment_size, workers, engine, digest)
+                if verify_index is not None:
+                    verify_index.record(segmented_file, digest)
+                print(f"\tSUCCESSFULLY ENCRYPTED! {file_path} ==> {segmented_file}")
+                commit.add(segmented_file, remove=file_path)
+                results[file_path] = True
+            except Exception as e:
+                report_failure(file_path, e)
+                print("Encryption failed.")
+                results[file_path] = False
+    return commit_failures(results, commit)
+
+
+def encrypt_stream(recipients, engine, src=None, dst=None, compress=None) -> bool:
+    """Encrypts stdin to stdout; nothing touches the disk."""
+    try:
+        compress_encrypt_stream(engine, src or sys.stdin.buffer, dst or sys.stdout.buffer, recipients, compress)
+        return True
+    except Exception as e:
+        report_failure("<stdin>", e)
+        print("Encryption failed.")
+        return False
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="yubienCrypt", description="Encrypt files to your YubiKey.")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns, - for stdin to stdout")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into directories")
+    parser.add_argument("-i", "--identity", action="append", metavar="NAME",
+                        help="identity file in ~/.yubiCrypt/keys to encrypt to, repeatable (default: all)")
+    parser.add_argument("-b", "--bundle", metavar="NAME.ycb",
+                        help="encrypt all files into one bundle under a single hardware-wrapped key")
+    parser.add_argument("-s", "--store", metavar="NAME.ycc",
+                        help="add the files to a deduplicating chunk store, created if it does not exist")
+    parser.add_argument("-S", "--segmented", action="store_true",
+                        help=f"split each file into segments encrypted in parallel ({SEGMENT_SUFFIX}, for large files)")
+    parser.add_argument("--segment-size", type=int, default=DEFAULT_SEGMENT_SIZE >> 20, metavar="MiB",
+                        help=f"segment size for --segmented (default: {DEFAULT_SEGMENT_SIZE >> 20})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep the plaintexts and only encrypt files changed since the last run")
+    parser.add_argument("--prune", action="store_true",
+                        help="with --incremental, remove ciphertexts whose source files are gone")
+    parser.add_argument("--compress", choices=COMPRESS_CHOICES, metavar="CODEC",
+                        help=f"compress .age files before encrypting: {', '.join(COMPRESS_CHOICES)}")
+    parser.add_argument("-z", dest="compress", action="store_const", const="auto",
+                        help="same as --compress auto: best installed codec, skips files that do not compress")
+    parser.add_argument("--sync-batch", type=int, default=DEFAULT_SYNC_BATCH, metavar="N",
+                        help=f"fsync the output directories and remove the originals every N files "
+                             f"(default: {DEFAULT_SYNC_BATCH}, 1 for one file at a time)")
+    parser.add_argument("--wipe", choices=WIPE_POLICIES, default="unlink",
+                        help="how to remove the originals: unlink, overwrite (one random pass), "
+                             "multipass (three), punch (free/TRIM the blocks) (default: unlink)")
+    parser.add_argument("--wipe-rate", type=float, metavar="MB/s",
+                        help="limit the overwrite passes to MB/s in total (default: unlimited)")
+    parser.add_argument("--wipe-workers", type=int, default=DEFAULT_WIPE_WORKERS, metavar="N",
+                        help=f"files wiped at once, next to the encryption workers (default: {DEFAULT_WIPE_WORKERS})")
+    parser.add_argument("--verify", action="store_true",
+                        help="record plaintext and ciphertext hashes so yubiCryptVerify can check the files later "
+                             "(--incremental always records them)")
+    parser.add_argument("-e", "--engine", choices=ENGINE_NAMES, default=None,
+                        help=f"age backend (default: ${ENGINE_ENV} or auto)")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"number of parallel age processes (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help=f"record timing spans to FILE (.prom or JSON lines) or stderr (default: ${PROFILE_ENV})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    enable_profiling(args.profile)
+
+    if args.paths == ["-"]:
+        stdout = sys.stdout.buffer
+        # stdout carries the ciphertext, so every message goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            try:
+                recipients = read_recipients(args.identity)
+                engine = select_engine(args.engine)
+            except Exception as e:
+                report_failure("<stdin>", e)
+                return 1
+            return 0 if encrypt_stream(recipients, engine, dst=stdout, compress=args.compress) else 1
+
+    # Never re-encrypt existing ciphertexts when walking directories
+    files, missing = collect_files(args.paths, args.recursive, exclude_suffix=(".age", SEGMENT_SUFFIX, TEMP_SUFFIX),
+                                   prune_suffix=(BUNDLE_SUFFIX, STORE_SUFFIX))
+    if not files and not args.prune:
+        print("No files to encrypt.")
+        return 1
+
+    if args.prune and not args.incremental:
+        print("--prune needs --incremental.")
+        return 1
+
+    if args.wipe != "unlink" and args.incremental:
+        print("--wipe does not apply to --incremental, which keeps the originals.")
+        return 1
+
+    if args.compress and (args.bundle or args.store or args.segmented):
+        print("--compress only applies to .age files, not to bundles, stores or segmented files.")
+        return 1
+
+    if args.compress:
+        try:
+            resolve_codec(args.compress)
+        except ValueError as e:
+            print(e)
+            return 1
+
+    if args.verify and (args.bundle or args.store):
+        print("--verify applies to .age and segmented files, bundles and stores authenticate their own contents.")
+        return 1
+
+    direct = args.bundle or args.store or args.segmented or args.incremental or args.wipe != "unlink" or args.verify
+    if not direct:
+        response = daemon_request({"op": "encrypt", "files": [os.path.abspath(p) for p in files],
+                                   "identities": args.identity, "engine": args.engine, "workers": args.workers,
+                                   "compress": args.compress, "sync_batch": args.sync_batch})
+        if response is not None:
+            return print_reply(response, files, missing, "Encrypt")
+
+    try:
+        recipients = read_recipients(args.identity)
+        engine = select_engine(args.engine)
+    except Exception as e:
+        for path in files:
+            report_failure(path, e)
+        print("Encryption failed.")
+        return 1
+
+    rate = args.wipe_rate * (1 << 20) if args.wipe_rate else None
+    shredder = Shredder(args.wipe, args.wipe_workers, rate)
+    verify_index = VerifyIndex() if args.verify else None
+    with span("batch", files=len(files)):
+        if args.bundle:
+            try:
+                results = create_bundle(files, args.bundle, recipients, max(1, args.workers), engine, shredder.submit)
+            except Exception as e:
+                report_failure(args.bundle, e)
+                results = {path: False for path in files}
+        elif args.store:
+            try:
+                results = store_files(files, args.store, recipients, max(1, args.workers), engine, shredder.submit)
+            except Exception as e:
+                report_failure(args.store, e)
+                results = {path: False for path in files}
+        elif args.incremental:
+            index = IncrementalIndex()
+            results = encrypt_changed_files(files, recipients, max(1, args.workers), engine, index, args.compress,
+                                            args.sync_batch)
+            if args.prune:
+                for path in index.prune(args.paths):
+                    print(f"\tPRUNED {path}")
+                index.save()
+        elif args.segmented:
+            results = encrypt_large_files(files, recipients, args.segment_size << 20, max(1, args.workers), engine,
+                                          args.sync_batch, shredder.submit, verify_index)
+        else:
+            results = encrypt_files(files, recipients, max(1, args.workers), engine, args.compress, args.sync_batch,
+                                    shredder.submit, verify_index)
+        shredder.close()
+        if verify_index is not None:
+            verify_index.save()
+    for path, error in shredder.failed.items():
+        report_failure(path, error)
+        results[path] = False
+    # Paths that matched nothing fail the run like files that could not be encrypted, unless
+    # --prune was asked to clean up after sources that are gone
+    if not args.prune:
+        results.update(dict.fromkeys(missing, False))
+    if args.wipe != "unlink" and shredder.stats["seconds"]:
+        stats = shredder.stats
+        print(f"Wiped {stats['files']} files ({args.wipe}): {stats['size']:,} bytes, "
+              f"{stats['written']:,} written over them, {stats['size'] / stats['seconds'] / (1 << 20):.1f} MB/s "
+              f"per worker")
+    print_summary(results, "Encrypt")
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+#!/bin/env python3
+"""
+Pluggable age backends.
+
+``AgeEngine`` drives the ``age`` binary, ``PyrageEngine`` encrypts in-process
+through pyrage (https://github.com/woodruffw/pyrage) for X25519 keys and hands
+plugin recipients/identities such as age-plugin-yubikey over to the binary.
+The backend is picked with ``--engine`` or ``YUBICRYPT_ENGINE`` (auto, age, pyrage).
+"""
+
+import errno
+import os
+import subprocess
+import threading
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from instrument import span
+
+try:
+    import pyrage
+except ImportError:
+    pyrage = None
+
+ENGINE_ENV = "YUBICRYPT_ENGINE"
+ENGINE_NAMES = ("auto", "age", "pyrage")
+
+# pyrage holds plaintext and ciphertext in memory, larger files go to the age binary
+IN_PROCESS_LIMIT = 64 << 20
+
+# One identity file path or several, age tries them all
+IdentityFiles = Union[str, Sequence[str]]
+
+
+def is_x25519_recipient(recipient: str) -> bool:
+    # Plugin recipients look like age1<plugin>1..., native ones are bech32 "age1" + data
+    return recipient.startswith("age1") and len(recipient) == 62
+
+
+def is_x25519_identity(identity: str) -> bool:
+    return identity.startswith("AGE-SECRET-KEY-1")
+
+
+def identity_file_list(identity_file: IdentityFiles) -> List[str]:
+    return [identity_file] if isinstance(identity_file, str) else list(identity_file)
+
+
+def recipient_args(recipients: List[str]) -> List[str]:
+    args = []
+    for recipient in recipients:
+        args += ["-r", recipient]
+    return args
+
+
+def identity_args(identity_file: IdentityFiles) -> List[str]:
+    args = []
+    for path in identity_file_list(identity_file):
+        args += ["-i", path]
+    return args
+
+
+def read_identity_lines(identity_file: IdentityFiles) -> List[str]:
+    lines = []
+    for path in identity_file_list(identity_file):
+        with open(path, "r") as f:
+            lines += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return lines
+
+
+def ciphertext_size_hint(length: int) -> int:
+    # age adds a 16 byte tag per 64 KiB STREAM chunk and a header of a few hundred bytes
+    return length + (length // 65536 + 1) * 16 + 4096
+
+
+def send_region(out_fd: int, in_fd: int, offset: int, length: int) -> None:
+    """Copies length bytes at offset of in_fd to out_fd, inside the kernel where sendfile allows it."""
+    sent = 0
+    use_sendfile = hasattr(os, "sendfile")
+    while sent < length:
+        if use_sendfile:
+            try:
+                n = os.sendfile(out_fd, in_fd, offset + sent, length - sent)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                use_sendfile = False
+                continue
+        else:
+            n = os.write(out_fd, os.pread(in_fd, min(length - sent, 1 << 20), offset + sent))
+        if n == 0:
+            raise EOFError(f"Short read at offset {offset + sent}")
+        sent += n
+
+
+def read_all(fd: int, size_hint: int) -> bytearray:
+    """Reads fd to EOF into one preallocated buffer, growing it only if the hint was short."""
+    buffer = bytearray(size_hint)
+    filled = 0
+    while True:
+        if filled == len(buffer):
+            buffer.extend(bytes(max(1 << 16, len(buffer) // 4)))
+        with memoryview(buffer)[filled:] as view:
+            n = os.readv(fd, [view])
+        if not n:
+            break
+        filled += n
+    del buffer[filled:]
+    return buffer
+
+
+def run_age(command: List[str], phase: str, **kwargs) -> subprocess.CompletedProcess:
+    """Runs one age process as a profiling span named after the phase."""
+    with span(phase, engine="age"):
+        return subprocess.run(command, check=True, **kwargs)
+
+
+class AgeEngine:
+    """Runs the age binary for every operation."""
+
+    name = "age"
+
+    def encrypt_file(self, src: str, dst: str, recipients: List[str]) -> None:
+        run_age(["age"] + recipient_args(recipients) + ["-o", dst, src], "age_encrypt")
+
+    def decrypt_file(self, src: str, dst: str, identity_file: Optional[IdentityFiles] = None,
+                     identity: Optional[str] = None) -> None:
+        if identity is not None:
+            run_age(["age", "-d", "-i", "-", "-o", dst, src], "age_decrypt", input=f"{identity}\n".encode())
+        else:
+            run_age(["age", "-d"] + identity_args(identity_file) + ["-o", dst, src], "age_decrypt")
+
+    def encrypt_stream(self, src: IO, dst: IO, recipients: List[str]) -> None:
+        """Encrypts between two file objects; age reads and writes them directly in constant memory."""
+        run_age(["age"] + recipient_args(recipients), "age_encrypt", stdin=src, stdout=dst)
+
+    def decrypt_stream(self, src: IO, dst: IO, identity_file: IdentityFiles) -> None:
+        run_age(["age", "-d"] + identity_args(identity_file), "age_decrypt", stdin=src, stdout=dst)
+
+    def decrypt_chunks(self, src: Union[str, IO], identity_file: IdentityFiles,
+                       chunk_size: int = 1 << 20) -> Iterator[bytes]:
+        """
+        Yields the plaintext of src (a path or file object) while age decrypts it.
+        age only releases authenticated STREAM chunks, and closing the generator
+        early stops it.
+        """
+        command = ["age", "-d"] + identity_args(identity_file)
+        if isinstance(src, str):
+            with open(src, "rb") as f:
+                process = subprocess.Popen(command, stdin=f, stdout=subprocess.PIPE)
+        else:
+            process = subprocess.Popen(command, stdin=src, stdout=subprocess.PIPE)
+        finished = False
+        try:
+            with span("age_decrypt", engine="age"):
+                while True:
+                    chunk = process.stdout.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finished = True
+        finally:
+            process.stdout.close()
+            if not finished:
+                process.kill()
+            returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, process.args)
+
+    def encrypt_bytes(self, data: bytes, recipients: List[str]) -> bytes:
+        return run_age(["age"] + recipient_args(recipients), "age_encrypt", input=data, capture_output=True).stdout
+
+    def decrypt_bytes(self, data: bytes, identity_file: Optional[IdentityFiles] = None,
+                      identity: Optional[str] = None) -> bytes:
+        if identity is not None:
+            # The ciphertext takes stdin, so the identity goes through a pipe
+            read_fd, write_fd = os.pipe()
+            try:
+                with os.fdopen(write_fd, "w") as w:
+                    w.write(f"{identity}\n")
+                return run_age(["age", "-d", "-i", f"/dev/fd/{read_fd}"], "age_decrypt", input=data,
+                               capture_output=True, pass_fds=(read_fd,)).stdout
+            finally:
+                os.close(read_fd)
+        return run_age(["age", "-d"] + identity_args(identity_file), "age_decrypt", input=data,
+                       capture_output=True).stdout
+
+    def _run_region(self, command: List[str], fd: int, offset: int, length: int, size_hint: int,
+                    phase: str, pass_fds: Tuple[int, ...] = ()) -> bytearray:
+        """
+        Runs age over length bytes of fd at offset. The kernel moves the input
+        into age's stdin and the output lands in one preallocated buffer.
+        """
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, pass_fds=pass_fds)
+
+        def feed() -> None:
+            try:
+                send_region(process.stdin.fileno(), fd, offset, length)
+            except BrokenPipeError:
+                pass  # age gave up early, its exit status says why
+            finally:
+                process.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        with span(phase, engine="age"):
+            feeder.start()
+            try:
+                output = read_all(process.stdout.fileno(), size_hint)
+            finally:
+                process.stdout.close()
+                feeder.join()
+                returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, command)
+        return output
+
+    def encrypt_region(self, fd: int, offset: int, length: int, recipients: List[str]) -> bytes:
+        """Encrypts length bytes of fd at offset without copying them through Python."""
+        return self._run_region(["age"] + recipient_args(recipients), fd, offset, length,
+                                ciphertext_size_hint(length), "age_encrypt")
+
+    def decrypt_region(self, fd: int, offset: int, length: int, plaintext_size: int,
+                       identity_file: Optional[IdentityFiles] = None, identity: Optional[str] = None) -> bytes:
+        """Decrypts length bytes of fd at offset into a buffer sized for the expected plaintext."""
+        # One spare byte lets the EOF read land without growing the buffer
+        if identity is not None:
+            read_fd, write_fd = os.pipe()
+            try:
+                with os.fdopen(write_fd, "w") as w:
+                    w.write(f"{identity}\n")
+                return self._run_region(["age", "-d", "-i", f"/dev/fd/{read_fd}"], fd, offset, length,
+                                        plaintext_size + 1, "age_decrypt", (read_fd,))
+            finally:
+                os.close(read_fd)
+        return self._run_region(["age", "-d"] + identity_args(identity_file), fd, offset, length,
+                                plaintext_size + 1, "age_decrypt")
+
+    def generate_identity(self) -> Tuple[str, str]:
+        """Returns a fresh X25519 (identity, recipient) pair."""
+        result = run_age(["age-keygen"], "age_keygen", capture_output=True, text=True)
+        identity = recipient = ""
+        for line in result.stdout.splitlines():
+            if line.startswith("AGE-SECRET-KEY-"):
+                identity = line.strip()
+            elif line.startswith("# public key:"):
+                recipient = line.split(":", 1)[1].strip()
+        if not identity or not recipient:
+            raise ValueError("age-keygen returned no key")
+        return identity, recipient
+
+
+class PyrageEngine(AgeEngine):
+    """
+    Encrypts X25519 in-process with pyrage, falls back to the binary for plugins.
+    Streams, files and regions above IN_PROCESS_LIMIT stay on the binary, pyrage only
+    works on whole buffers and would hold both of them in memory.
+    """
+
+    name = "pyrage"
+
+    def __init__(self) -> None:
+        if pyrage is None:
+            raise ImportError("pyrage is not installed (pip install pyrage)")
+
+    @staticmethod
+    def _recipients(recipients: List[str]):
+        if not all(is_x25519_recipient(r) for r in recipients):
+            return None
+        return [pyrage.x25519.Recipient.from_str(r) for r in recipients]
+
+    @staticmethod
+    def _identities(identity_file: Optional[IdentityFiles], identity: Optional[str]):
+        lines = [identity] if identity is not None else read_identity_lines(identity_file)
+        if not lines or not all(is_x25519_identity(line) for line in lines):
+            return None
+        return [pyrage.x25519.Identity.from_str(line) for line in lines]
+
+    def encrypt_file(self, src: str, dst: str, recipients: List[str]) -> None:
+        native = self._recipients(recipients)
+        if native is None or os.path.getsize(src) > IN_PROCESS_LIMIT:
+            return super().encrypt_file(src, dst, recipients)
+        with open(src, "rb") as f:
+            data = f.read()
+        with span("age_encrypt", engine="pyrage"):
+            data = pyrage.encrypt(data, native)
+        with open(dst, "wb") as f:
+            f.write(data)
+
+    def decrypt_file(self, src: str, dst: str, identity_file: Optional[IdentityFiles] = None,
+                     identity: Optional[str] = None) -> None:
+        native = self._identities(identity_file, identity)
+        if native is None or os.path.getsize(src) > IN_PROCESS_LIMIT:
+            return super().decrypt_file(src, dst, identity_file, identity)
+        with open(src, "rb") as f:
+            data = f.read()
+        with span("age_decrypt", engine="pyrage"):
+            data = pyrage.decrypt(data, native)
+        with open(dst, "wb") as f:
+            f.write(data)
+
+    def encrypt_bytes(self, data: bytes, recipients: List[str]) -> bytes:
+        native = self._recipients(recipients)
+        if native is None:
+            return super().encrypt_bytes(data, recipients)
+        with span("age_encrypt", engine="pyrage"):
+            return pyrage.encrypt(data, native)
+
+    def decrypt_bytes(self, data: bytes, identity_file: Optional[IdentityFiles] = None,
+                      identity: Optional[str] = None) -> bytes:
+        native = self._identities(identity_file, identity)
+        if native is None:
+            return super().decrypt_bytes(data, identity_file, identity)
+        with span("age_decrypt", engine="pyrage"):
+            return pyrage.decrypt(data, native)
+
+    def encrypt_region(self, fd: int, offset: int, length: int, recipients: List[str]) -> bytes:
+        native = self._recipients(recipients)
+        if native is None or length > IN_PROCESS_LIMIT:
+            return super().encrypt_region(fd, offset, length, recipients)
+        # pyrage only accepts bytes, so this read is the one copy we cannot avoid
+        data = os.pread(fd, length, offset)
+        with span("age_encrypt", engine="pyrage"):
+            return pyrage.encrypt(data, native)
+
+    def decrypt_region(self, fd: int, offset: int, length: int, plaintext_size: int,
+                       identity_file: Optional[IdentityFiles] = None, identity: Optional[str] = None) -> bytes:
+        native = self._identities(identity_file, identity)
+        if native is None or length > IN_PROCESS_LIMIT:
+            return super().decrypt_region(fd, offset, length, plaintext_size, identity_file, identity)
+        data = os.pread(fd, length, offset)
+        with span("age_decrypt", engine="pyrage"):
+            return pyrage.decrypt(data, native)
+
+    def generate_identity(self) -> Tuple[str, str]:
+        identity = pyrage.x25519.Identity.generate()
+        return str(identity), str(identity.to_public())
+
+
+_engines: Dict[str, AgeEngine] = {}
+
+
+def select_engine(name: Optional[str] = None) -> AgeEngine:
+    """Returns the requested backend; auto prefers pyrage and falls back to the age binary."""
+    name = (name or os.environ.get(ENGINE_ENV) or "auto").lower()
+    if name not in ENGINE_NAMES:
+        raise ValueError(f"Unknown engine '{name}', choose from {', '.join(ENGINE_NAMES)}")
+    if name == "auto":
+        name = "pyrage" if pyrage is not None else "age"
+    if name not in _engines:
+        _engines[name] = PyrageEngine() if name == "pyrage" else AgeEngine()
+    return _engines[name]
@@ -0,0 +1,123 @@
+#!/bin/env python3
+"""
+Change index for incremental encryption (``yubienCrypt --incremental``).
+
+Incremental runs keep the plaintext and only re-encrypt files that changed.
+~/.yubiCrypt/incremental.index.json maps every source file to its last encryption:
+
+    size, mtime_ns   stat data, compared first
+    sha256           content hash, only computed when the stat data changed
+    recipients       hash of the recipient set, new keys re-encrypt everything
+    ciphertext       the .age file written for it and its sha256
+
+The stat data and the hash are taken before encrypting, so a file modified
+while it is being encrypted no longer matches and is picked up again by the
+next run.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence
+
+INDEX_PATH = os.path.expanduser("~/.yubiCrypt/incremental.index.json")
+INDEX_VERSION = 1
+HASH_BLOCK = 1 << 20
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file, streamed in 1 MiB blocks."""
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def recipients_id(recipients: Sequence[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(recipients)).encode()).hexdigest()
+
+
+class IncrementalIndex:
+    """Last encryption of every source file, keyed by absolute path."""
+
+    def __init__(self, index_path: str = INDEX_PATH) -> None:
+        self.index_path = index_path
+        self.files: Dict[str, dict] = self._read_index()
+        self._lock = threading.Lock()
+
+    def _read_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                return index["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.index_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".incremental.index.")
+        try:
+            with os.fdopen(fd, "w") as f, self._lock:
+                json.dump({"version": INDEX_VERSION, "files": self.files}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.index_path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def check(self, path: str, recipients_key: str) -> Optional[dict]:
+        """
+        Returns None when path is unchanged since its last encryption, else the
+        state (stat data and hash) to record once it has been encrypted again.
+        The hash is taken here, before encrypting: hashing the file afterwards
+        could record content that age never read.
+        """
+        st = os.stat(path)
+        with self._lock:
+            entry = self.files.get(os.path.abspath(path))
+        if entry is not None and entry["recipients"] == recipients_key and os.path.exists(entry["ciphertext"]) \
+                and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return None
+        state = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_hash(path)}
+        if entry is None or entry["recipients"] != recipients_key or not os.path.exists(entry["ciphertext"]):
+            return state
+
+        # Touched, but maybe not modified: only the content decides
+        if state["sha256"] == entry["sha256"]:
+            with self._lock:
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            return None
+        return state
+
+    def record(self, path: str, state: dict, recipients_key: str, ciphertext: str) -> None:
+        entry = dict(
+            state,
+            recipients=recipients_key,
+            ciphertext=os.path.abspath(ciphertext),
+            ciphertext_sha256=file_hash(ciphertext),
+        )
+        with self._lock:
+            self.files[os.path.abspath(path)] = entry
+
+    def prune(self, roots: Sequence[str]) -> List[str]:
+        """Removes the ciphertexts of vanished sources below roots, returns their paths."""
+        roots = [os.path.abspath(root) for root in roots]
+        removed = []
+        with self._lock:
+            for path, entry in list(self.files.items()):
+                if os.path.exists(path):
+                    continue
+                if not any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots):
+                    continue
+                if os.path.exists(entry["ciphertext"]):
+                    os.remove(entry["ciphertext"])
+                    removed.append(entry["ciphertext"])
+                del self.files[path]
+        return removed
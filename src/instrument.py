@@ -0,0 +1,120 @@
+#!/bin/env python3
+"""
+Named timing spans shared by yubiCrypt, the importer and the setup scripts.
+
+Spans are dropped unless profiling is switched on with ``--profile [TARGET]``
+or ``YUBICRYPT_PROFILE=TARGET``. The collected spans are exported at exit:
+
+    -                 per-phase summary on stderr
+    <file>.prom       Prometheus textfile (node_exporter textfile collector)
+    <file>            one JSON object per span (JSON lines), appended
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, List, Optional
+
+PROFILE_ENV = "YUBICRYPT_PROFILE"
+
+
+class Collector:
+    """Thread safe in-memory list of finished spans."""
+
+    def __init__(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+        self.target: Optional[str] = None
+        self._lock = threading.Lock()
+        self._registered = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.target is not None
+
+    def enable(self, target: str = "-") -> None:
+        self.target = target
+        if not self._registered:
+            atexit.register(self.export)
+            self._registered = True
+
+    def record(self, name: str, start: float, duration: float, attrs: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append({"name": name, "start": start, "seconds": duration, **attrs})
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and max seconds per span name."""
+        phases: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for s in self.spans:
+                phase = phases.setdefault(s["name"], {"count": 0, "total": 0.0, "max": 0.0})
+                phase["count"] += 1
+                phase["total"] += s["seconds"]
+                phase["max"] = max(phase["max"], s["seconds"])
+        return phases
+
+    def export(self) -> None:
+        if not self.target or not self.spans:
+            return
+        if self.target == "-":
+            print_summary(self.summary())
+        elif self.target.endswith(".prom"):
+            export_prometheus(self.summary(), self.target)
+        else:
+            with self._lock, open(self.target, "a") as f:
+                for s in self.spans:
+                    f.write(json.dumps(s) + "\n")
+
+
+COLLECTOR = Collector()
+if os.environ.get(PROFILE_ENV):
+    COLLECTOR.enable(os.environ[PROFILE_ENV])
+
+
+def enable(target: Optional[str] = "-") -> None:
+    """Switches profiling on, e.g. from a --profile flag."""
+    if target:
+        COLLECTOR.enable(target)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Generator[None, Any, None]:
+    """Times the enclosed block as one span of the given name."""
+    if not COLLECTOR.enabled:
+        yield
+        return
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        COLLECTOR.record(name, start_wall, time.perf_counter() - start, attrs)
+
+
+def print_summary(phases: Dict[str, Dict[str, float]]) -> None:
+    # Spans nest (batch holds every age_encrypt), so totals are not summed up
+    print(f"\n{'span':<24} {'count':>7} {'total s':>10} {'max s':>9}", file=sys.stderr)
+    for name, p in sorted(phases.items(), key=lambda item: -item[1]["total"]):
+        print(f"{name:<24} {p['count']:>7} {p['total']:>10.4f} {p['max']:>9.4f}", file=sys.stderr)
+
+
+def export_prometheus(phases: Dict[str, Dict[str, float]], path: str) -> None:
+    lines = [
+        "# HELP yubicrypt_span_seconds_total Time spent per yubiCrypt phase.",
+        "# TYPE yubicrypt_span_seconds_total counter",
+    ]
+    lines += [f'yubicrypt_span_seconds_total{{span="{n}"}} {p["total"]:.6f}' for n, p in sorted(phases.items())]
+    lines += ["# HELP yubicrypt_span_count Number of spans per yubiCrypt phase.",
+              "# TYPE yubicrypt_span_count counter"]
+    lines += [f'yubicrypt_span_count{{span="{n}"}} {p["count"]}' for n, p in sorted(phases.items())]
+    lines += ["# HELP yubicrypt_span_seconds_max Longest span per yubiCrypt phase.",
+              "# TYPE yubicrypt_span_seconds_max gauge"]
+    lines += [f'yubicrypt_span_seconds_max{{span="{n}"}} {p["max"]:.6f}' for n, p in sorted(phases.items())]
+    # Written aside and renamed so the textfile collector never reads half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
@@ -0,0 +1,172 @@
+#!/bin/env python3
+"""
+Parsed view of ~/.yubiCrypt/keys shared by encrypt.py and decrypt.py.
+
+Identity files are stored per YubiKey (yubikey-<serial>.txt, written by
+yubiCryptImport) and each is parsed once into (serial, slot, recipient) entries and
+kept in ~/.yubiCrypt/keys.index.json. An entry is reused as long as the
+file's mtime, size and inode are unchanged, so a warm lookup costs one
+stat() per identity file.
+"""
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+KEYS_DIR = os.path.expanduser("~/.yubiCrypt/keys")
+INDEX_PATH = os.path.expanduser("~/.yubiCrypt/keys.index.json")
+INDEX_VERSION = 1
+
+SERIAL_SLOT = re.compile(r"Serial:\s*(\d+),\s*Slot:\s*(\d+)")
+
+
+def parse_identity_file(path: str) -> List[dict]:
+    """Parses the age-plugin-yubikey comment blocks of one identity file."""
+    entries = []
+    serial = slot = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            match = SERIAL_SLOT.search(line)
+            if match:
+                serial, slot = match.group(1), int(match.group(2))
+            elif line.startswith("#") and "Recipient:" in line:
+                recipient = line.split("Recipient:", 1)[1].strip()
+                entries.append({"serial": serial, "slot": slot, "recipient": recipient})
+                serial = slot = None
+            elif line.startswith("AGE-SECRET-KEY-") and not entries:
+                # Plain age identity without comments, the recipient is not recorded
+                entries.append({"serial": None, "slot": None, "recipient": None})
+    return entries
+
+
+def file_signature(st: os.stat_result) -> List[int]:
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+class KeyCache:
+    """Identity files of a keys directory with their parsed entries."""
+
+    def __init__(self, keys_dir: str = KEYS_DIR, index_path: str = INDEX_PATH) -> None:
+        self.keys_dir = keys_dir
+        self.index_path = index_path
+        self.files: Dict[str, dict] = {}
+        self._load()
+
+    def _read_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("keys_dir") == self.keys_dir:
+                return index["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _write_index(self) -> None:
+        directory = os.path.dirname(self.index_path)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".keys.index.")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": INDEX_VERSION, "keys_dir": self.keys_dir, "files": self.files}, f)
+            os.replace(tmp, self.index_path)
+        except OSError:
+            # A read-only home only costs us the cache
+            pass
+
+    def refresh(self) -> None:
+        """Re-stats the identity files, re-parsing only the ones that changed."""
+        self._load(dict(self.files))
+
+    def _load(self, cached: Optional[Dict[str, dict]] = None) -> None:
+        if cached is None:
+            cached = self._read_index()
+        files = {}
+        changed = False
+        try:
+            names = sorted(n for n in os.listdir(self.keys_dir) if n.endswith(".txt"))
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            path = os.path.join(self.keys_dir, name)
+            try:
+                signature = file_signature(os.stat(path))
+            except FileNotFoundError:
+                continue
+            record = cached.get(name)
+            if record is None or record["signature"] != signature:
+                record = {"signature": signature, "entries": parse_identity_file(path)}
+                changed = True
+            files[name] = record
+
+        # Swapped in one go so concurrent readers never see a half built view
+        self.files = files
+        if changed or set(cached) != set(files):
+            self._write_index()
+
+    def identity_files(self, names: Optional[Sequence[str]] = None) -> List[str]:
+        """Paths of the requested identity files, or all of them."""
+        names = list(names) if names else list(self.files)
+        missing = [name for name in names if name not in self.files]
+        if missing:
+            raise FileNotFoundError(f"Identity file not found: {os.path.join(self.keys_dir, missing[0])}")
+        return [os.path.join(self.keys_dir, name) for name in names]
+
+    def entries(self, names: Optional[Sequence[str]] = None) -> List[dict]:
+        result = []
+        for path in self.identity_files(names):
+            name = os.path.basename(path)
+            result.extend(dict(entry, file=name) for entry in self.files[name]["entries"])
+        return result
+
+    def recipients(self, names: Optional[Sequence[str]] = None) -> List[str]:
+        """Unique recipients of the requested identity files, in file order."""
+        recipients = []
+        for entry in self.entries(names):
+            if entry["recipient"] and entry["recipient"] not in recipients:
+                recipients.append(entry["recipient"])
+        if not recipients:
+            raise ValueError(f"No recipient found in {', '.join(names or self.files) or self.keys_dir}")
+        return recipients
+
+    def identity_files_for_serials(self, serials: Sequence[str]) -> List[str]:
+        """Identity files holding an identity of one of the given YubiKeys."""
+        names = []
+        for entry in self.entries():
+            if entry["serial"] in serials and entry["file"] not in names:
+                names.append(entry["file"])
+        return self.identity_files(names) if names else []
+
+    def lookup(self, serial: Optional[str] = None, slot: Optional[int] = None) -> List[dict]:
+        """Entries matching a YubiKey serial and/or slot."""
+        return [
+            entry for entry in self.entries()
+            if (serial is None or entry["serial"] == str(serial))
+            and (slot is None or entry["slot"] == slot)
+        ]
+
+
+def inserted_serials() -> List[str]:
+    """Serial numbers of the YubiKeys currently plugged in, empty if ykman is unavailable."""
+    try:
+        result = subprocess.run(["ykman", "list", "--serials"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    if result.returncode != 0:
+        return []
+    return [line.strip() for line in result.stdout.splitlines() if line.strip().isdigit()]
+
+
+_cache: Optional[KeyCache] = None
+
+
+def key_cache() -> KeyCache:
+    """Process wide KeyCache for the default keys directory."""
+    global _cache
+    if _cache is None:
+        _cache = KeyCache()
+    return _cache
@@ -0,0 +1,227 @@
+#!/bin/env python3
+"""
+yubiCrypt segmented files: one large file cut into fixed-size segments that
+are encrypted and decrypted in parallel under a single hardware-wrapped key.
+
+A segmented file ends in ``.ycs`` and is laid out as:
+
+    magic        b"YCSEG1\\n"
+    key length   8 bytes, big endian
+    key          batch identity (age X25519), wrapped once to the YubiKey recipients
+    segments     one age ciphertext per segment, in the order they were finished
+    index        JSON index encrypted to the batch recipient: plaintext size,
+                 segment size and the (offset, length) of every segment
+    trailer      offset and length of the index (8 bytes each) and b"YCSEGEND"
+
+Segment n holds the plaintext bytes [n * segment_size, (n + 1) * segment_size),
+so any segment can be located from the trailer without reading the rest.
+"""
+
+import json
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, List, Optional
+
+from batch import DEFAULT_WORKERS, SEGMENT_SUFFIX
+from engine import AgeEngine, IdentityFiles, select_engine
+from instrument import span
+
+SEGMENT_VERSION = 1
+DEFAULT_SEGMENT_SIZE = 16 << 20
+
+MAGIC = b"YCSEG1\n"
+KEY_LENGTH = struct.Struct(">Q")
+TRAILER = struct.Struct(">QQ8s")
+TRAILER_MAGIC = b"YCSEGEND"
+
+
+def is_segmented(path: str) -> bool:
+    return path.endswith(SEGMENT_SUFFIX) and os.path.isfile(path)
+
+
+def drop_cache(fd: int, offset: int, length: int) -> None:
+    """Lets the kernel evict a range we are done with, so a 200GB image does not flush the page cache."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+
+def encrypt_segmented(src: str, dst: str, recipients: List[str], segment_size: int = DEFAULT_SEGMENT_SIZE,
+                      workers: int = DEFAULT_WORKERS, engine: Optional[AgeEngine] = None, digest=None) -> None:
+    """
+    Encrypts src into a new segmented file, one age process per segment in
+    parallel. With digest, each segment is read once into memory, fed to
+    digest.update in file order and encrypted from there.
+    """
+    engine = engine or select_engine()
+    if segment_size <= 0:
+        raise ValueError(f"Invalid segment size: {segment_size}")
+    size = os.path.getsize(src)
+    count = max(1, -(-size // segment_size))
+
+    identity, batch_recipient = engine.generate_identity()
+    wrapped = engine.encrypt_bytes(f"{identity}\n".encode(), recipients)
+
+    segments: List[Optional[List[int]]] = [None] * count
+    lock = threading.Lock()
+    # digest takes the segments in file order, next_digest is the one it waits for
+    turn = threading.Condition()
+    next_digest = 0
+    src_fd = os.open(src, os.O_RDONLY)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def read_segment(n: int, offset: int, length: int) -> bytes:
+        """Reads segment n into memory and feeds it to digest once the segments before it are in."""
+        nonlocal next_digest
+        data = None
+        try:
+            data = os.pread(src_fd, length, offset)
+        finally:
+            # executor.map starts the segments in order, so the one waited for is running or done;
+            # a failed segment stops the count and releases the ones after it
+            with turn:
+                turn.wait_for(lambda: next_digest in (n, -1))
+                if data is not None and next_digest == n:
+                    digest.update(data)
+                    next_digest += 1
+                else:
+                    next_digest = -1
+                turn.notify_all()
+        if next_digest == -1:
+            raise RuntimeError(f"Segment {n} of {src} was not encrypted, an earlier one failed")
+        return data
+
+    try:
+        with open(dst, "wb") as out:
+            out.write(MAGIC + KEY_LENGTH.pack(len(wrapped)) + wrapped)
+
+            def encrypt_segment(n: int) -> None:
+                offset = n * segment_size
+                length = min(segment_size, size - offset)
+                if digest is None:
+                    ciphertext = engine.encrypt_region(src_fd, offset, length, [batch_recipient])
+                else:
+                    ciphertext = engine.encrypt_bytes(read_segment(n, offset, length), [batch_recipient])
+                drop_cache(src_fd, offset, length)
+                # Segments land in completion order, the index records where
+                with lock:
+                    segments[n] = [out.tell(), len(ciphertext)]
+                    out.write(ciphertext)
+
+            with span("segment_encrypt", segments=count), ThreadPoolExecutor(max(1, workers)) as executor:
+                list(executor.map(encrypt_segment, range(count)))
+
+            index = {"version": SEGMENT_VERSION, "size": size, "segment_size": segment_size, "segments": segments}
+            encrypted_index = engine.encrypt_bytes(json.dumps(index).encode(), [batch_recipient])
+            index_offset = out.tell()
+            out.write(encrypted_index)
+            out.write(TRAILER.pack(index_offset, len(encrypted_index), TRAILER_MAGIC))
+    except BaseException:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    finally:
+        os.close(src_fd)
+
+
+class SegmentedFile:
+    """Read access to a segmented file; opening it costs the one hardware unwrap."""
+
+    def __init__(self, path: str, identity_file: IdentityFiles, engine: Optional[AgeEngine] = None) -> None:
+        self.path = path
+        self.engine = engine or select_engine()
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self._open(identity_file)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def _open(self, identity_file: IdentityFiles) -> None:
+        head = os.pread(self.fd, len(MAGIC) + KEY_LENGTH.size, 0)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a segmented yubiCrypt file: {self.path}")
+        (key_length,) = KEY_LENGTH.unpack(head[len(MAGIC):])
+        wrapped = os.pread(self.fd, key_length, len(head))
+        with span("hardware_unwrap"):
+            self.identity = self.engine.decrypt_bytes(wrapped, identity_file=identity_file).decode().strip()
+
+        file_size = os.fstat(self.fd).st_size
+        if file_size < len(head) + key_length + TRAILER.size:
+            raise ValueError(f"Truncated segmented file: {self.path}")
+        offset, length, magic = TRAILER.unpack(os.pread(self.fd, TRAILER.size, file_size - TRAILER.size))
+        if magic != TRAILER_MAGIC:
+            raise ValueError(f"Truncated segmented file: {self.path}")
+        index = json.loads(self.engine.decrypt_bytes(os.pread(self.fd, length, offset), identity=self.identity))
+        if index.get("version") != SEGMENT_VERSION:
+            raise ValueError(f"Unsupported segmented file version: {index.get('version')}")
+        self.size: int = index["size"]
+        self.segment_size: int = index["segment_size"]
+        self.segments: List[List[int]] = index["segments"]
+
+    def segment_length(self, n: int) -> int:
+        """Plaintext length of segment n."""
+        return max(0, min(self.segment_size, self.size - n * self.segment_size))
+
+    def read_segment(self, n: int) -> bytes:
+        """Plaintext of segment n, read into a buffer of exactly its size."""
+        offset, length = self.segments[n]
+        data = self.engine.decrypt_region(self.fd, offset, length, self.segment_length(n), identity=self.identity)
+        drop_cache(self.fd, offset, length)
+        if len(data) != self.segment_length(n):
+            raise ValueError(f"Segment {n} of {self.path} has {len(data)} bytes, expected {self.segment_length(n)}")
+        return data
+
+    def read_range(self, start: Optional[int], end: Optional[int], dst: IO, workers: int = 1) -> int:
+        """
+        Writes the plaintext slice [start:end] to dst, decrypting only the segments
+        that cover it. Negative bounds count from the end like a Python slice.
+        Returns the number of bytes written.
+        """
+        start, end, _ = slice(start, end).indices(self.size)
+        if start >= end:
+            return 0
+        first, last = start // self.segment_size, (end - 1) // self.segment_size
+        written = 0
+        with ThreadPoolExecutor(max(1, workers)) as executor:
+            # A window of segments at a time keeps memory at workers * segment_size
+            for window in range(first, last + 1, max(1, workers)):
+                numbers = range(window, min(window + max(1, workers), last + 1))
+                for n, data in zip(numbers, executor.map(self.read_segment, numbers)):
+                    base = n * self.segment_size
+                    chunk = memoryview(data)[max(start - base, 0):min(end - base, len(data))]
+                    dst.write(chunk)
+                    written += len(chunk)
+        return written
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def __enter__(self) -> "SegmentedFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def decrypt_segmented(src: str, dst: str, identity_file: IdentityFiles, workers: int = DEFAULT_WORKERS,
+                      engine: Optional[AgeEngine] = None) -> None:
+    """Restores a segmented file to dst, decrypting the segments in parallel."""
+    with SegmentedFile(src, identity_file, engine) as container:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            os.ftruncate(dst_fd, container.size)
+
+            def decrypt_segment(n: int) -> None:
+                os.pwrite(dst_fd, container.read_segment(n), n * container.segment_size)
+
+            with span("segment_decrypt", segments=len(container.segments)), \
+                    ThreadPoolExecutor(max(1, workers)) as executor:
+                list(executor.map(decrypt_segment, range(len(container.segments))))
+        except BaseException:
+            os.close(dst_fd)
+            os.remove(dst)
+            raise
+        os.close(dst_fd)
@@ -0,0 +1,175 @@
+#!/bin/env python3
+"""
+Removal of plaintexts after encryption (``yubienCrypt --wipe POLICY``).
+
+    unlink      os.remove only, the data stays on disk until it is reused (default)
+    overwrite   one pass of random data, fsynced, then unlink
+    multipass   MULTIPASS_PASSES passes of fresh random data, each fsynced, then unlink
+    punch       fallocate(PUNCH_HOLE): the filesystem frees the blocks and, with
+                discard enabled, TRIMs them on the SSD; falls back to overwrite
+                where the filesystem cannot punch holes
+
+Wipes run on their own small pool behind a shared RateLimiter, so they do not
+take the disk away from the age workers. Overwriting in place only reaches the
+old blocks on filesystems that write in place (ext4, xfs): copy-on-write
+filesystems (btrfs, ZFS) and SSD wear levelling keep old copies around, use
+full-disk encryption or punch there. Files with other hard links are only
+unlinked, overwriting them would destroy the other names' data.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from instrument import span
+
+POLICIES = ("unlink", "overwrite", "multipass", "punch")
+MULTIPASS_PASSES = 3
+DEFAULT_WIPE_WORKERS = 2
+WIPE_BLOCK = 1 << 20
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+_libc = None
+
+
+def punch_hole(fd: int, offset: int, length: int) -> None:
+    """Deallocates a range of fd, raising OSError(EOPNOTSUPP) where that is not possible."""
+    global _libc
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Punching holes needs Linux")
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    if _libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+class RateLimiter:
+    """Spaces out writes so that all callers together stay below rate bytes per second."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + n / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class Shredder:
+    """
+    Removes files with one policy on a pool of workers. submit() returns at
+    once; close() waits for the queue and leaves the files that could not be
+    wiped in failed. stats holds the files, their size, the bytes written over
+    them and the busy seconds of all workers.
+    """
+
+    def __init__(self, policy: str = "unlink", workers: int = DEFAULT_WIPE_WORKERS,
+                 rate: Optional[float] = None, passes: int = MULTIPASS_PASSES) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown wipe policy '{policy}', choose from {', '.join(POLICIES)}")
+        self.policy = policy
+        self.passes = passes if policy == "multipass" else 1
+        self.limiter = RateLimiter(rate)
+        self.failed: Dict[str, Exception] = {}
+        self.stats = {"files": 0, "size": 0, "written": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+        self._futures: List[Future] = []
+        # unlink is as cheap as the bookkeeping, it runs inline
+        self._executor = ThreadPoolExecutor(max(1, workers)) if policy != "unlink" else None
+
+    def submit(self, path: str) -> None:
+        if self._executor is None:
+            self._run(path)
+        else:
+            self._futures.append(self._executor.submit(self._run, path))
+
+    def _run(self, path: str) -> None:
+        start = time.perf_counter()
+        try:
+            size = os.path.getsize(path)
+            with span("wipe", policy=self.policy):
+                written = self.wipe(path)
+        except Exception as e:
+            print(f"Could not wipe {path}: {e}", file=sys.stderr)
+            with self._lock:
+                self.failed[path] = e
+            return
+        with self._lock:
+            self.stats["files"] += 1
+            self.stats["size"] += size
+            self.stats["written"] += written
+            self.stats["seconds"] += time.perf_counter() - start
+
+    def wipe(self, path: str) -> int:
+        """Removes path according to the policy, returns the bytes written over it."""
+        if self.policy == "unlink":
+            os.remove(path)
+            return 0
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            st = os.fstat(fd)
+            if st.st_nlink > 1:
+                print(f"{path} has other hard links, only unlinking it", file=sys.stderr)
+                written = 0
+            elif self.policy == "punch":
+                written = self._punch(fd, st.st_size)
+            else:
+                written = self._overwrite(fd, st.st_size, self.passes)
+        finally:
+            os.close(fd)
+        os.remove(path)
+        return written
+
+    def _punch(self, fd: int, size: int) -> int:
+        try:
+            punch_hole(fd, 0, size)
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                raise
+            return self._overwrite(fd, size, 1)
+        os.fsync(fd)
+        return 0
+
+    def _overwrite(self, fd: int, size: int, passes: int) -> int:
+        for _ in range(passes):
+            block = memoryview(os.urandom(min(WIPE_BLOCK, max(size, 1))))
+            offset = 0
+            while offset < size:
+                n = min(len(block), size - offset)
+                self.limiter.acquire(n)
+                offset += os.pwrite(fd, block[:n], offset)
+            # Without it the page cache merges the passes and only the last reaches the disk
+            os.fsync(fd)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return size * passes
+
+    def close(self) -> None:
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def __enter__(self) -> "Shredder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,361 @@
+#!/bin/env python3
+"""
+yubiCryptVerify: checks .age and .ycs files without the YubiKey.
+
+``yubienCrypt --verify`` records every ciphertext it writes in
+~/.yubiCrypt/verify.index.json, keyed by absolute path:
+
+    size, mtime_ns     stat data of the ciphertext when it was written
+    sha256             ciphertext hash
+    plaintext_sha256   hash of the plaintext it was made from, and plaintext_size
+
+yubiCryptVerify hashes the ciphertexts on a pool of workers (readinto and
+hashlib release the GIL on large buffers, so the hashing spreads over the
+cores) and compares them with the record, or with the incremental index for
+files written by ``--incremental``. Every file also gets a structural check of
+its age header or .ycs trailer. ``--sample`` decrypts some of the files with
+the YubiKey into a hash instead of the disk and compares the plaintext hash.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from batch import DEFAULT_WORKERS, collect_files
+from compress import decompress_chunks
+from engine import ENGINE_ENV, ENGINE_NAMES, AgeEngine, IdentityFiles, select_engine
+from incremental import INDEX_PATH as INCREMENTAL_INDEX_PATH
+from instrument import PROFILE_ENV, enable as enable_profiling, span
+from segments import KEY_LENGTH, MAGIC as SEGMENT_MAGIC, SEGMENT_SUFFIX, TRAILER, TRAILER_MAGIC, SegmentedFile
+
+INDEX_PATH = os.path.expanduser("~/.yubiCrypt/verify.index.json")
+INDEX_VERSION = 1
+HASH_BLOCK = 4 << 20
+
+AGE_HEADER = b"age-encryption.org/v1\n"
+AGE_ARMOR = b"-----BEGIN AGE ENCRYPTED FILE-----"
+AGE_MAC = re.compile(rb"^--- [A-Za-z0-9+/]{43}\n$")
+AGE_HEADER_LIMIT = 1 << 20
+STREAM_NONCE = 16
+STREAM_CHUNK = 64 * 1024 + 16
+
+# Statuses that make yubiCryptVerify fail
+FAILURES = ("CORRUPT", "MALFORMED", "MISSING", "DECRYPT FAILED", "PLAINTEXT MISMATCH")
+
+
+def file_sha256(path: str, block_size: int = HASH_BLOCK) -> str:
+    """SHA-256 of a file, read into one reused buffer."""
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sha256_hash.update(view[:n])
+    return sha256_hash.hexdigest()
+
+
+class PlaintextDigest:
+    """SHA-256 and size of the plaintext as it is fed to the encryptor."""
+
+    def __init__(self) -> None:
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        self.sha256.update(data)
+        self.size += len(data)
+
+
+class VerifyIndex:
+    """Recorded hashes of every ciphertext written with --verify, keyed by absolute path."""
+
+    def __init__(self, index_path: str = INDEX_PATH) -> None:
+        self.index_path = index_path
+        self.files: Dict[str, dict] = self._read_index()
+        self._lock = threading.Lock()
+
+    def _read_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                return index["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.index_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".verify.index.")
+        try:
+            with os.fdopen(fd, "w") as f, self._lock:
+                json.dump({"version": INDEX_VERSION, "files": self.files}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.index_path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def record(self, ciphertext: str, plaintext: PlaintextDigest) -> None:
+        """Hashes a freshly written ciphertext, plaintext being the digest taken while it was encrypted."""
+        with span("verify_record"):
+            st = os.stat(ciphertext)
+            entry = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha256": file_sha256(ciphertext),
+                "plaintext_size": plaintext.size,
+                "plaintext_sha256": plaintext.sha256.hexdigest(),
+            }
+        with self._lock:
+            self.files[os.path.abspath(ciphertext)] = entry
+
+    def lookup(self, ciphertext: str) -> Optional[dict]:
+        with self._lock:
+            return self.files.get(os.path.abspath(ciphertext))
+
+
+def incremental_records(index_path: str = INCREMENTAL_INDEX_PATH) -> Dict[str, dict]:
+    """Ciphertext path -> entry of the incremental index, which hashes both sides as well."""
+    try:
+        with open(index_path, "r") as f:
+            files = json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {
+        entry["ciphertext"]: {"sha256": entry.get("ciphertext_sha256"), "plaintext_sha256": entry.get("sha256"),
+                              "plaintext_size": entry.get("size")}
+        for entry in files.values() if entry.get("ciphertext")
+    }
+
+
+def stream_payload_valid(length: int) -> bool:
+    """Whether an age STREAM payload (nonce, then chunks of up to 64 KiB plus a 16 byte tag) can have this length."""
+    if length < STREAM_NONCE + 16:
+        return False
+    full, last = divmod(length - STREAM_NONCE, STREAM_CHUNK)
+    return last > 16 or (last == 16 and full == 0) or (last == 0 and full > 0)
+
+
+def check_age_structure(path: str) -> Optional[str]:
+    """Returns what is wrong with the age header and payload length of path, None if nothing."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        first = f.readline(AGE_HEADER_LIMIT)
+        if first.startswith(AGE_ARMOR):
+            return None
+        if first != AGE_HEADER:
+            return "no age header"
+        header_length = len(first)
+        while True:
+            line = f.readline(AGE_HEADER_LIMIT)
+            header_length += len(line)
+            if not line.endswith(b"\n") or header_length > AGE_HEADER_LIMIT:
+                return "truncated age header"
+            if line.startswith(b"---"):
+                break
+    payload = size - header_length
+    # Real age headers end in a base64 MAC, then the STREAM payload has a fixed shape
+    if AGE_MAC.match(line) and not stream_payload_valid(payload):
+        return f"truncated payload ({payload} bytes)"
+    return None
+
+
+def check_segmented_structure(path: str) -> Optional[str]:
+    """Returns what is wrong with the layout of a .ycs file, None if nothing."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(len(SEGMENT_MAGIC) + KEY_LENGTH.size)
+        if head[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC or len(head) < len(SEGMENT_MAGIC) + KEY_LENGTH.size:
+            return "no segmented file header"
+        (key_length,) = KEY_LENGTH.unpack(head[len(SEGMENT_MAGIC):])
+        body_start = len(head) + key_length
+        if size < body_start + TRAILER.size:
+            return "truncated"
+        f.seek(size - TRAILER.size)
+        offset, length, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != TRAILER_MAGIC:
+        return "no trailer"
+    if offset < body_start or offset + length != size - TRAILER.size:
+        return "trailer points outside the file"
+    return None
+
+
+def check_file(path: str, record: Optional[dict]) -> Tuple[str, str]:
+    """
+    Checks one ciphertext without decrypting it, returns (status, detail):
+    OK, CORRUPT, MALFORMED, MISSING or UNRECORDED (structure only). The hash
+    decides even when the stat data changed: a file that was touched is OK, a
+    file that was rewritten is CORRUPT.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "MISSING", ""
+    checker = check_segmented_structure if path.endswith(SEGMENT_SUFFIX) else check_age_structure
+    problem = checker(path)
+    if problem:
+        return "MALFORMED", problem
+    if record is None or not record.get("sha256"):
+        return "UNRECORDED", "structure ok"
+    with span("verify_hash"):
+        digest = file_sha256(path)
+    if digest != record["sha256"]:
+        rewritten = "mtime_ns" in record and (record["size"], record["mtime_ns"]) != (st.st_size, st.st_mtime_ns)
+        return "CORRUPT", (f"{'rewritten since it was recorded, ' if rewritten else ''}"
+                           f"sha256 {digest[:16]}... expected {record['sha256'][:16]}...")
+    return "OK", ""
+
+
+class HashWriter:
+    """File-like sink that only hashes what is written to it."""
+
+    def __init__(self) -> None:
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def decrypt_hash(path: str, identity_file: IdentityFiles, engine: AgeEngine, workers: int = 1) -> Tuple[str, int]:
+    """Decrypts path into a hash, nothing reaches the disk. Returns (sha256, size) of the plaintext."""
+    sink = HashWriter()
+    if path.endswith(SEGMENT_SUFFIX):
+        with SegmentedFile(path, identity_file, engine) as container:
+            container.read_range(None, None, sink, workers)
+    else:
+        chunks = engine.decrypt_chunks(path, identity_file)
+        try:
+            for chunk in decompress_chunks(chunks):
+                sink.write(chunk)
+        finally:
+            chunks.close()
+    return sink.hash.hexdigest(), sink.size
+
+
+def verify_files(files: List[str], workers: int = DEFAULT_WORKERS, index: Optional[VerifyIndex] = None,
+                 fallback: Optional[Dict[str, dict]] = None) -> Dict[str, Tuple[str, str]]:
+    """Checks many ciphertexts in parallel against their records."""
+    index = index or VerifyIndex()
+    fallback = fallback if fallback is not None else incremental_records()
+
+    def check(path: str) -> Tuple[str, str]:
+        record = index.lookup(path) or fallback.get(os.path.abspath(path))
+        try:
+            return check_file(path, record)
+        except OSError as e:
+            return "MALFORMED", str(e)
+
+    with span("verify", files=len(files)), ThreadPoolExecutor(max(1, workers)) as executor:
+        return dict(zip(files, executor.map(check, files)))
+
+
+def sample_files(files: List[str], sample: float, rng: random.Random) -> List[str]:
+    """sample below 1 is a fraction of the files, from 1 up a number of files."""
+    count = round(len(files) * sample) if sample < 1 else int(sample)
+    if sample > 0:
+        count = max(1, count)
+    return sorted(rng.sample(files, min(count, len(files))))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="yubiCryptVerify",
+                                     description="Check encrypted files without decrypting them.")
+    parser.add_argument("paths", nargs="+", help=".age/.ycs files, directories or glob patterns")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into directories")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="files hashed at once (default: one per core)")
+    parser.add_argument("--sample", type=float, default=0, metavar="N",
+                        help="also decrypt N files (or this fraction of them if below 1) with the YubiKey "
+                             "and compare their plaintext hash")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for --sample")
+    parser.add_argument("-i", "--identity", action="append", metavar="NAME",
+                        help="identity file for --sample, repeatable (default: the inserted YubiKey)")
+    parser.add_argument("--index", default=INDEX_PATH, help=f"verify index (default: {INDEX_PATH})")
+    parser.add_argument("-e", "--engine", choices=ENGINE_NAMES, default=None,
+                        help=f"age backend for --sample (default: ${ENGINE_ENV} or auto)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help=f"record timing spans to FILE (.prom or JSON lines) or stderr (default: ${PROFILE_ENV})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    enable_profiling(args.profile)
+
+    files, missing = collect_files(args.paths, args.recursive, suffix=(".age", SEGMENT_SUFFIX))
+    if not files and not missing:
+        print("No .age/.ycs files to verify.")
+        return 1
+
+    index = VerifyIndex(args.index)
+    results = verify_files(files, args.workers, index)
+    results.update((path, ("MISSING", "no such file")) for path in missing)
+
+    if args.sample:
+        from decrypt import identity_paths
+        candidates = [path for path, (status, _) in results.items() if status not in FAILURES]
+        sampled = sample_files(candidates, args.sample, random.Random(args.seed))
+        if sampled:
+            fallback = incremental_records()
+            try:
+                identity = identity_paths(args.identity)
+                engine = select_engine(args.engine)
+            except Exception as e:
+                print(f"Cannot decrypt for --sample: {e}")
+                return 1
+            print('Press the button on your yubikey: ')
+            for n, path in enumerate(sampled, 1):
+                print(f"[{n}/{len(sampled)}] decrypting {path}")
+                record = index.lookup(path) or fallback.get(os.path.abspath(path)) or {}
+                try:
+                    with span("verify_decrypt"):
+                        digest, size = decrypt_hash(path, identity, engine, max(1, args.workers))
+                except Exception as e:
+                    results[path] = ("DECRYPT FAILED", str(e))
+                    continue
+                expected = record.get("plaintext_sha256")
+                if expected and digest != expected:
+                    results[path] = ("PLAINTEXT MISMATCH", f"{size} bytes, sha256 {digest[:16]}...")
+                else:
+                    detail = "plaintext hash matches" if expected else "decrypts, no plaintext hash recorded"
+                    results[path] = ("OK" if expected else results[path][0], detail)
+
+    if args.json:
+        print(json.dumps({path: {"status": status, "detail": detail} for path, (status, detail) in results.items()},
+                         indent=2))
+    else:
+        for path, (status, detail) in results.items():
+            print(f"{status:<18} {path}{f'  ({detail})' if detail else ''}")
+        counts: Dict[str, int] = {}
+        for status, _ in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        print("-" * 40)
+        print(", ".join(f"{count} {status.lower()}" for status, count in sorted(counts.items())))
+    return 1 if any(status in FAILURES for status, _ in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
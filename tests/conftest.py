@@ -0,0 +1,61 @@
+"""
+The tests run against the YubiKey simulator: simulator/bin goes first on PATH
+and HOME is a throwaway directory holding the simulated key, imported once
+with yubiCryptImporter the way a user would.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+HOME = Path(tempfile.mkdtemp(prefix="yubicrypt-tests-"))
+
+# The modules resolve ~/.yubiCrypt when they are imported, so this comes before any of them is
+os.environ["HOME"] = str(HOME)
+os.environ["PATH"] = f"{ROOT / 'simulator' / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}"
+os.environ["YUBICRYPT_DAEMON"] = "0"
+for name in [name for name in os.environ if name.startswith(("YUBICRYPT_SIM_", "YUBICRYPT_ENGINE"))]:
+    del os.environ[name]
+sys.path[:0] = [str(ROOT / "src"), str(ROOT / "setup_files"), str(ROOT)]
+
+KEYS_DIR = HOME / ".yubiCrypt" / "keys"
+KEYS_SNAPSHOT = HOME / "keys.snapshot"
+
+
+def pytest_sessionstart(session) -> None:
+    KEYS_DIR.mkdir(parents=True, mode=0o700)
+    # Like `cp -rL`: the importer's modules are symlinks into src
+    importer = HOME / "yubiCryptImporter"
+    shutil.copytree(ROOT / "yubiCryptImporter", importer, ignore=shutil.ignore_patterns("__pycache__"))
+    subprocess.run([sys.executable, "import.py"], cwd=importer, check=True, stdout=subprocess.DEVNULL)
+    shutil.copytree(KEYS_DIR, KEYS_SNAPSHOT)
+
+
+def pytest_sessionfinish(session, exitstatus) -> None:
+    shutil.rmtree(HOME, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def keys():
+    """Restores the imported identity files, a failed decryption wipes them."""
+    shutil.rmtree(KEYS_DIR)
+    shutil.copytree(KEYS_SNAPSHOT, KEYS_DIR)
+    return KEYS_DIR
+
+
+@pytest.fixture
+def recipients():
+    from encrypt import read_recipients
+    return read_recipients()
+
+
+@pytest.fixture
+def identity():
+    from decrypt import identity_paths
+    return identity_paths()
@@ -0,0 +1,124 @@
+import os
+import re
+
+import pytest
+
+import decrypt
+from bundle import create_bundle
+from encrypt import encrypt_files
+
+
+@pytest.fixture
+def encrypted(tmp_path, recipients):
+    """Five encrypted files, returns (.age paths, plaintext per path)."""
+    contents = {}
+    for n in range(5):
+        path = tmp_path / f"file{n}.txt"
+        path.write_bytes(os.urandom(1000 + n))
+        contents[str(path)] = path.read_bytes()
+    assert all(encrypt_files(sorted(contents), recipients, 1).values())
+    return [f"{path}.age" for path in sorted(contents)], contents
+
+
+@pytest.fixture
+def wipes(monkeypatch):
+    """Counts the calls of wipe_keys, which still wipes."""
+    calls = []
+    real = decrypt.wipe_keys
+
+    def wipe_keys():
+        calls.append(1)
+        real()
+
+    monkeypatch.setattr(decrypt, "wipe_keys", wipe_keys)
+    return calls
+
+
+def test_batch_reports_progress_and_restores_every_file(encrypted, identity, wipes, keys, capsys):
+    files, contents = encrypted
+    results = decrypt.decrypt_files(files, identity, sync_batch=2)
+
+    assert results == dict.fromkeys(files, True)
+    progress = re.findall(r"^\[(\d+)/(\d+)\] (.+)$", capsys.readouterr().out, re.MULTILINE)
+    assert progress == [(str(n), "5", path) for n, path in enumerate(files, 1)]
+    for path, data in contents.items():
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert not os.path.exists(f"{path}.age")
+    assert wipes == []
+    assert os.listdir(keys)
+
+
+def test_failure_mid_batch_wipes_the_keys_once_after_the_batch(encrypted, identity, wipes, keys):
+    files, contents = encrypted
+    for broken in (files[1], files[3]):
+        with open(broken, "wb") as f:
+            f.write(b"age-encryption.org/v1\ntruncated")
+
+    results = decrypt.decrypt_files(files, identity)
+
+    assert results == {path: path not in (files[1], files[3]) for path in files}
+    # The files after the failures were still decrypted with the same keys
+    for path in files:
+        plaintext = path[:-len(".age")]
+        assert os.path.exists(plaintext) == results[path]
+        assert os.path.exists(path) != results[path]
+        if results[path]:
+            with open(plaintext, "rb") as f:
+                assert f.read() == contents[plaintext]
+    assert wipes == [1]
+    assert os.listdir(keys) == []
+
+
+def test_failed_rename_keeps_the_keys(encrypted, identity, wipes, keys, monkeypatch):
+    files, contents = encrypted
+    blocked = files[2][:-len(".age")]
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if dst == blocked:
+            raise PermissionError(13, "Permission denied", dst)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    results = decrypt.decrypt_files(files, identity)
+
+    assert results == {path: path != files[2] for path in files}
+    assert not os.path.exists(blocked)
+    assert os.path.exists(files[2])
+    assert wipes == []
+    assert os.listdir(keys)
+
+
+def test_bundles_wipe_the_keys_only_when_age_rejects_the_key(tmp_path, recipients, identity, wipes, keys):
+    bundles = []
+    for name in ("broken_blob", "broken_key"):
+        (tmp_path / name).mkdir()
+        path = tmp_path / name / "file.txt"
+        path.write_bytes(os.urandom(100))
+        bundles.append(str(tmp_path / name / f"{name}.ycb"))
+        assert all(create_bundle([str(path)], bundles[-1], recipients).values())
+    with open(os.path.join(bundles[0], "blobs", "000000.age"), "wb") as f:
+        f.write(b"not an age file")
+
+    assert not any(decrypt.decrypt_bundles(bundles[:1], identity, 1).values())
+    assert wipes == []
+
+    with open(os.path.join(bundles[1], "key.age"), "wb") as f:
+        f.write(b"age-encryption.org/v1\ntruncated")
+    assert decrypt.decrypt_bundles(bundles[1:], identity, 1) == {bundles[1]: False}
+    assert wipes == [1]
+    assert os.listdir(keys) == []
+
+
+def test_main_exits_non_zero_for_failed_and_missing_files(encrypted, tmp_path, capsys):
+    files, _ = encrypted
+    with open(files[2], "wb") as f:
+        f.write(b"garbage")
+    missing = str(tmp_path / "typo.txt.age")
+
+    assert decrypt.main(files + [missing]) == 1
+    out = capsys.readouterr().out
+    assert f"FAILED {files[2]}" in out
+    assert f"FAILED {missing}" in out
+    assert "4/6 files decrypted, 2 failed" in out
@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+
+import bundle as bundle_module
+from bundle import create_bundle, entry_paths, extract_bundle, wrap_key
+from engine import select_engine
+
+
+def write_tree(root, count: int) -> dict:
+    """count files spread over nested directories, returns path -> content."""
+    contents = {}
+    for n in range(count):
+        path = root / f"dir{n % 5}" / f"sub{n % 3}" / f"file{n:03d}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = os.urandom(n * 37 % 4096)
+        path.write_bytes(data)
+        contents[str(path)] = data
+    return contents
+
+
+def test_round_trip_many_entries(tmp_path, recipients, identity):
+    contents = write_tree(tmp_path, 120)
+    bundle = str(tmp_path / "many.ycb")
+
+    created = create_bundle(sorted(contents), bundle, recipients, workers=4)
+    assert all(created.values()) and len(created) == 120
+    assert not any(os.path.exists(path) for path in contents)
+    assert len(os.listdir(os.path.join(bundle, "blobs"))) == 120
+
+    extracted = extract_bundle(bundle, identity, workers=4)
+    assert len(extracted) == 120 and all(extracted.values())
+    for path, data in contents.items():
+        with open(path, "rb") as f:
+            assert f.read() == data
+    assert not os.path.exists(bundle)
+
+
+def test_create_skips_unreadable_entries(tmp_path, recipients, identity):
+    contents = write_tree(tmp_path, 6)
+    gone = str(tmp_path / "gone.txt")
+    bundle = str(tmp_path / "partial.ycb")
+
+    created = create_bundle(sorted(contents) + [gone], bundle, recipients, workers=2)
+    assert created[gone] is False
+    assert all(ok for path, ok in created.items() if path != gone)
+
+    extracted = extract_bundle(bundle, identity)
+    assert sorted(extracted) == sorted(os.path.realpath(path) for path in contents)
+    assert all(extracted.values())
+
+
+def test_extract_keeps_bundle_when_an_entry_fails(tmp_path, recipients, identity):
+    contents = write_tree(tmp_path, 8)
+    bundle = str(tmp_path / "broken.ycb")
+    create_bundle(sorted(contents), bundle, recipients, workers=2)
+    with open(os.path.join(bundle, "blobs", "000003.age"), "wb") as f:
+        f.write(b"not an age file")
+
+    extracted = extract_bundle(bundle, identity, workers=2)
+    broken = os.path.realpath(sorted(contents)[3])
+    assert extracted[broken] is False
+    assert not os.path.exists(broken)
+    assert all(ok for path, ok in extracted.items() if path != broken)
+    for path, data in contents.items():
+        if os.path.realpath(path) != broken:
+            with open(path, "rb") as f:
+                assert f.read() == data
+    # The failed entry can only be retried while the bundle is there
+    assert os.path.isdir(bundle)
+
+
+def test_failed_create_leaves_nothing_behind(tmp_path, recipients, monkeypatch):
+    contents = write_tree(tmp_path, 6)
+    bundle = tmp_path / "failed.ycb"
+
+    def fail(directory):
+        raise OSError(5, "Input/output error", directory)
+
+    monkeypatch.setattr(bundle_module, "fsync_directory", fail)
+    with pytest.raises(OSError):
+        create_bundle(sorted(contents), str(bundle), recipients, workers=2)
+    assert not bundle.exists()
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]
+    assert all(os.path.exists(path) for path in contents)
+
+
+def test_create_rejects_files_outside_the_bundle_directory(tmp_path, recipients):
+    outside = tmp_path / "outside.txt"
+    outside.write_text("outside")
+    (tmp_path / "inner").mkdir()
+    with pytest.raises(ValueError):
+        entry_paths([str(outside)], str(tmp_path / "inner" / "x.ycb"))
+    with pytest.raises(ValueError):
+        create_bundle([str(outside)], str(tmp_path / "inner" / "x.ycb"), recipients)
+    assert outside.exists()
+
+
+@pytest.mark.parametrize("entry", ["../escaped.txt", "a/../../escaped.txt", "{tmp}/escaped.txt"])
+def test_extract_rejects_entries_escaping_the_bundle_directory(tmp_path, recipients, identity, entry):
+    entry = entry.format(tmp=tmp_path)
+    engine = select_engine()
+    base = tmp_path / "base"
+    bundle = base / "evil.ycb"
+    (bundle / "blobs").mkdir(parents=True)
+    batch_identity, batch_recipient = engine.generate_identity()
+    wrap_key(batch_identity, recipients, str(bundle / "key.age"), engine)
+    blob = bundle / "blobs" / "000000.age"
+    payload = tmp_path / "payload"
+    payload.write_text("escaped")
+    engine.encrypt_file(str(payload), str(blob), [batch_recipient])
+    index = {"version": 1, "entries": [{"path": entry, "blob": blob.name, "size": 7}]}
+    (bundle / "index.age").write_bytes(engine.encrypt_bytes(json.dumps(index).encode(), [batch_recipient]))
+
+    with pytest.raises(ValueError, match="escapes"):
+        extract_bundle(str(bundle), identity)
+    assert not (tmp_path / "escaped.txt").exists()
+    assert bundle.is_dir()
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import decrypt
+from chunkstore import ChunkStore
+from encrypt import store_files
+
+
+def test_store_deduplicates_and_restores(tmp_path, recipients, identity, capsys):
+    data = os.urandom(3 << 20)
+    first, second = tmp_path / "first.img", tmp_path / "second.img"
+    first.write_bytes(data)
+    second.write_bytes(data)
+    store = str(tmp_path / "backup.ycc")
+
+    assert store_files([str(first)], store, recipients, 2) == {str(first): True}
+    chunks = len(os.listdir(os.path.join(store, "chunks")))
+    assert store_files([str(second)], store, recipients, 2) == {str(second): True}
+    assert len(os.listdir(os.path.join(store, "chunks"))) == chunks
+    assert "(0/" in capsys.readouterr().out
+    assert not first.exists() and not second.exists()
+
+    results = decrypt.decrypt_stores([store], identity, 2)
+    assert results == {f"{store}:{first}": True, f"{store}:{second}": True}
+    assert first.read_bytes() == data and second.read_bytes() == data
+    assert not os.path.exists(store)
+
+
+def test_existing_store_is_not_recreated(tmp_path, recipients):
+    store = ChunkStore.create(str(tmp_path / "backup"), recipients)
+    assert store.path.endswith(".ycc")
+    with pytest.raises(FileExistsError):
+        ChunkStore.create(store.path, recipients)
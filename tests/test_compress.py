@@ -0,0 +1,72 @@
+import io
+import os
+
+import pytest
+
+import compress
+import decrypt
+import encrypt
+from compress import MAGIC
+from engine import select_engine
+
+# Plaintext that looks like a framed zlib file to anything trusting the first bytes
+LOOKALIKE = MAGIC + bytes([compress.CODEC_IDS["zlib"]]) + os.urandom(4000)
+
+
+def test_compressed_file_round_trips(tmp_path, recipients, identity):
+    path = tmp_path / "log.txt"
+    data = b"the same line over and over\n" * 20000
+    path.write_bytes(data)
+
+    assert encrypt.encrypt_files([str(path)], recipients, 1, compress="zlib") == {str(path): True}
+    assert os.path.getsize(f"{path}.age") < len(data) // 10
+    assert decrypt.decrypt_files([f"{path}.age"], identity) == {f"{path}.age": True}
+    assert path.read_bytes() == data
+
+
+@pytest.mark.parametrize("setting", [None, "none", "auto"])
+def test_file_starting_with_magic_round_trips(tmp_path, recipients, identity, setting):
+    path = tmp_path / "lookalike.bin"
+    path.write_bytes(LOOKALIKE)
+    assert encrypt.encrypt_files([str(path)], recipients, 1, compress=setting) == {str(path): True}
+
+    out = io.BytesIO()
+    assert decrypt.decrypt_range(f"{path}.age", 2, 30, identity, select_engine(), dst=out)
+    assert out.getvalue() == LOOKALIKE[2:30]
+
+    assert decrypt.decrypt_files([f"{path}.age"], identity) == {f"{path}.age": True}
+    assert path.read_bytes() == LOOKALIKE
+
+
+@pytest.mark.parametrize("setting", [None, "zlib"])
+def test_stream_starting_with_magic_round_trips(tmp_path, recipients, identity, setting):
+    engine = select_engine()
+    ciphertext = tmp_path / "stream.age"
+    with open(ciphertext, "wb") as dst:
+        assert encrypt.encrypt_stream(recipients, engine, src=io.BytesIO(LOOKALIKE), dst=dst, compress=setting)
+
+    out = io.BytesIO()
+    with open(ciphertext, "rb") as src:
+        assert decrypt.decrypt_stream(identity, engine, src=src, dst=out)
+    assert out.getvalue() == LOOKALIKE
+
+    out = io.BytesIO()
+    assert decrypt.decrypt_range(str(ciphertext), None, 12, identity, engine, dst=out)
+    assert out.getvalue() == LOOKALIKE[:12]
+
+
+def test_missing_codec_fails_the_file_and_keeps_the_keys(tmp_path, recipients, identity, keys, monkeypatch):
+    paths = [tmp_path / "a.txt", tmp_path / "b.txt"]
+    for path in paths:
+        path.write_bytes(b"compressible " * 1000)
+    encrypt.encrypt_files([str(paths[0])], recipients, 1, compress="zlib")
+    encrypt.encrypt_files([str(paths[1])], recipients, 1)
+    monkeypatch.delitem(compress.DECOMPRESSORS, "zlib")
+    files = [f"{path}.age" for path in paths]
+
+    assert decrypt.decrypt_files(files, identity) == {files[0]: False, files[1]: True}
+    assert not decrypt.decrypt_file(files[0], identity)
+    assert os.path.exists(files[0]) and not paths[0].exists()
+    assert paths[1].read_bytes() == b"compressible " * 1000
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]
+    assert os.listdir(keys)
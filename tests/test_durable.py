@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from durable import GroupCommit, atomic_output
+
+
+def test_atomic_output_keeps_the_old_file_on_failure(tmp_path):
+    dst = tmp_path / "out.txt"
+    dst.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_output(str(dst)) as tmp:
+            with open(tmp, "w") as f:
+                f.write("half")
+            raise RuntimeError("interrupted")
+    assert dst.read_text() == "old"
+    assert os.listdir(tmp_path) == ["out.txt"]
+
+    with atomic_output(str(dst)) as tmp:
+        with open(tmp, "w") as f:
+            f.write("new")
+    assert dst.read_text() == "new"
+    assert os.listdir(tmp_path) == ["out.txt"]
+
+
+def test_group_commit_removes_sources_per_batch(tmp_path):
+    sources = []
+    for n in range(5):
+        source = tmp_path / f"src{n}"
+        source.write_text("x")
+        sources.append(source)
+    removed = []
+    # Sources only go once a whole batch of outputs is durable, src3 cannot be removed
+    expected = [0, 2, 2, 3, 3]
+
+    def remover(path):
+        if path.endswith("src3"):
+            raise PermissionError(13, "Permission denied", path)
+        removed.append(path)
+        os.remove(path)
+
+    with GroupCommit(2, remover) as commit:
+        for n, source in enumerate(sources):
+            commit.add(str(tmp_path / f"out{n}"), remove=str(source))
+            assert len(removed) == expected[n]
+    assert removed == [str(sources[n]) for n in (0, 1, 2, 4)]
+    assert list(commit.failed) == [str(sources[3])]
+    assert sources[3].exists()
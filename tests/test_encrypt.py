@@ -0,0 +1,18 @@
+import os
+
+from encrypt import encrypt_files
+
+
+def test_existing_ciphertext_is_never_replaced(tmp_path, recipients):
+    kept = tmp_path / "kept.txt"
+    fresh = tmp_path / "fresh.txt"
+    kept.write_text("new plaintext")
+    fresh.write_text("fresh")
+    (tmp_path / "kept.txt.age").write_bytes(b"older ciphertext")
+
+    results = encrypt_files([str(kept), str(fresh)], recipients, 2)
+
+    assert results == {str(kept): False, str(fresh): True}
+    assert (tmp_path / "kept.txt.age").read_bytes() == b"older ciphertext"
+    assert kept.read_text() == "new plaintext"
+    assert not fresh.exists() and os.path.exists(f"{fresh}.age")
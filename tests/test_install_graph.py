@@ -0,0 +1,148 @@
+import json
+import subprocess
+import time
+
+import pytest
+
+from install_graph import BLOCKED, DONE, FAILED, SATISFIED, Installer, Step
+from simulator.config import install_packages, installed_packages, load_config
+
+PACKAGE_MANAGER_LOCK = "package-manager"
+CARGO_LOCK = "cargo"
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    """Fake package managers recording into tmp_path, returns the log of their calls."""
+    monkeypatch.setenv("YUBICRYPT_SIM_PACKAGES", str(tmp_path / "packages"))
+    monkeypatch.setenv("YUBICRYPT_SIM_LOG", str(tmp_path / "sim.log"))
+    log = tmp_path / "sim.log"
+
+    def calls():
+        if not log.exists():
+            return []
+        return [line.split(" ", 1)[1] for line in log.read_text().splitlines()]
+
+    return calls
+
+
+def installed(name: str) -> bool:
+    return name in installed_packages(load_config())
+
+
+def apt(package: str, **kwargs) -> Step:
+    return Step(package, ["apt-get", "install", "-y", package], check=lambda: installed(package),
+                lock=PACKAGE_MANAGER_LOCK, **kwargs)
+
+
+def crate(name: str, **kwargs) -> Step:
+    return Step(name, ["cargo", "install", name], check=lambda: installed(f"cargo:{name}"), lock=CARGO_LOCK, **kwargs)
+
+
+def statuses(state_path) -> dict:
+    with open(state_path) as f:
+        return {name: entry["status"] for name, entry in json.load(f)["steps"].items()}
+
+
+def test_satisfied_steps_are_skipped(tmp_path, sim):
+    install_packages(load_config(), ["libpcsclite-dev"])
+    state = tmp_path / "state.json"
+    steps = [apt("libpcsclite-dev"), crate("age-plugin-yubikey", requires=["libpcsclite-dev"])]
+
+    assert Installer(steps, str(state)).run()
+    assert statuses(state) == {"libpcsclite-dev": SATISFIED, "age-plugin-yubikey": DONE}
+    assert sim() == ["cargo install age-plugin-yubikey"]
+    assert installed("cargo:age-plugin-yubikey")
+
+
+def test_failed_step_blocks_its_dependents_only(tmp_path, sim, monkeypatch):
+    monkeypatch.setenv("YUBICRYPT_SIM_FAIL", "cargo:1")
+    state = tmp_path / "state.json"
+    ran = []
+    steps = [
+        apt("libpcsclite-dev"),
+        crate("age-plugin-yubikey", requires=["libpcsclite-dev"]),
+        Step("aliases", lambda: ran.append("aliases"), requires=["age-plugin-yubikey"]),
+        apt("pcscd"),
+    ]
+
+    assert not Installer(steps, str(state)).run()
+    assert statuses(state) == {"libpcsclite-dev": DONE, "age-plugin-yubikey": FAILED, "aliases": BLOCKED,
+                               "pcscd": DONE}
+    assert ran == []
+    with open(state) as f:
+        saved = json.load(f)
+    assert not saved["complete"]
+    assert "cargo install age-plugin-yubikey exited with 1" in saved["steps"]["age-plugin-yubikey"]["error"]
+
+
+def test_resume_skips_the_steps_that_succeeded(tmp_path, sim, monkeypatch, capsys):
+    state = tmp_path / "state.json"
+    ran = []
+    steps = [
+        apt("libpcsclite-dev"),
+        crate("age-plugin-yubikey", requires=["libpcsclite-dev"]),
+        Step("aliases", lambda: ran.append("aliases"), requires=["age-plugin-yubikey"]),
+    ]
+    monkeypatch.setenv("YUBICRYPT_SIM_FAIL", "cargo:1")
+    assert not Installer(steps, str(state)).run()
+
+    monkeypatch.delenv("YUBICRYPT_SIM_FAIL")
+    capsys.readouterr()
+    assert Installer(steps, str(state)).run()
+    assert "Resuming the run" in capsys.readouterr().out
+    assert statuses(state) == {"libpcsclite-dev": DONE, "age-plugin-yubikey": DONE, "aliases": DONE}
+    assert ran == ["aliases"]
+    assert sim().count("apt-get install -y libpcsclite-dev") == 1
+    assert sim().count("cargo install age-plugin-yubikey") == 2
+
+    # After a complete run the next one starts over and relies on the checks
+    assert Installer(steps, str(state)).run()
+    assert statuses(state)["libpcsclite-dev"] == SATISFIED
+    assert ran == ["aliases", "aliases"]
+
+
+def test_restart_ignores_the_state_file(tmp_path, sim, monkeypatch):
+    state = tmp_path / "state.json"
+    steps = [apt("libpcsclite-dev"), crate("age-plugin-yubikey", requires=["libpcsclite-dev"])]
+    monkeypatch.setenv("YUBICRYPT_SIM_FAIL", "cargo:1")
+    assert not Installer(steps, str(state)).run()
+    monkeypatch.delenv("YUBICRYPT_SIM_FAIL")
+
+    assert Installer(steps, str(state), restart=True).run()
+    assert statuses(state) == {"libpcsclite-dev": SATISFIED, "age-plugin-yubikey": DONE}
+
+
+def test_steps_sharing_a_lock_never_overlap(tmp_path, sim, monkeypatch):
+    monkeypatch.setenv("YUBICRYPT_SIM_INSTALL_DELAY", "0.3")
+    intervals = {}
+
+    def timed(name, command=None):
+        def action():
+            start = time.monotonic()
+            if command:
+                subprocess.run(command, check=True, capture_output=True)
+            else:
+                time.sleep(0.3)
+            intervals[name] = (start, time.monotonic())
+        return action
+
+    steps = [
+        Step("libpcsclite-dev", timed("libpcsclite-dev", ["apt-get", "install", "libpcsclite-dev"]),
+             lock=PACKAGE_MANAGER_LOCK),
+        Step("pcscd", timed("pcscd", ["apt-get", "install", "pcscd"]), lock=PACKAGE_MANAGER_LOCK),
+        Step("age-plugin-yubikey", timed("age-plugin-yubikey", ["cargo", "install", "age-plugin-yubikey"]),
+             lock=CARGO_LOCK),
+        Step("rustup", timed("rustup"), interactive=True),
+        Step("aliases", timed("aliases"), interactive=True),
+    ]
+
+    def overlap(a, b):
+        return intervals[a][0] < intervals[b][1] and intervals[b][0] < intervals[a][1]
+
+    assert Installer(steps, str(tmp_path / "state.json"), workers=4).run()
+    assert not overlap("libpcsclite-dev", "pcscd")
+    assert not overlap("rustup", "aliases")
+    # Different locks still run at once
+    assert overlap("age-plugin-yubikey", "libpcsclite-dev") or overlap("age-plugin-yubikey", "pcscd")
+    assert sorted(installed_packages(load_config())) == ["cargo:age-plugin-yubikey", "libpcsclite-dev", "pcscd"]
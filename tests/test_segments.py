@@ -0,0 +1,44 @@
+import hashlib
+import io
+import os
+
+import decrypt
+from encrypt import encrypt_large_files
+from engine import select_engine
+from verify import VerifyIndex
+
+SEGMENT_SIZE = 64 << 10
+
+
+def test_segmented_round_trip_and_range(tmp_path, recipients, identity):
+    path = tmp_path / "image.bin"
+    data = os.urandom(5 * SEGMENT_SIZE + 123)
+    path.write_bytes(data)
+    index = VerifyIndex(str(tmp_path / "verify.json"))
+
+    assert encrypt_large_files([str(path)], recipients, SEGMENT_SIZE, 4, verify_index=index) == {str(path): True}
+    segmented = f"{path}.ycs"
+    assert not path.exists()
+    recorded = index.lookup(segmented)
+    assert recorded["plaintext_size"] == len(data)
+    assert recorded["plaintext_sha256"] == hashlib.sha256(data).hexdigest()
+
+    # Across a segment boundary, and the tail
+    for start, end in ((SEGMENT_SIZE - 10, 2 * SEGMENT_SIZE + 10), (-50, None)):
+        out = io.BytesIO()
+        assert decrypt.decrypt_range(segmented, start, end, identity, select_engine(), dst=out, workers=2)
+        assert out.getvalue() == data[start:end]
+
+    assert decrypt.decrypt_large_files([segmented], identity, 4) == {segmented: True}
+    assert path.read_bytes() == data
+    assert not os.path.exists(segmented)
+
+
+def test_existing_segmented_file_is_kept(tmp_path, recipients):
+    path = tmp_path / "image.bin"
+    path.write_bytes(os.urandom(1000))
+    (tmp_path / "image.bin.ycs").write_bytes(b"older")
+
+    assert encrypt_large_files([str(path)], recipients, SEGMENT_SIZE) == {str(path): False}
+    assert (tmp_path / "image.bin.ycs").read_bytes() == b"older"
+    assert path.exists()
@@ -1,43 +1,28 @@
 #!/bin/env python3.14
-import ast
 import os
-import time
 from contextlib import contextmanager
 from typing import Generator, IO, Any
-from datetime import datetime
+from modules.identity_store import IdentityStore
+from modules.instrument import span
 
 @contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
+def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
+    file: IO= open(path, mode)
+    print('Opening file')
     try:
-        yield
+        yield file
+    except Exception as e:
+        print(e)
     finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
-
-
-@contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
-        print('Opening file')
-        try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
+        print('Closing file...')
+        if file:
+            file.close()
 
-def read_identities_file(filename="identities.dict"):
-    """Reads the identities.dict file and parses it into a dictionary."""
+def read_identities(serial=None, filename="identities.db"):
+    """Reads the identities of one YubiKey (or all of them) from the identity store."""
     try:
-        with file_manager(filename, "r") as f:
-            content = f.read()
-            return ast.literal_eval(content)  # Safely parse the dictionary
+        with IdentityStore(filename) as store:
+            return store.slots(serial)
     except Exception as e:
         print(f"Error reading {filename}: {e}")
         return {}
@@ -75,15 +60,18 @@ def save_formatted_identities(identities, output_filename="formatted_identities.
     except Exception as e:
         print(f"Error writing to {output_filename}: {e}")
 
-def main():
-    # Read the identities.dict file
-    identities = read_identities_file("identities.dict")
+def main(serial=None):
+    # Read the identities of this YubiKey from the store
+    with span("identity_read"):
+        identities = read_identities(serial)
     if not identities:
         print("No identities found or failed to read the file.")
-        return
+        return False
 
     # Save the formatted identities to a new file
-    save_formatted_identities(identities, "formatted_identities.txt")
+    with span("identity_format", identities=len(identities)):
+        save_formatted_identities(identities, "formatted_identities.txt")
+    return True
 
 if __name__ == "__main__":
     main()
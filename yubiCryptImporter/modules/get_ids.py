@@ -1,152 +1,116 @@
 #!/bin/env python3.14
-import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 from collections import OrderedDict
-import threading
-import ast
-import os
-import queue
-import time
-from contextlib import contextmanager
-from typing import Generator, IO, Any
-from datetime import datetime
-
-@contextmanager
-def timer() -> Generator[None, Any, None]:
-    start_time: float = time.perf_counter()
-    print(f'Started at: {datetime.now():%H:%M:%S}')
-    try:
-        yield
-    finally:
-        end_time: float = time.perf_counter()
-        print(f'Ended at: {datetime.now():%H:%M:%S}')
-        print(f'Time: {end_time - start_time:.4f}s')
+import re
+from typing import Dict, Optional
+from modules.identity_store import IdentityStore
+from modules.instrument import span
+
+SLOT_TIMEOUT: float = 15.0  # seconds, covers a PIN/touch prompt
+SERIAL_SLOT = re.compile(r"Serial:\s*\d+,\s*Slot:\s*(\d+)")
 
 
-@contextmanager
-def file_manager(path: str, mode: str) -> Generator[IO, Any, None]:
-    with timer():
-        file: IO= open(path, mode)
-        print('Opening file')
+async def run_yubikey_command(slot: int, semaphore: asyncio.Semaphore,
+                              timeout: float = SLOT_TIMEOUT) -> Optional[str]:
+    """Runs age-plugin-yubikey for one slot, killing it on timeout or cancellation."""
+    async with semaphore:
         try:
-            yield file
-        except Exection as e:
-            print(e)
-        finally:
-            print('Closing file...')
-            if file:
-                file.close()
-class ThreadSafeDict:
-    def __init__(self):
-        self._dict = {}
-        self._lock = threading.Lock()
-
-    def __setitem__(self, key, value):
-        with self._lock:
-            self._dict[key] = value
-
-    def __getitem__(self, key):
-        with self._lock:
-            return self._dict[key]
-
-    def items(self):
-        with self._lock:
-            return self._dict.copy().items()
-
-    def keys(self):
-        with self._lock:
-            return self._dict.copy().keys()
-
-    def __bool__(self):
-        with self._lock:
-            return bool(self._dict)
-
-    def to_dict(self):
-        with self._lock:
-            return self._dict.copy()
-
-class ResultPrinter:
-    def __init__(self):
-        self._print_lock = threading.Lock()
-        self._print_queue = queue.Queue()
-        self._print_thread = threading.Thread(target=self._print_worker, daemon=True)
-        self._print_thread.start()
-
-    def print(self, message):
-        self._print_queue.put(message)
-
-    def _print_worker(self):
-        while True:
-            message = self._print_queue.get()
-            with self._print_lock:
-                print(message)
-
-def read_existing_data(filename='identities.dict'):
-    """Read existing data from file if it exists"""
-    if os.path.exists(filename):
+            process = await asyncio.create_subprocess_exec(
+                "age-plugin-yubikey", "--identity", "--slot", str(slot),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            print(f"Error running command for slot {slot}: {e}")
+            return None
         try:
-            with file_manager(filename, 'r') as f:
-                content = f.read()
-                if content:
-                    return ast.literal_eval(content)
-        except (SyntaxError, ValueError) as e:
-            print(f"Error reading existing file: {e}")
-    return {}
-
-def compare_and_merge_data(new_data, existing_data):
-    """Compare and merge new data with existing data"""
-    merged_data = existing_data.copy()
-    changes = False
-
-    for slot, identity in new_data.items():
-        if slot not in existing_data or existing_data[slot] != identity:
-            merged_data[slot] = identity
-            changes = True
-
-    return merged_data, changes
-
-def save_data(data, filename='identities.dict'):
-    """Save data to file"""
-    with file_manager(filename, 'w') as f:
-        f.write(str(dict(data)))
-
-def run_yubikey_command(slot):
-    command = f"age-plugin-yubikey --identity --slot {slot}"
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
-        return None
-    except Exception as e:
-        print(f"Error running command for slot {slot}: {e}")
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Slot {slot} timed out after {timeout:.0f}s")
+            return None
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        output = stdout.decode().strip()
+        if process.returncode == 0 and output:
+            return output
         return None
 
-def worker(slot: int, shared_dict: ThreadSafeDict, printer: ResultPrinter) -> None:
-    printer.print(f"Checking slot {slot}...")
-    result = run_yubikey_command(slot)
-
-    if result:
-        shared_dict[slot] = result
-        printer.print(f"Found valid slot {slot}: {result}")
 
-def process_slots_threaded(slot_range, max_workers=8):
-    shared_dict = ThreadSafeDict()
-    printer = ResultPrinter()
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for slot in slot_range:
-            future = executor.submit(worker, slot, shared_dict, printer)
-            futures.append(future)
+async def scan_slots(slot_range, max_concurrency: int = 8, timeout: float = SLOT_TIMEOUT) -> Dict[int, str]:
+    """Probes all slots concurrently and reports them in slot order as they complete."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.create_task(run_yubikey_command(slot, semaphore, timeout)) for slot in slot_range]
+    results = {}
+    try:
+        for slot, task in zip(slot_range, tasks):
+            print(f"Checking slot {slot}...")
+            identity = await task
+            if identity:
+                results[slot] = identity
+                print(f"Found valid slot {slot}: {identity}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+
+def parse_identities(output: str) -> Dict[int, str]:
+    """Splits the output of `age-plugin-yubikey --identity` into one block per slot."""
+    identities = {}
+    block, slot = [], None
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        match = SERIAL_SLOT.search(line)
+        if match and block:
+            block, slot = [], None
+        if match:
+            slot = int(match.group(1))
+        block.append(line.strip())
+        if line.startswith("AGE-PLUGIN-YUBIKEY-") and slot is not None:
+            identities[slot] = "\n".join(block)
+            block, slot = [], None
+    return identities
+
+
+async def list_identities(timeout: float = SLOT_TIMEOUT) -> Optional[Dict[int, str]]:
+    """Reads every identity in one plugin call, None if the plugin cannot list them."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "age-plugin-yubikey", "--identity",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        print(f"Error listing identities: {e}")
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        print(f"Listing identities timed out after {timeout:.0f}s")
+        return None
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        return None
+    output = stdout.decode()
+    identities = parse_identities(output)
+    if output.strip() and not identities:
+        # Unknown output format, let the per-slot scan deal with it
+        return None
+    return identities
 
-        # Wait for all futures to complete
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                printer.print(f"Error in thread: {e}")
 
-    return shared_dict.to_dict()
+def process_slots(slot_range, max_concurrency: int = 8, timeout: float = SLOT_TIMEOUT) -> Dict[int, str]:
+    """Enumerates occupied slots in one call, probing slot by slot only as a fallback."""
+    identities = asyncio.run(list_identities(timeout))
+    if identities is not None:
+        for slot, identity in sorted(identities.items()):
+            print(f"Found valid slot {slot}: {identity}")
+        return {slot: identity for slot, identity in identities.items() if slot in slot_range}
+    print("Falling back to probing every slot...")
+    return asyncio.run(scan_slots(slot_range, max_concurrency, timeout))
 
 def print_sorted_results(results_dict):
     if results_dict:
@@ -159,29 +123,31 @@ def print_sorted_results(results_dict):
         print("No valid slots found.")
 
 def main():
-    # Read existing data
-    existing_data = read_existing_data()
     print("Checking slots...")
 
-    # Process slots with threads
+    # Probe slots concurrently
     slot_range = range(22)  # 0-21
-    results = process_slots_threaded(slot_range)
+    with span("slot_scan", slots=len(slot_range)):
+        results = process_slots(slot_range)
 
     # Final results sorted by slot number
     print("\nFinal Results:")
     print_sorted_results(results)
 
-    # Compare and merge with existing data
-    merged_data, changes = compare_and_merge_data(results, existing_data)
+    # Upsert only the slots that changed
+    with span("identity_store"), IdentityStore() as store:
+        changes = store.upsert_many(results)
 
     if changes:
-        print("\nNew changes detected. Updating file...")
-        save_data(merged_data)
+        print(f"\n{changes} new or changed slots saved to identities.db.")
     else:
-        print("\nNo new changes detected. File remains unchanged.")
+        print("\nNo new changes detected. Store remains unchanged.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nOperation cancelled by user")
 
 # Created/Modified files during execution:
-# identities.dict (only if changes are detected)
+# identities.db (rows are only written for new or changed slots)
@@ -0,0 +1,121 @@
+#!/bin/env python3
+import ast
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+SCHEMA_VERSION = 1
+SERIAL_SLOT = re.compile(r"Serial:\s*(\d+),\s*Slot:\s*(\d+)")
+RECIPIENT = re.compile(r"Recipient:\s*(\S+)")
+
+
+def parse_identity(data: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """Extracts (serial, slot, recipient) from an age-plugin-yubikey identity block."""
+    serial = slot = recipient = None
+    match = SERIAL_SLOT.search(data)
+    if match:
+        serial, slot = match.group(1), int(match.group(2))
+    match = RECIPIENT.search(data)
+    if match:
+        recipient = match.group(1)
+    return serial, slot, recipient
+
+
+class IdentityStore:
+    """
+    SQLite backed store of YubiKey identities, one row per (serial, slot).
+    Replaces the str(dict) identities.dict file, which is migrated on first use.
+    """
+
+    def __init__(self, path: str = "identities.db", legacy_path: str = "identities.dict") -> None:
+        new = not os.path.exists(path)
+        self.db = sqlite3.connect(path)
+        if new:
+            os.chmod(path, 0o600)
+        self._create_schema()
+        if new and os.path.exists(legacy_path):
+            self.migrate_legacy(legacy_path)
+
+    def _create_schema(self) -> None:
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"identities store has schema {version}, this version knows {SCHEMA_VERSION}")
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS identities (
+                    serial TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    identity TEXT NOT NULL,
+                    recipient TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (serial, slot)
+                )""")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def migrate_legacy(self, legacy_path: str) -> int:
+        """Imports an old identities.dict file, returns the number of rows written."""
+        try:
+            with open(legacy_path, "r") as f:
+                content = f.read()
+            legacy = ast.literal_eval(content) if content.strip() else {}
+        except (OSError, SyntaxError, ValueError) as e:
+            print(f"Error migrating {legacy_path}: {e}")
+            return 0
+        changed = self.upsert_many(legacy)
+        print(f"Migrated {changed} identities from {legacy_path}")
+        return changed
+
+    def upsert(self, slot: int, identity: str, serial: Optional[str] = None) -> bool:
+        """Inserts or updates one slot, returns True if anything changed."""
+        with self.db:
+            return self._upsert(slot, identity, serial)
+
+    def upsert_many(self, identities: Dict[int, str], serial: Optional[str] = None) -> int:
+        """Like upsert for every slot, in a single transaction."""
+        with self.db:
+            return sum(self._upsert(slot, identity, serial) for slot, identity in identities.items())
+
+    def _upsert(self, slot: int, identity: str, serial: Optional[str]) -> bool:
+        parsed_serial, parsed_slot, recipient = parse_identity(identity)
+        serial = serial or parsed_serial or ""
+        slot = parsed_slot if parsed_slot is not None else int(slot)
+        now = datetime.now().isoformat(timespec="seconds")
+        cursor = self.db.execute("""
+            INSERT INTO identities (serial, slot, identity, recipient, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (serial, slot) DO UPDATE SET
+                identity = excluded.identity,
+                recipient = excluded.recipient,
+                updated_at = excluded.updated_at
+            WHERE identities.identity != excluded.identity""",
+            (serial, slot, identity, recipient, now, now))
+        return cursor.rowcount > 0
+
+    def get(self, serial: str, slot: int) -> Optional[str]:
+        row = self.db.execute("SELECT identity FROM identities WHERE serial = ? AND slot = ?",
+                              (serial, slot)).fetchone()
+        return row[0] if row else None
+
+    def slots(self, serial: Optional[str] = None) -> Dict[int, str]:
+        """Identities by slot, for one YubiKey or for all of them."""
+        if serial is None:
+            rows = self.db.execute("SELECT slot, identity FROM identities ORDER BY serial, slot")
+        else:
+            rows = self.db.execute("SELECT slot, identity FROM identities WHERE serial = ? ORDER BY slot",
+                                   (serial,))
+        return dict(rows.fetchall())
+
+    def serials(self) -> Iterable[str]:
+        return [row[0] for row in self.db.execute("SELECT DISTINCT serial FROM identities ORDER BY serial")]
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "IdentityStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1 @@
+../../src/instrument.py
\ No newline at end of file
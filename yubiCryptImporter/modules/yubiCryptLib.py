@@ -1,6 +1,11 @@
+import filecmp
+import os
+import shutil
 import subprocess
 import sys
 
+KEYS_DIR = os.path.expanduser("~/.yubiCrypt/keys")
+
 def get_yubikey_serial():
     try:
         # Run ykman info command and capture output
@@ -26,6 +31,23 @@ def get_yubikey_serial():
         print(f"Error: {str(e)}")
         sys.exit(1)
 
+def identity_file_for(serial: str) -> str:
+    """Path of the identity file holding every slot of one YubiKey."""
+    return os.path.join(KEYS_DIR, f"yubikey-{serial}.txt")
+
+def store_identities(serial: str, source: str = "formatted_identities.txt") -> str:
+    """Stores the formatted identities of one YubiKey next to those of the other keys."""
+    os.makedirs(KEYS_DIR, mode=0o700, exist_ok=True)
+    target = identity_file_for(serial)
+    if os.path.exists(target) and filecmp.cmp(source, target, shallow=False):
+        # Keep the mtime so the key cache of yubienCrypt stays valid
+        print(f"Identities of YubiKey {serial} unchanged in {target}")
+        return target
+    shutil.copyfile(source, target)
+    os.chmod(target, 0o600)
+    print(f"Identities of YubiKey {serial} stored in {target}")
+    return target
+
 if __name__ == "__main__":
     try:
         serial = get_yubikey_serial()